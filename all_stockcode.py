@@ -1,27 +1,13 @@
 import baostock as bs
 import pandas as pd
-import pymysql
 from datetime import datetime
-from config import DB_CONFIG
+from rate_control import get_default_controller
+from trade_calendar import get_trade_calendar, refresh_trade_calendar
+from db_pool import get_connection
 
-def get_db_connection():
-    return pymysql.connect(
-        host=DB_CONFIG['host'],
-        port=DB_CONFIG['port'],
-        user=DB_CONFIG['user'],
-        password=DB_CONFIG['password'],
-        database=DB_CONFIG['database']
-    )
-
-def create_table():
-    conn = get_db_connection()
+def create_table(conn):
+    # 不再DROP，刷新期间下游任务始终能读到完整的旧列表
     cursor = conn.cursor()
-    
-    # Drop table if exists and create new one
-    drop_table_sql = "DROP TABLE IF EXISTS stock_codes"
-    cursor.execute(drop_table_sql)
-    
-    # Create table if not exists
     create_table_sql = """
     CREATE TABLE IF NOT EXISTS stock_codes (
         code VARCHAR(20) PRIMARY KEY,
@@ -34,43 +20,108 @@ def create_table():
     cursor.execute(create_table_sql)
     conn.commit()
     cursor.close()
-    conn.close()
 
-#### 登陆系统 ####
-lg = bs.login()
-# 显示登陆返回信息
-print('login respond error_code:'+lg.error_code)
-print('login respond  error_msg:'+lg.error_msg)
+DELISTED_STATUS = 'delisted'
 
-#### 获取证券信息 ####
-rs = bs.query_all_stock(day="2017-06-30")
-print('query_all_stock respond error_code:'+rs.error_code)
-print('query_all_stock respond  error_msg:'+rs.error_msg)
+UPSERT_STOCK_CODE_SQL = """
+INSERT INTO stock_codes (code, code_name, industry, trade_status, update_time)
+VALUES (%s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+    code_name = VALUES(code_name), industry = VALUES(industry),
+    trade_status = VALUES(trade_status), update_time = VALUES(update_time)
+"""
 
-#### 获取数据并存入MySQL ####
-data_list = []
-while (rs.error_code == '0') & rs.next():
-    data_list.append(rs.get_row_data())
-result = pd.DataFrame(data_list, columns=rs.fields)
+def _query(fn, **kwargs):
+    """限速调用baostock查询并返回DataFrame，调用方需已登录"""
+    rs = get_default_controller().call(fn, **kwargs)
+    data_list = []
+    while (rs.error_code == '0') & rs.next():
+        data_list.append(rs.get_row_data())
+    return pd.DataFrame(data_list, columns=rs.fields)
 
-# Create table
-create_table()
+def fetch_stock_list(day):
+    """day当天的全部证券列表，附带行业；当天数据还没发布时返回空DataFrame"""
+    listing = _query(bs.query_all_stock, day=day.strftime('%Y-%m-%d'))
+    if listing.empty:
+        return listing
+    industry = _query(bs.query_stock_industry)
+    industry_map = dict(zip(industry['code'], industry['industry'])) if not industry.empty else {}
+    listing['industry'] = listing['code'].map(industry_map).fillna('')
+    return listing
 
-# Insert data into MySQL
-conn = get_db_connection()
-cursor = conn.cursor()
+def diff_stock_codes(current, listing):
+    """对比表中现有记录和最新列表
+
+    current为{code: (code_name, industry, trade_status)}，listing为fetch_stock_list的结果。
+    返回(新增或变化的行, 退市代码)。不在最新列表里的代码视为退市。
+    """
+    listed = {}
+    for code, name, industry, status in zip(listing['code'], listing['code_name'],
+                                            listing['industry'], listing['tradeStatus']):
+        listed[code] = (name, industry, status)
+    changed = [(code, *row) for code, row in listed.items() if current.get(code) != row]
+    delisted = [code for code, (_, _, status) in current.items()
+                if code not in listed and status != DELISTED_STATUS]
+    return changed, delisted
+
+def refresh_stock_codes(day=None):
+    """用day（默认今天）之前最近一个交易日的证券列表增量刷新stock_codes，返回变更统计
+
+    新增、名称/行业/状态变化和退市在同一个事务中提交，
+    刷新过程中get_stock_codes()读到的始终是旧的完整列表。
+    """
+    lg = bs.login()
+    if lg.error_code != '0':
+        raise RuntimeError(f"Baostock login failed: {lg.error_msg}")
+    try:
+        today = day or datetime.now().date()
+        calendar = get_trade_calendar()
+        if calendar is None or calendar.covered_until < today:
+            calendar = refresh_trade_calendar(today)
+        # 当天的列表收盘后才发布，取不到时退回前一个交易日
+        listing = pd.DataFrame()
+        for trade_day in reversed(calendar.previous_trading_days(2, today)):
+            listing = fetch_stock_list(trade_day)
+            if not listing.empty:
+                break
+    finally:
+        bs.logout()
+    if listing.empty:
+        raise RuntimeError(f"query_all_stock returned no securities up to {today}, stock_codes left unchanged")
 
-# Insert new data
-current_time = datetime.now()
-for _, row in result.iterrows():
-    sql = "INSERT INTO stock_codes (code, code_name, industry, trade_status, update_time) VALUES (%s, %s, %s, %s, %s)"
-    cursor.execute(sql, (row['code'], row['code_name'], '', row['tradeStatus'], current_time))
+    conn = get_connection()
+    try:
+        create_table(conn)
+        cursor = conn.cursor()
+        cursor.execute("SELECT code, code_name, industry, trade_status FROM stock_codes")
+        current = {code: (name, industry or '', status) for code, name, industry, status in cursor.fetchall()}
+        changed, delisted = diff_stock_codes(current, listing)
 
-conn.commit()
-cursor.close()
-conn.close()
+        now = datetime.now()
+        try:
+            if changed:
+                cursor.executemany(UPSERT_STOCK_CODE_SQL, [row + (now,) for row in changed])
+            if delisted:
+                cursor.executemany("UPDATE stock_codes SET trade_status = %s, update_time = %s WHERE code = %s",
+                                   [(DELISTED_STATUS, now, code) for code in delisted])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        cursor.close()
+    finally:
+        conn.close()
 
-print(f"Successfully stored {len(result)} stock codes in MySQL database")
+    inserted = sum(1 for row in changed if row[0] not in current)
+    return {
+        'trade_date': str(trade_day),
+        'listed': len(listing),
+        'inserted': inserted,
+        'updated': len(changed) - inserted,
+        'delisted': len(delisted),
+    }
 
-#### 登出系统 ####
-bs.logout()
\ No newline at end of file
+if __name__ == "__main__":
+    stats = refresh_stock_codes()
+    print(f"Refreshed stock codes for {stats['trade_date']}: {stats['listed']} listed, "
+          f"{stats['inserted']} inserted, {stats['updated']} updated, {stats['delisted']} delisted")
@@ -0,0 +1,117 @@
+"""用fake_baostock的合成行情离线压测K线获取和入库
+
+    python bench_ingest.py --stocks 500 --latency 0.05 --workers 4
+    python bench_ingest.py --stocks 200 --db daily   # 需要MySQL，会改写stock_codes和stock_kline
+
+fetch模式不访问数据库，对比逐个顺序获取和多进程并发获取的吞吐。
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+import fake_baostock
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline ingestion benchmark against a synthetic baostock")
+    parser.add_argument('--stocks', type=int, default=500, help="size of the synthetic market")
+    parser.add_argument('--seed', type=int, default=20241203)
+    parser.add_argument('--latency', type=float, default=0.02, help="seconds added to every query")
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--max-rate', type=float, default=None, help="queries/s allowed per session")
+    parser.add_argument('--days', type=int, default=365, help="history length per stock in fetch mode")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--cache', action='store_true', help="read settled months from the local kline cache")
+    parser.add_argument('--db', choices=['main', 'daily'], default=None,
+                        help="run k_stockinfo.main or daily_update.update_daily_kline against MySQL")
+    return parser.parse_args()
+
+def report(name, codes, rows, errors, seconds, controller):
+    print(f"{name:<12} codes={codes:<6} rows={rows:<9} errors={errors:<4} "
+          f"{seconds:7.1f}s  {codes / seconds:7.1f} codes/s  {rows / seconds:9.0f} rows/s  "
+          f"calls={controller.calls} final_rate={controller.rate:.2f}/s")
+
+def bench_fetch(args):
+    from k_stockinfo import get_k_data
+    from kline_fetcher import fetch_k_data_parallel
+    from rate_control import AIMDRateController
+
+    codes = fake_baostock._market_instance().codes
+    end_date = datetime.now().strftime('%Y-%m-%d')
+    start_date = (datetime.now() - timedelta(days=args.days)).strftime('%Y-%m-%d')
+    tasks = [(code, start_date, end_date) for code in codes]
+
+    controller = AIMDRateController()
+    fake_baostock.login()
+    started = time.monotonic()
+    rows = errors = 0
+    for code, start, end in tasks:
+        try:
+            rows += len(get_k_data(code, start, end, controller=controller, use_cache=args.cache))
+        except Exception:
+            errors += 1
+    fake_baostock.logout()
+    report('sequential', len(tasks), rows, errors, time.monotonic() - started, controller)
+
+    controller = AIMDRateController()
+    started = time.monotonic()
+    rows = errors = 0
+    for code, k_data, error in fetch_k_data_parallel(tasks, workers=args.workers, controller=controller,
+                                                     use_cache=args.cache):
+        if error is not None:
+            errors += 1
+        else:
+            rows += len(k_data)
+    report('parallel', len(tasks), rows, errors, time.monotonic() - started, controller)
+
+def seed_stock_codes():
+    """用合成市场的股票列表覆盖stock_codes"""
+    from db_pool import get_connection
+
+    market = fake_baostock._market_instance()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stock_codes (
+                code VARCHAR(20) PRIMARY KEY,
+                code_name VARCHAR(100),
+                industry VARCHAR(100),
+                trade_status VARCHAR(20),
+                update_time DATETIME
+            )
+        """)
+        cursor.execute("DELETE FROM stock_codes")
+        now = datetime.now()
+        cursor.executemany(
+            "INSERT INTO stock_codes (code, code_name, industry, trade_status, update_time) VALUES (%s, %s, %s, %s, %s)",
+            [(code, market.names[code], '', '1', now) for code in market.codes])
+        conn.commit()
+        cursor.close()
+
+def bench_db(args):
+    from rate_control import get_default_controller
+
+    seed_stock_codes()
+    started = time.monotonic()
+    if args.db == 'main':
+        import k_stockinfo
+        k_stockinfo.main()
+    else:
+        import daily_update
+        summary = daily_update.update_daily_kline()
+        print({k: v for k, v in summary.items() if k not in ('baostock_rate', 'failed_codes')})
+    controller = get_default_controller()
+    print(f"{args.db}: {time.monotonic() - started:.1f}s, calls={controller.calls}, "
+          f"errors={controller.errors}, final_rate={controller.rate:.2f}/s")
+
+def main():
+    args = parse_args()
+    # 必须在导入项目模块之前替换baostock
+    fake_baostock.install(n_stocks=args.stocks, seed=args.seed, latency=args.latency, jitter=args.jitter,
+                          error_rate=args.error_rate, max_rate=args.max_rate)
+    if args.db:
+        bench_db(args)
+    else:
+        bench_fetch(args)
+
+if __name__ == "__main__":
+    main()
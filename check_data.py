@@ -1,16 +1,10 @@
-import pymysql
 from datetime import datetime, timedelta
-from config import DB_CONFIG
+from kline_ledger import get_ledger_entry
+from db_pool import get_connection
 
 def check_latest_data():
     # Connect to database
-    conn = pymysql.connect(
-        host=DB_CONFIG['host'],
-        port=DB_CONFIG['port'],
-        user=DB_CONFIG['user'],
-        password=DB_CONFIG['password'],
-        database=DB_CONFIG['database']
-    )
+    conn = get_connection()
     
     try:
         cursor = conn.cursor()
@@ -18,39 +12,33 @@ def check_latest_data():
         # Get yesterday's date
         yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
         
-        # Query to check data for yesterday
-        query = f"""
-        SELECT COUNT(*) as count, 
-               MIN(code) as sample_code,
-               MAX(update_time) as last_update
-        FROM stock_kline 
-        WHERE date = '{yesterday}'
-        """
+        # Per-date totals come from the ingestion ledger, a single primary-key lookup
+        entry = get_ledger_entry(conn, yesterday)
+        count = entry['codes_covered'] if entry else 0
+        last_update = entry['last_update'] if entry else None
         
-        cursor.execute(query)
-        result = cursor.fetchone()
+        print(f"数据统计 (日期: {yesterday}):")
+        print(f"- 总记录数: {count}")
+        print(f"- 最后更新时间: {last_update}")
+        if entry:
+            print(f"- 失败股票数: {entry['error_count']}")
         
-        if result:
-            count, sample_code, last_update = result
-            print(f"数据统计 (日期: {yesterday}):")
-            print(f"- 总记录数: {count}")
-            print(f"- 样本股票代码: {sample_code}")
-            print(f"- 最后更新时间: {last_update}")
+        if count > 0:
+            # Sample a few codes through the (code, date) index instead of scanning by date
+            sample_query = """
+            SELECT code, date, open, close, volume
+            FROM stock_kline
+            WHERE code IN (SELECT code FROM (
+                SELECT code FROM stock_codes WHERE trade_status = '1' ORDER BY code LIMIT 20
+            ) c) AND date = %s
+            LIMIT 5
+            """
+            cursor.execute(sample_query, (yesterday,))
+            samples = cursor.fetchall()
             
-            if count > 0:
-                # Get some sample data
-                sample_query = f"""
-                SELECT code, date, open, close, volume
-                FROM stock_kline
-                WHERE date = '{yesterday}'
-                LIMIT 5
-                """
-                cursor.execute(sample_query)
-                samples = cursor.fetchall()
-                
-                print("\n前5条记录示例:")
-                for sample in samples:
-                    print(f"股票: {sample[0]}, 开盘: {sample[2]}, 收盘: {sample[3]}, 成交量: {sample[4]}")
+            print("\n前5条记录示例:")
+            for sample in samples:
+                print(f"股票: {sample[0]}, 开盘: {sample[2]}, 收盘: {sample[3]}, 成交量: {sample[4]}")
         
     finally:
         conn.close()
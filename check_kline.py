@@ -1,53 +1,38 @@
-import pymysql
 from datetime import datetime
-from config import DB_CONFIG
+from kline_ledger import get_ledger_entry, get_recent_ledger, count_active_codes
+from db_pool import get_connection
 import logging
 
 logging.basicConfig(level=logging.INFO)
 
 def check_today_kline():
-    """检查今天的K线数据"""
-    conn = pymysql.connect(**DB_CONFIG)
-    cursor = conn.cursor()
+    """检查今天的K线数据（读取按日入库台账，不扫描stock_kline）"""
+    conn = get_connection()
     
     try:
         today = datetime.now().strftime('%Y-%m-%d')
+        active = count_active_codes(conn)
         
         # 检查今天的数据量
-        sql = """
-        SELECT DATE(date) as trade_date, COUNT(*) as count 
-        FROM stock_kline 
-        WHERE DATE(date) = %s 
-        GROUP BY DATE(date)
-        """
-        cursor.execute(sql, (today,))
-        result = cursor.fetchone()
-        
-        if result:
-            logging.info(f"今天（{today}）的K线数据数量: {result[1]}条")
+        entry = get_ledger_entry(conn, today)
+        if entry and entry['codes_covered']:
+            logging.info(f"今天（{today}）的K线数据数量: {entry['codes_covered']}条"
+                         f"（正常交易股票 {active} 只，获取失败 {entry['error_count']} 只）")
         else:
             logging.warning(f"今天（{today}）还没有K线数据")
             
         # 检查最新的数据日期
-        sql = """
-        SELECT DATE(date) as latest_date, COUNT(*) as count 
-        FROM stock_kline 
-        GROUP BY DATE(date) 
-        ORDER BY DATE(date) DESC 
-        LIMIT 1
-        """
-        cursor.execute(sql)
-        result = cursor.fetchone()
-        
-        if result:
-            logging.info(f"最新的K线数据日期是: {result[0]}，数据量: {result[1]}条")
+        latest = get_recent_ledger(conn, limit=1)
+        if latest:
+            entry = latest[0]
+            logging.info(f"最新的K线数据日期是: {entry['trade_date']}，数据量: {entry['codes_covered']}条，"
+                         f"最后更新时间: {entry['last_update']}")
         else:
-            logging.warning("数据库中没有K线数据")
+            logging.warning("数据库中没有K线数据（台账为空时可运行 python kline_ledger.py --rebuild）")
             
     except Exception as e:
         logging.error(f"检查数据时出错: {str(e)}")
     finally:
-        cursor.close()
         conn.close()
 
 if __name__ == "__main__":
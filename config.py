@@ -9,5 +9,105 @@ DB_CONFIG = {
 
 # Other configurations can be added here
 BAOSTOCK_CONFIG = {
-    'delay_seconds': 0.5  # Delay between API calls
+    'workers': 4,  # Parallel fetch processes, each with its own login session
+    'burst': 8,  # Token bucket capacity
+    # Adaptive (AIMD) request rate shared by all fetch workers, in requests per second
+    'initial_rate': 4.0,
+    'min_rate': 0.5,
+    'max_rate': 20.0,  # Provider request ceiling
+    'rate_increase': 0.5,  # Added roughly every second while calls succeed
+    'rate_decrease_factor': 0.5,  # Applied on errors, timeouts and slow calls
+    'slow_call_seconds': 5.0,  # Calls slower than this count as congestion
+    'rate_history_size': 1000,
+    'rate_history_path': 'data/baostock_rate.json'  # Exported rate and history
+}
+
+INGEST_CONFIG = {
+    'insert_batch_rows': 5000,  # Rows per multi-row INSERT batch
+    'flush_rows': 20000,  # Pipeline writer flushes after this many buffered rows...
+    'flush_seconds': 5,  # ...or after this many seconds, whichever comes first
+    'queue_size': 64,  # Bound of each pipeline queue (in stocks), keeps memory flat
+    'initial_days': 365,  # History fetched for codes with no rows in stock_kline yet
+    'suspended_recheck_days': 5,  # Trading days before a suspended code (tradestatus 0) is fetched again
+    'journal_path': 'data/ingest_journal.sqlite3',  # Resumable run journal
+    'summary_path': 'data/ingest_summary.json',  # Machine-readable summary of the last run
+    'max_retries': 3,  # Retry rounds for failed codes at the end of a run
+    'retry_backoff_seconds': 10,  # First retry delay, doubled each round
+    'stage_dir': 'data/initial_load',  # CSV staging files for the bulk initial load
+    'stage_file_rows': 1000000,  # Rows per staging file (one LOAD DATA statement each)
+    'ledger_lookup_keys': 500  # (code, date) keys per row-constructor IN lookup when counting new ledger rows
+}
+
+CALENDAR_CONFIG = {
+    'path': 'data/trade_calendar.csv',  # Local trading calendar cache
+    'start_date': '2010-01-01'  # First date fetched when the cache is built
+}
+
+CACHE_CONFIG = {
+    'dir': 'data/kline_cache',  # On-disk cache of settled baostock history, one file per code-month
+    'max_bytes': 2 * 1024 ** 3,  # Least recently used files are evicted above this size
+    'settle_days': 1  # A month is cached only once its last day is at least this many days old
+}
+
+SCHEMA_CONFIG = {
+    'migrate_chunk_rows': 50000,  # Legacy stock_kline id range copied per transaction
+    'migrate_sleep_seconds': 0.05,  # Pause between chunks to leave room for other queries
+    'migrate_state_path': 'data/kline_migration.json',  # Copy progress, lets an interrupted migration resume
+    'first_partition_year': 2010  # Earliest yearly partition of stock_kline_compact
+}
+
+INTEGRITY_CONFIG = {
+    'code_batch': 100,  # Codes per ranged (code, date) index query and vectorized check
+    'delete_batch_rows': 1000,  # Duplicate rows deleted per short transaction during repair
+    'delete_sleep_seconds': 0.05,  # Pause between delete batches
+    'sample_size': 20,  # Examples kept per issue type in the report
+    'report_path': 'data/kline_integrity.json'
+}
+
+PANEL_CONFIG = {
+    'dir': 'data/market_panel',  # Memory-mapped [code, trading day] arrays, one .npy file per field
+    'start_date': '2015-01-01',  # First trading day on the panel's day axis
+    'code_capacity': 6000,  # Initial rows reserved for codes, doubled when exceeded
+    'spare_days': 500,  # Extra trading-day columns reserved beyond the calendar when (re)allocating
+    'code_batch': 500  # Codes per ranged MySQL query when loading bars into the panel
+}
+
+PARQUET_CONFIG = {
+    'dir': 'data/kline_parquet',  # Hive-partitioned mirror of stock_kline: year=YYYY/month=MM/part.parquet
+    'row_group_rows': 50000,  # Rows per row group; files are sorted by code so groups prune on code ranges
+    'code_batch': 500  # Codes per ranged MySQL query when exporting
+}
+
+LOADER_CONFIG = {
+    'fetch_rows': 20000,  # Rows per fetchmany from the unbuffered cursor in kline_loader
+    'initial_rows': 4096  # Preallocated rows when the caller gives no size hint, doubled as needed
+}
+
+POOL_CONFIG = {
+    'max_size': 16,  # Connections open at once per pool; further checkouts wait for a return
+    'wait_timeout': 30,  # Seconds a checkout waits for a free connection before PoolTimeout
+    'ping_after_seconds': 60,  # Idle connections older than this are pinged before reuse
+    'max_idle': 8  # Returned connections kept open for reuse; the rest are closed
+}
+
+SCREEN_CONFIG = {
+    'code_batch': 500,  # Codes per ranged MySQL query when screen_rules loads a window for all codes
+    'workers': 1,  # Screening processes over the shared-memory window; 1 evaluates in-process
+    'slice_rows': 256  # Codes per task handed to a screening process
+}
+
+STATE_CONFIG = {
+    'dir': 'data/screen_state',  # Per-code ring buffers and running window sums for incremental screening
+    'resync_every': 20,  # Trading days of incremental updates before the running sums are recomputed from the rings
+    'rebuild_lookback_factor': 3  # A rebuild replays this many ring lengths of panel days (covers suspensions)
+}
+
+SPIKE_CONFIG = {
+    'code_batch': 500,  # Codes per ranged MySQL query in volume_analysis
+    'history_margin': 20  # Extra bars read before the lookback window of an incremental run (covers suspensions)
+}
+
+HISTORY_CONFIG = {
+    'code_batch': 200,  # Codes per batch in screen_history; each batch holds its full [code, bar] history in memory
+    'horizons': (5, 10, 20)  # Forward-return holding periods, in bars after the signal day
 }
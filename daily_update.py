@@ -1,9 +1,19 @@
 import baostock as bs
 import pandas as pd
-from datetime import datetime, timedelta
+import json
 import time
-from k_stockinfo import get_db_connection, get_stock_codes, get_k_data, insert_k_data
-from config import BAOSTOCK_CONFIG
+from datetime import datetime, timedelta
+from db_pool import get_connection
+from k_stockinfo import get_stock_codes, get_kline_watermarks, ensure_kline_unique_key
+from ingest_pipeline import run_ingest_pipeline
+from trade_calendar import get_trade_calendar, refresh_trade_calendar
+from ingest_journal import IngestJournal
+from kline_ledger import record_errors
+from market_panel import update_market_panel
+from kline_parquet import sync_parquet
+from screen_state import update_screen_state
+from rate_control import get_default_controller
+from config import INGEST_CONFIG
 import logging
 
 # Configure logging
@@ -13,48 +23,169 @@ logging.basicConfig(
     filename='daily_update.log'
 )
 
+def load_calendar(today):
+    """Local trading calendar covering today, refreshed from baostock only when it falls short"""
+    calendar = get_trade_calendar()
+    if calendar is None or calendar.covered_until < today:
+        bs.login()
+        try:
+            calendar = refresh_trade_calendar(today)
+        finally:
+            bs.logout()
+    return calendar
+
+def build_sync_tasks(stock_codes, watermarks, end_date, calendar):
+    """Build (code, start, end) tasks from each code's high watermark
+
+    Codes already holding end_date are skipped, codes with no rows get
+    INGEST_CONFIG['initial_days'] of history, the rest resume at the next
+    trading day after their last bar. Codes whose last bar was suspended
+    (tradestatus 0) are only rechecked every INGEST_CONFIG['suspended_recheck_days']
+    trading days. Returns (tasks, suspended_skipped).
+    """
+    initial_start = end_date - timedelta(days=INGEST_CONFIG['initial_days'])
+    end_str = end_date.strftime('%Y-%m-%d')
+    tasks = []
+    suspended_skipped = 0
+    for code in stock_codes:
+        if code not in watermarks:
+            tasks.append((code, initial_start.strftime('%Y-%m-%d'), end_str))
+            continue
+        last_date, tradestatus = watermarks[code]
+        if last_date >= end_date:
+            continue
+        if tradestatus == 0 and calendar.count_trading_days(last_date, end_date) < INGEST_CONFIG['suspended_recheck_days']:
+            suspended_skipped += 1
+            continue
+        start_date = calendar.next_trading_day(last_date)
+        tasks.append((code, start_date.strftime('%Y-%m-%d'), end_str))
+    return tasks, suspended_skipped
+
+def _ingest(tasks, conn, journal, run_id, summary):
+    """Stream tasks through the fetch -> parse -> write pipeline, journaling codes once committed
+
+    Returns the tasks whose fetch, parse or write failed.
+    """
+    task_by_code = {task[0]: task for task in tasks}
+    failed = []
+
+    def on_committed(results):
+        journal.mark_done(run_id, results)
+        summary['rows_written'] += sum(rows for _, rows in results)
+
+    def on_failed(code, error):
+        logging.error(f"Error processing stock {code}: {str(error)}")
+        journal.mark_failed(run_id, code, error)
+        failed.append(task_by_code[code])
+
+    def on_empty(code):
+        logging.warning(f"No new data available for {code}")
+        summary['empty'] += 1
+
+    stats = run_ingest_pipeline(tasks, conn, on_committed, on_failed, on_empty)
+    logging.info(f"Pipeline wrote {stats['rows_written']} rows in {stats['batches']} batches, "
+                 f"{stats['seconds']:.1f}s total, {stats['write_seconds']:.1f}s in MySQL")
+    return failed
+
 def update_daily_kline():
+    """Run an incremental update and return its summary dict
+
+    Completed codes are journaled locally, so a restarted run for the same
+    target date resumes where it stopped. Failed codes are retried with
+    exponential backoff at the end of the run.
+    """
+    started = time.time()
+    summary = None
     try:
-        # Login to baostock
-        bs.login()
-        
-        # Get yesterday's date
-        today = datetime.now()
-        yesterday = (today - timedelta(days=1)).strftime('%Y-%m-%d')
+        # Sync every code from its own last stored date up to the latest trading day
+        today = datetime.now().date()
+        calendar = load_calendar(today)
+        end_date = calendar.latest_trading_day(today)
         
-        logging.info(f"Starting daily update for date: {yesterday}")
+        journal = IngestJournal()
+        run_id, resumed = journal.start_run('daily_kline', end_date)
+        logging.info(f"{'Resuming' if resumed else 'Starting'} incremental update run {run_id} up to date: {end_date}")
+        if not calendar.is_trading_day(today):
+            logging.info(f"{today} is not a trading day, only codes behind {end_date} will be fetched")
         
         # Get all stock codes
         stock_codes = get_stock_codes()
-        total_stocks = len(stock_codes)
         
-        for idx, code in enumerate(stock_codes, 1):
+        # Reuse one connection for all writes; the unique key makes reruns idempotent
+        conn = get_connection()
+        try:
+            if not ensure_kline_unique_key(conn):
+                logging.warning("stock_kline has no (code, date) unique key, reruns may create duplicate rows")
+            
+            tasks, suspended_skipped = build_sync_tasks(stock_codes, get_kline_watermarks(conn), end_date, calendar)
+            done = journal.completed_codes(run_id)
+            already_done = sum(1 for task in tasks if task[0] in done)
+            tasks = [task for task in tasks if task[0] not in done]
+            logging.info(f"{len(stock_codes) - len(tasks) - already_done - suspended_skipped} codes already current, "
+                         f"{already_done} codes done earlier in this run, "
+                         f"{suspended_skipped} suspended codes skipped, {len(tasks)} codes to sync")
+            
+            summary = {
+                'run_id': run_id,
+                'target_date': str(end_date),
+                'resumed': resumed,
+                'total_codes': len(stock_codes),
+                'to_sync': len(tasks),
+                'done_before_resume': already_done,
+                'suspended_skipped': suspended_skipped,
+                'rows_written': 0,
+                'empty': 0,
+                'retry_rounds': 0,
+            }
+            
+            # Fetch processes, a parser thread and a batched writer run concurrently
+            failed = _ingest(tasks, conn, journal, run_id, summary)
+            
+            # Drain the retry queue with exponential backoff
+            for attempt in range(1, INGEST_CONFIG['max_retries'] + 1):
+                if not failed:
+                    break
+                delay = INGEST_CONFIG['retry_backoff_seconds'] * 2 ** (attempt - 1)
+                logging.info(f"Retrying {len(failed)} failed codes in {delay:.0f}s (attempt {attempt})")
+                time.sleep(delay)
+                summary['retry_rounds'] = attempt
+                failed = _ingest(failed, conn, journal, run_id, summary)
+            
+            record_errors(conn, end_date, len(failed))
+            
+            # Append the new bars to the memory-mapped market panel used by the screeners
             try:
-                # Get K-line data for yesterday
-                k_data = get_k_data(code, yesterday, yesterday)
-                
-                if not k_data.empty:
-                    # Insert data into database
-                    insert_k_data(k_data)
-                    logging.info(f"Successfully updated {code} ({idx}/{total_stocks})")
-                else:
-                    logging.warning(f"No data available for {code} on {yesterday}")
-                
-                # Add delay between API calls
-                time.sleep(BAOSTOCK_CONFIG['delay_seconds'])
-                
+                summary['panel_bars'] = update_market_panel(conn)
             except Exception as e:
-                logging.error(f"Error processing stock {code}: {str(e)}")
-                continue
+                logging.warning(f"Market panel update failed: {str(e)}")
+            try:
+                summary['screen_state_days'] = update_screen_state()
+            except Exception as e:
+                logging.warning(f"Screen state update failed: {str(e)}")
+            try:
+                summary['parquet_months'] = sync_parquet(conn)
+            except Exception as e:
+                logging.warning(f"Parquet mirror sync failed: {str(e)}")
+        finally:
+            conn.close()
+        
+        summary['baostock_rate'] = get_default_controller().snapshot(history=False)
+        failures = journal.failed_codes(run_id)
+        summary['failed'] = len(failures)
+        summary['failed_codes'] = {code: error for code, (_, error) in failures.items()}
+        summary['wall_seconds'] = round(time.time() - started, 1)
+        journal.finish_run(run_id, summary)
+        journal.close()
         
+        with open(INGEST_CONFIG['summary_path'], 'w') as f:
+            json.dump(summary, f, default=str, indent=2)
+        logging.info(f"Daily update summary: {json.dumps(summary, default=str)}")
         logging.info("Daily update completed successfully")
         
     except Exception as e:
         logging.error(f"Error in daily update: {str(e)}")
     
-    finally:
-        # Logout from baostock
-        bs.logout()
+    return summary
 
 if __name__ == "__main__":
     update_daily_kline()
@@ -0,0 +1,226 @@
+"""线程安全的MySQL连接池，所有模块通过get_connection()取得连接
+
+    from db_pool import get_connection
+    conn = get_connection()
+    try:
+        ...
+    finally:
+        conn.close()   # 归还连接池，而不是断开
+
+    with get_connection() as conn:   # 同样在退出时归还
+        ...
+
+每次get_connection()为调用线程签出一个独占的连接，归还前其他线程拿不到它；多线程筛选时每个任务各自签出。
+连接数达到max_size时等待其他线程归还，超过wait_timeout抛出PoolTimeout；空闲超过ping_after_seconds的连接
+签出前先ping，断开的连接直接丢弃重建。归还时回滚未提交的事务，与断开连接的语义一致。
+stats()返回签出次数、等待次数和等待时间等指标。fork出的子进程首次使用时会丢弃从父进程继承的连接。
+忘记close()的连接在被垃圾回收时交回连接池（断开后释放名额，计入leaked），不会永久占住一个名额。
+"""
+import os
+import time
+import threading
+import logging
+from collections import deque
+import pymysql
+from config import DB_CONFIG, POOL_CONFIG
+
+class PoolTimeout(Exception):
+    """连接池已满，等待超时"""
+
+class PooledConnection:
+    """pymysql连接的包装，close()把连接还给连接池，其余属性和方法原样转发"""
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+
+    def __getattr__(self, name):
+        if self._raw is None:
+            raise pymysql.err.InterfaceError("connection already returned to the pool")
+        return getattr(self._raw, name)
+
+    def close(self):
+        if self._raw is not None:
+            raw, self._raw = self._raw, None
+            self._pool._release(raw)
+
+    def discard(self):
+        """断开连接而不是归还（会话状态不确定时使用），连接池随后补建"""
+        if self._raw is not None:
+            raw, self._raw = self._raw, None
+            try:
+                raw.close()
+            except Exception:
+                pass
+            self._pool._release(raw)
+
+    def __del__(self):
+        # 垃圾回收可能发生在持有连接池锁的代码中间，这里不加锁，只放进待回收队列
+        raw = getattr(self, '_raw', None)
+        if raw is not None:
+            self._raw = None
+            self._pool._orphans.append(raw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class ConnectionPool:
+    def __init__(self, max_size=None, wait_timeout=None, ping_after_seconds=None, max_idle=None, **connect_kwargs):
+        self.max_size = max_size or POOL_CONFIG['max_size']
+        self.wait_timeout = POOL_CONFIG['wait_timeout'] if wait_timeout is None else wait_timeout
+        self.ping_after_seconds = (POOL_CONFIG['ping_after_seconds'] if ping_after_seconds is None
+                                   else ping_after_seconds)
+        self.max_idle = POOL_CONFIG['max_idle'] if max_idle is None else max_idle
+        self.connect_kwargs = {**DB_CONFIG, **connect_kwargs}
+        self._cond = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = []  # [(raw, 归还时间)]，后进先出，常用的连接保持温热
+        self._orphans = deque()  # 未close()就被回收的连接，下次签出时断开并释放名额
+        self._size = 0
+        self._metrics = {'checkouts': 0, 'created': 0, 'discarded': 0, 'leaked': 0, 'waits': 0, 'timeouts': 0,
+                         'wait_seconds': 0.0, 'max_wait_seconds': 0.0}
+
+    def _check_fork(self):
+        if os.getpid() != self._pid:
+            # 父进程的socket不能在子进程里复用，只丢弃引用不关闭
+            self._reset()
+
+    def _healthy(self, raw, idle_since):
+        if not raw.open:
+            return False
+        if time.monotonic() - idle_since < self.ping_after_seconds:
+            return True
+        try:
+            raw.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _reclaim_orphans(self):
+        """调用方持有锁"""
+        while self._orphans:
+            raw = self._orphans.popleft()
+            self._metrics['leaked'] += 1
+            self._size -= 1
+            self._discard(raw)
+            logging.warning("A pooled MySQL connection was garbage-collected without close(), reclaimed")
+
+    def _discard(self, raw):
+        self._metrics['discarded'] += 1
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def get_connection(self):
+        """为当前线程签出一个连接"""
+        started = time.monotonic()
+        waited = False
+        with self._cond:
+            self._check_fork()
+            while True:
+                self._reclaim_orphans()
+                while self._idle:
+                    raw, idle_since = self._idle.pop()
+                    if self._healthy(raw, idle_since):
+                        self._checked_out(started, waited)
+                        return PooledConnection(self, raw)
+                    self._size -= 1
+                    self._discard(raw)
+                if self._size < self.max_size:
+                    # 先占位，在锁外建立连接
+                    self._size += 1
+                    break
+                remaining = self.wait_timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._metrics['timeouts'] += 1
+                    raise PoolTimeout(f"no MySQL connection available within {self.wait_timeout}s "
+                                      f"(max_size={self.max_size})")
+                waited = True
+                # 被回收的连接不会notify，定期醒来检查
+                self._cond.wait(min(remaining, 1.0))
+        try:
+            raw = pymysql.connect(**self.connect_kwargs)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._metrics['created'] += 1
+            self._checked_out(started, waited)
+        return PooledConnection(self, raw)
+
+    def _checked_out(self, started, waited):
+        self._metrics['checkouts'] += 1
+        if waited:
+            wait = time.monotonic() - started
+            self._metrics['waits'] += 1
+            self._metrics['wait_seconds'] += wait
+            self._metrics['max_wait_seconds'] = max(self._metrics['max_wait_seconds'], wait)
+
+    def _release(self, raw):
+        reusable = raw.open
+        if reusable:
+            try:
+                raw.rollback()
+            except Exception:
+                reusable = False
+        with self._cond:
+            if os.getpid() != self._pid:
+                return
+            if reusable and len(self._idle) < self.max_idle:
+                self._idle.append((raw, time.monotonic()))
+            else:
+                self._size -= 1
+                self._discard(raw)
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            self._check_fork()
+            self._reclaim_orphans()
+            return {**self._metrics, 'size': self._size, 'idle': len(self._idle),
+                    'in_use': self._size - len(self._idle), 'max_size': self.max_size}
+
+    def close_idle(self):
+        """断开所有空闲连接（签出中的连接归还后照常处理）"""
+        with self._cond:
+            while self._idle:
+                raw, _ = self._idle.pop()
+                self._size -= 1
+                self._discard(raw)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(**connect_kwargs):
+    """按连接参数共享的连接池，例如get_pool(local_infile=True)是单独的一个池"""
+    key = tuple(sorted(connect_kwargs.items()))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(**connect_kwargs)
+        return pool
+
+def get_connection(**connect_kwargs):
+    return get_pool(**connect_kwargs).get_connection()
+
+def pool_stats():
+    """所有连接池的指标，键为连接参数"""
+    with _pools_lock:
+        pools = dict(_pools)
+    return {', '.join(f"{k}={v}" for k, v in key) or 'default': pool.stats() for key, pool in pools.items()}
+
+def log_pool_stats():
+    for name, stats in pool_stats().items():
+        logging.info(f"MySQL pool [{name}]: {stats['checkouts']} checkouts, {stats['created']} connections created, "
+                     f"{stats['waits']} waits ({stats['wait_seconds']:.2f}s total, "
+                     f"max {stats['max_wait_seconds']:.2f}s), {stats['timeouts']} timeouts, "
+                     f"{stats['leaked']} leaked")
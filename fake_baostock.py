@@ -0,0 +1,300 @@
+"""离线的baostock替身，用确定性的合成行情实现本仓库用到的bs接口子集
+
+用法：在导入项目模块之前调用install()，之后所有 `import baostock as bs` 拿到的都是本模块。
+fork方式启动的子进程（Linux默认）会继承替换结果。
+
+    import fake_baostock
+    fake_baostock.install(n_stocks=500, latency=0.02, error_rate=0.01)
+"""
+import sys
+import time
+import bisect
+import random
+import zlib
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+import numpy as np
+
+MARKET_START = date(2010, 1, 4)
+
+KLINE_FORMATS = {
+    'open': '%.4f', 'high': '%.4f', 'low': '%.4f', 'close': '%.4f', 'preclose': '%.4f',
+    'volume': '%d', 'amount': '%.4f', 'turn': '%.6f', 'pctChg': '%.6f',
+    'peTTM': '%.6f', 'pbMRQ': '%.6f', 'psTTM': '%.6f', 'pcfNcfTTM': '%.6f',
+}
+
+_settings = {
+    'n_stocks': 3564,
+    'seed': 20241203,
+    'latency': 0.0,  # Seconds added to every query
+    'jitter': 0.0,  # Uniform random extra latency, seconds
+    'error_rate': 0.0,  # Probability that a query returns a non-zero error_code
+    'max_rate': None,  # Queries per second allowed per session before errors are returned
+}
+_market = None
+_logged_in = False
+_recent_calls = []
+_rng = random.Random(0)
+
+class ResultData:
+    """模仿baostock的ResultData：error_code/error_msg/fields/next()/get_row_data()"""
+
+    def __init__(self, fields=None, rows=None, error_code='0', error_msg='success'):
+        self.error_code = error_code
+        self.error_msg = error_msg
+        self.fields = fields or []
+        self.data = rows or []
+        self._cursor = -1
+
+    def next(self):
+        self._cursor += 1
+        return self._cursor < len(self.data)
+
+    def get_row_data(self):
+        return self.data[self._cursor]
+
+    def get_data(self):
+        import pandas as pd
+        return pd.DataFrame(self.data, columns=self.fields)
+
+def _is_holiday(day):
+    """近似的A股节假日：元旦、春节（2月第一周）、劳动节、国庆"""
+    return ((day.month == 1 and day.day == 1) or
+            (day.month == 2 and day.day <= 7) or
+            (day.month == 5 and day.day <= 3) or
+            (day.month == 10 and day.day <= 7))
+
+def is_trading_day(day):
+    return day.weekday() < 5 and not _is_holiday(day)
+
+class SyntheticMarket:
+    """确定性的合成行情：同样的seed和代码总是生成同样的K线
+
+    每个字段用独立的随机数流生成，序列延长时已生成的历史保持不变。
+    只在内存里保留最近用到的cache_size只股票。
+    """
+
+    def __init__(self, n_stocks, seed, cache_size=256):
+        self.seed = seed
+        self.cache_size = cache_size
+        self.codes = []
+        for i in range(n_stocks):
+            if i % 2 == 0:
+                self.codes.append(f"sh.{600000 + i // 2:06d}")
+            else:
+                self.codes.append(f"sz.{1 + i // 2:06d}")
+        self.names = {code: f"合成股票{i:04d}" for i, code in enumerate(self.codes)}
+        self.ipo_dates = {}
+        for code in self.codes:
+            rng = self._rng(code, 'ipo')
+            offset = int(rng.integers(0, 3000)) if rng.random() < 0.3 else 0
+            self.ipo_dates[code] = MARKET_START + timedelta(days=offset)
+        self._days = []
+        self._series = OrderedDict()
+
+    def _rng(self, code, salt):
+        return np.random.default_rng([self.seed, zlib.crc32(f"{code}:{salt}".encode())])
+
+    def trading_days(self, until):
+        """从MARKET_START到until的全部交易日（字符串），按需延长"""
+        day = datetime.strptime(self._days[-1], '%Y-%m-%d').date() + timedelta(days=1) if self._days else MARKET_START
+        while day <= until:
+            if is_trading_day(day):
+                self._days.append(day.strftime('%Y-%m-%d'))
+            day += timedelta(days=1)
+        return self._days
+
+    def series(self, code, until):
+        """生成code从上市日到until（含）的全部日线，按需延长并缓存"""
+        cached = self._series.get(code)
+        if cached is not None and cached['end'] >= until:
+            self._series.move_to_end(code)
+            return cached
+        end = max(until, date.today())
+        all_days = self.trading_days(end)
+        first = bisect.bisect_left(all_days, self.ipo_dates[code].strftime('%Y-%m-%d'))
+        last = bisect.bisect_right(all_days, end.strftime('%Y-%m-%d'))
+        days = all_days[first:last]
+        n = len(days)
+
+        scalars = self._rng(code, 'scalars')
+        price_level = scalars.uniform(0.5, 5)
+        base_volume = scalars.uniform(1e6, 5e7)
+        float_shares = base_volume * scalars.uniform(50, 200)
+        valuation = scalars.uniform([5, 0.5, 0.5, -20], [50, 5, 10, 40])
+
+        close = 10 * price_level * np.exp(np.cumsum(self._rng(code, 'returns').normal(0.0003, 0.02, n)))
+        preclose = np.concatenate([close[:1], close[:-1]])
+        open_ = preclose * (1 + self._rng(code, 'open').normal(0, 0.005, n))
+        high = np.maximum(open_, close) * (1 + np.abs(self._rng(code, 'high').normal(0, 0.01, n)))
+        low = np.minimum(open_, close) * (1 - np.abs(self._rng(code, 'low').normal(0, 0.01, n)))
+        volume = base_volume * self._rng(code, 'volume').lognormal(0, 0.3, n)
+        # 偶发的3-6倍放量，让筛选条件有机会触发
+        surge_rng = self._rng(code, 'surge')
+        volume *= np.where(surge_rng.random(n) < 0.03, surge_rng.uniform(3, 6, n), 1.0)
+
+        suspend_rng = self._rng(code, 'suspend')
+        starts = suspend_rng.random(n) < 0.002
+        lengths = suspend_rng.integers(1, 20, n)
+        suspended = np.zeros(n, dtype=bool)
+        for i in np.flatnonzero(starts):
+            suspended[i:i + lengths[i]] = True
+        # 停牌日价格不变、成交为0
+        for i in np.flatnonzero(suspended):
+            prev = close[i - 1] if i else close[i]
+            open_[i] = high[i] = low[i] = close[i] = preclose[i] = prev
+        volume = np.where(suspended, 0, np.floor(volume))
+
+        self._series[code] = {
+            'end': end,
+            'dates': days,
+            'open': open_, 'high': high, 'low': low, 'close': close, 'preclose': preclose,
+            'volume': volume,
+            'amount': volume * (open_ + close) / 2,
+            'turn': volume / float_shares * 100,
+            'pctChg': (close / preclose - 1) * 100,
+            'tradestatus': np.where(suspended, 0, 1),
+            'peTTM': close * valuation[0] / 10,
+            'pbMRQ': close * valuation[1] / 10,
+            'psTTM': close * valuation[2] / 10,
+            'pcfNcfTTM': close * valuation[3] / 10,
+        }
+        while len(self._series) > self.cache_size:
+            self._series.popitem(last=False)
+        return self._series[code]
+
+    def k_rows(self, code, fields, start_date, end_date):
+        if code not in self.ipo_dates:
+            return []
+        s = self.series(code, datetime.strptime(end_date, '%Y-%m-%d').date())
+        lo = bisect.bisect_left(s['dates'], start_date)
+        hi = bisect.bisect_right(s['dates'], end_date)
+        rows = []
+        for i in range(lo, hi):
+            row = []
+            for field in fields:
+                if field == 'date':
+                    row.append(s['dates'][i])
+                elif field == 'code':
+                    row.append(code)
+                elif field == 'adjustflag':
+                    row.append('3')
+                elif field == 'tradestatus':
+                    row.append(str(s['tradestatus'][i]))
+                elif field == 'isST':
+                    row.append('0')
+                elif field in KLINE_FORMATS:
+                    row.append(KLINE_FORMATS[field] % s[field][i])
+                else:
+                    row.append('')
+            rows.append(row)
+        return rows
+
+def _market_instance():
+    global _market
+    if _market is None:
+        _market = SyntheticMarket(_settings['n_stocks'], _settings['seed'])
+    return _market
+
+def _simulate_call():
+    """注入延迟、随机错误和每会话速率上限，返回错误ResultData或None"""
+    if not _logged_in:
+        return ResultData(error_code='10001001', error_msg='用户未登录')
+    delay = _settings['latency'] + _rng.uniform(0, _settings['jitter'])
+    if delay:
+        time.sleep(delay)
+    if _settings['max_rate']:
+        now = time.monotonic()
+        _recent_calls[:] = [t for t in _recent_calls if now - t < 1.0]
+        _recent_calls.append(now)
+        if len(_recent_calls) > _settings['max_rate']:
+            return ResultData(error_code='10002007', error_msg='请求过于频繁')
+    if _rng.random() < _settings['error_rate']:
+        return ResultData(error_code='10002001', error_msg='网络接收错误')
+    return None
+
+def login(user_id='anonymous', password='123456', options=0):
+    global _logged_in
+    _logged_in = True
+    return ResultData(error_code='0', error_msg='success')
+
+def logout(user_id='anonymous'):
+    global _logged_in
+    _logged_in = False
+    return ResultData(error_code='0', error_msg='success')
+
+def query_history_k_data_plus(code, fields, start_date=None, end_date=None, frequency='d', adjustflag='3'):
+    error = _simulate_call()
+    if error:
+        return error
+    field_list = [f.strip() for f in fields.split(',')]
+    end_date = end_date or date.today().strftime('%Y-%m-%d')
+    start_date = start_date or '2015-01-01'
+    return ResultData(field_list, _market_instance().k_rows(code, field_list, start_date, end_date))
+
+def query_all_stock(day=None):
+    error = _simulate_call()
+    if error:
+        return error
+    market = _market_instance()
+    day = datetime.strptime(day, '%Y-%m-%d').date() if day else date.today()
+    if not is_trading_day(day):
+        return ResultData(['code', 'tradeStatus', 'code_name'], [])
+    rows = [[code, '1', market.names[code]] for code in market.codes if market.ipo_dates[code] <= day]
+    return ResultData(['code', 'tradeStatus', 'code_name'], rows)
+
+def query_stock_basic(code='', code_name=''):
+    error = _simulate_call()
+    if error:
+        return error
+    market = _market_instance()
+    rows = [[c, market.names[c], market.ipo_dates[c].strftime('%Y-%m-%d'), '', '1', '1']
+            for c in market.codes if (not code or c == code) and (not code_name or market.names[c] == code_name)]
+    return ResultData(['code', 'code_name', 'ipoDate', 'outDate', 'type', 'status'], rows)
+
+INDUSTRIES = ['J66货币金融服务', 'C39计算机、通信和其他电子设备制造业', 'C27医药制造业',
+              'K70房地产业', 'C26化学原料和化学制品制造业', 'I65软件和信息技术服务业']
+
+def query_stock_industry(code='', date=''):
+    error = _simulate_call()
+    if error:
+        return error
+    market = _market_instance()
+    rows = [['2024-01-02', c, market.names[c], INDUSTRIES[zlib.crc32(c.encode()) % len(INDUSTRIES)], '证监会行业分类']
+            for c in market.codes if not code or c == code]
+    return ResultData(['updateDate', 'code', 'code_name', 'industry', 'industryClassification'], rows)
+
+def query_trade_dates(start_date=None, end_date=None):
+    error = _simulate_call()
+    if error:
+        return error
+    start = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else date(2015, 1, 1)
+    end = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else date.today()
+    rows = []
+    day = start
+    while day <= end:
+        rows.append([day.strftime('%Y-%m-%d'), '1' if is_trading_day(day) else '0'])
+        day += timedelta(days=1)
+    return ResultData(['calendar_date', 'is_trading_day'], rows)
+
+def configure(**settings):
+    """修改合成市场规模(n_stocks, seed)或注入的latency/jitter/error_rate/max_rate"""
+    global _market
+    unknown = set(settings) - set(_settings)
+    if unknown:
+        raise ValueError(f"Unknown fake baostock settings: {sorted(unknown)}")
+    if 'n_stocks' in settings or 'seed' in settings:
+        _market = None
+    _settings.update(settings)
+    _rng.seed(_settings['seed'])
+
+def install(**settings):
+    """用本模块替换baostock，并重新绑定已导入模块里的bs引用"""
+    configure(**settings)
+    this = sys.modules[__name__]
+    real = sys.modules.get('baostock')
+    sys.modules['baostock'] = this
+    for module in list(sys.modules.values()):
+        if module is not None and real is not None and getattr(module, 'bs', None) is real:
+            module.bs = this
+    return this
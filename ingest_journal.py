@@ -0,0 +1,114 @@
+import os
+import json
+import sqlite3
+import threading
+import functools
+from datetime import datetime
+from config import INGEST_CONFIG
+
+def _locked(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+class IngestJournal:
+    """本地SQLite日志，记录每次入库任务已完成/失败的股票代码，用于断点续跑
+
+    流水线的写入线程和主线程都会回调它，所有访问都串行在同一把锁上。
+    """
+
+    def __init__(self, path=None):
+        path = path or INGEST_CONFIG['journal_path']
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS ingest_runs (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job TEXT NOT NULL,
+                target_date TEXT NOT NULL,
+                status TEXT NOT NULL,
+                started_at TEXT NOT NULL,
+                finished_at TEXT,
+                summary TEXT
+            );
+            CREATE TABLE IF NOT EXISTS ingest_codes (
+                run_id INTEGER NOT NULL,
+                code TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                rows_written INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (run_id, code)
+            );
+        """)
+        self.conn.commit()
+
+    @_locked
+    def start_run(self, job, target_date):
+        """续跑同一job、同一目标日期下未完成的任务，否则新建一次任务
+
+        返回(run_id, resumed)。
+        """
+        row = self.conn.execute(
+            "SELECT run_id FROM ingest_runs WHERE job = ? AND target_date = ? AND status = 'running' "
+            "ORDER BY run_id DESC LIMIT 1", (job, str(target_date))).fetchone()
+        if row:
+            return row[0], True
+        cursor = self.conn.execute(
+            "INSERT INTO ingest_runs (job, target_date, status, started_at) VALUES (?, ?, 'running', ?)",
+            (job, str(target_date), datetime.now().isoformat(timespec='seconds')))
+        self.conn.commit()
+        return cursor.lastrowid, False
+
+    @_locked
+    def completed_codes(self, run_id):
+        rows = self.conn.execute(
+            "SELECT code FROM ingest_codes WHERE run_id = ? AND status = 'done'", (run_id,))
+        return {code for (code,) in rows}
+
+    @_locked
+    def mark_done(self, run_id, results):
+        """results为[(code, rows_written)]，应在对应数据提交到MySQL之后调用"""
+        now = datetime.now().isoformat(timespec='seconds')
+        self.conn.executemany("""
+            INSERT INTO ingest_codes (run_id, code, status, attempts, rows_written, error, updated_at)
+            VALUES (?, ?, 'done', 1, ?, NULL, ?)
+            ON CONFLICT (run_id, code) DO UPDATE SET
+                status = 'done', attempts = attempts + 1,
+                rows_written = excluded.rows_written, error = NULL, updated_at = excluded.updated_at
+        """, [(run_id, code, rows, now) for code, rows in results])
+        self.conn.commit()
+
+    @_locked
+    def mark_failed(self, run_id, code, error):
+        now = datetime.now().isoformat(timespec='seconds')
+        self.conn.execute("""
+            INSERT INTO ingest_codes (run_id, code, status, attempts, rows_written, error, updated_at)
+            VALUES (?, ?, 'failed', 1, 0, ?, ?)
+            ON CONFLICT (run_id, code) DO UPDATE SET
+                status = 'failed', attempts = attempts + 1,
+                error = excluded.error, updated_at = excluded.updated_at
+        """, (run_id, code, str(error), now))
+        self.conn.commit()
+
+    @_locked
+    def failed_codes(self, run_id):
+        """当前仍处于失败状态的代码，返回{code: (attempts, error)}"""
+        rows = self.conn.execute(
+            "SELECT code, attempts, error FROM ingest_codes WHERE run_id = ? AND status = 'failed'", (run_id,))
+        return {code: (attempts, error) for code, attempts, error in rows}
+
+    @_locked
+    def finish_run(self, run_id, summary):
+        self.conn.execute(
+            "UPDATE ingest_runs SET status = 'finished', finished_at = ?, summary = ? WHERE run_id = ?",
+            (datetime.now().isoformat(timespec='seconds'), json.dumps(summary, default=str), run_id))
+        self.conn.commit()
+
+    @_locked
+    def close(self):
+        self.conn.close()
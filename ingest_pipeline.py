@@ -0,0 +1,158 @@
+import queue
+import threading
+import time
+import logging
+import pandas as pd
+from k_stockinfo import prepare_k_data, write_prepared_k_data
+from kline_fetcher import fetch_k_data_parallel
+from config import INGEST_CONFIG
+
+def _noop(*args):
+    pass
+
+class _StageFailure:
+    """解析/写入线程中第一个未处理的异常（例如回调本身出错）
+
+    出错后各阶段不再处理数据，只继续取空输入队列直到结束标记，上游不会阻塞在有界队列上；
+    主线程停止投递，等线程结束后重新抛出。
+    """
+
+    def __init__(self):
+        self.error = None
+        self._lock = threading.Lock()
+
+    def record(self, error):
+        with self._lock:
+            if self.error is None:
+                self.error = error
+                logging.error(f"Ingest pipeline stage failed: {error!r}")
+
+def _parse_stage(parse_queue, write_queue, on_failed, failure):
+    """解析线程：把baostock返回的字符串列转换成数值列"""
+    while True:
+        item = parse_queue.get()
+        if item is None:
+            write_queue.put(None)
+            return
+        if failure.error is not None:
+            continue
+        code, k_data = item
+        try:
+            try:
+                prepared = prepare_k_data(k_data)
+            except Exception as e:
+                on_failed(code, e)
+                continue
+            write_queue.put((code, prepared))
+        except Exception as e:
+            failure.record(e)
+
+def _write_stage(write_queue, conn, stats, on_committed, on_failed, failure):
+    """写入线程：攒够flush_rows行或距上次写入超过flush_seconds秒时批量写一次"""
+    flush_rows = INGEST_CONFIG['flush_rows']
+    flush_seconds = INGEST_CONFIG['flush_seconds']
+    frames = []
+    codes = []
+    buffered_rows = 0
+    last_flush = time.monotonic()
+
+    def flush():
+        if not codes:
+            return
+        started = time.monotonic()
+        try:
+            if frames:
+                write_prepared_k_data(pd.concat(frames, ignore_index=True), conn)
+        except Exception as e:
+            logging.error(f"Error writing batch of {len(codes)} codes: {str(e)}")
+            for code, _ in codes:
+                on_failed(code, e)
+        else:
+            stats['rows_written'] += buffered_rows
+            stats['codes_written'] += len(codes)
+            stats['batches'] += 1
+            stats['write_seconds'] += time.monotonic() - started
+            on_committed(list(codes))
+
+    while True:
+        timeout = max(0.0, flush_seconds - (time.monotonic() - last_flush))
+        try:
+            item = write_queue.get(timeout=timeout)
+        except queue.Empty:
+            item = False
+        if failure.error is not None:
+            if item is None:
+                return
+            continue
+        try:
+            if item is None:
+                flush()
+                return
+            if item:
+                code, df = item
+                if not df.empty:
+                    frames.append(df)
+                codes.append((code, len(df)))
+                buffered_rows += len(df)
+            if buffered_rows >= flush_rows or time.monotonic() - last_flush >= flush_seconds:
+                flush()
+                frames, codes, buffered_rows = [], [], 0
+                last_flush = time.monotonic()
+        except Exception as e:
+            failure.record(e)
+            if item is None:
+                return
+
+def run_ingest_pipeline(tasks, conn, on_committed=None, on_failed=None, on_empty=None, use_cache=False):
+    """流水线方式获取并写入K线数据
+
+    获取阶段由kline_fetcher的多进程完成（baostock会话不是线程安全的），
+    解析和写入各占一个线程，阶段之间用有界队列连接，下游写不动时上游自动阻塞。
+    写入线程是conn唯一的使用者。回调：
+      on_committed([(code, rows)])  一批数据提交到MySQL之后
+      on_failed(code, error)        获取、解析或写入失败
+      on_empty(code)                没有返回新数据
+    use_cache=True时已结算月份从本地K线缓存读取。返回统计信息字典。
+    解析或写入线程出错（包括回调抛出异常）时停止获取，线程结束后重新抛出第一个异常。
+    """
+    on_committed = on_committed or _noop
+    on_failed = on_failed or _noop
+    on_empty = on_empty or _noop
+    stats = {'rows_written': 0, 'codes_written': 0, 'batches': 0, 'write_seconds': 0.0}
+    started = time.monotonic()
+
+    parse_queue = queue.Queue(maxsize=INGEST_CONFIG['queue_size'])
+    write_queue = queue.Queue(maxsize=INGEST_CONFIG['queue_size'])
+    failure = _StageFailure()
+    parser = threading.Thread(target=_parse_stage, args=(parse_queue, write_queue, on_failed, failure), daemon=True)
+    writer = threading.Thread(target=_write_stage, args=(write_queue, conn, stats, on_committed, on_failed, failure),
+                              daemon=True)
+    parser.start()
+    writer.start()
+
+    fetched = fetch_k_data_parallel(tasks, use_cache=use_cache)
+    try:
+        for idx, (code, k_data, error) in enumerate(fetched, 1):
+            if failure.error is not None:
+                break
+            if error is not None:
+                on_failed(code, error)
+            elif k_data.empty:
+                on_empty(code)
+                # 空结果也交给写入线程，保证它和同批数据一起被确认
+                write_queue.put((code, k_data))
+            else:
+                parse_queue.put((code, k_data))
+            if idx % 100 == 0:
+                logging.info(f"Fetched {idx}/{len(tasks)} codes, {stats['rows_written']} rows written")
+    finally:
+        # 提前结束时立即停止获取进程
+        fetched.close()
+        parse_queue.put(None)
+        parser.join()
+        writer.join()
+    if failure.error is not None:
+        raise failure.error
+
+    stats['seconds'] = time.monotonic() - started
+    return stats
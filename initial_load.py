@@ -0,0 +1,164 @@
+"""stock_kline的批量初始加载
+
+和逐批INSERT不同，初始加载分三个阶段：
+  1. 获取：多进程从baostock获取K线，转换后追加写入本地CSV暂存文件
+  2. 导入：在没有(code, date)索引的空表上用LOAD DATA LOCAL INFILE逐个导入暂存文件
+     （紧凑布局下导入按主键聚簇的stock_kline_compact，暂存文件按代码分组、日期有序）
+  3. 建索引：全部导入后一次性建立uk_code_date唯一索引
+每个阶段分别报告耗时和行/秒。MySQL服务端需要开启local_infile。
+
+    python initial_load.py --days 1825
+"""
+import os
+import glob
+import time
+import argparse
+import logging
+from datetime import datetime, timedelta
+from k_stockinfo import (create_kline_table, ensure_kline_unique_key, get_stock_codes, prepare_k_data,
+                         KLINE_INSERT_COLUMNS)
+from db_pool import get_connection
+from kline_fetcher import fetch_k_data_parallel
+from kline_schema import get_kline_layout, get_code_ids, LOAD_COMPACT_SQL
+from kline_ledger import rebuild_ledger
+from config import INGEST_CONFIG
+
+LOAD_KLINE_SQL = """
+LOAD DATA LOCAL INFILE %s INTO TABLE stock_kline
+FIELDS TERMINATED BY ',' LINES TERMINATED BY '\\n'
+({columns})
+""".format(columns=', '.join(KLINE_INSERT_COLUMNS))
+
+def _phase(name, rows, seconds):
+    rate = rows / seconds if seconds > 0 else 0.0
+    print(f"{name}: {rows} rows in {seconds:.1f}s ({rate:.0f} rows/s)")
+    return {'rows': rows, 'seconds': round(seconds, 3), 'rows_per_second': round(rate)}
+
+def stage_k_data(tasks, stage_dir, use_cache=True):
+    """获取K线数据并写入暂存CSV，每个文件最多stage_file_rows行，返回(文件列表, 行数, 失败代码)"""
+    os.makedirs(stage_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(stage_dir, 'kline_*.csv')):
+        os.remove(path)
+
+    update_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    file_rows = INGEST_CONFIG['stage_file_rows']
+    files = []
+    failed = {}
+    total_rows = 0
+    current_rows = file_rows
+    handle = None
+    try:
+        for idx, (code, k_data, error) in enumerate(fetch_k_data_parallel(tasks, use_cache=use_cache), 1):
+            if error is not None:
+                failed[code] = error
+                continue
+            if k_data.empty:
+                continue
+            try:
+                df = prepare_k_data(k_data).assign(update_time=update_time)
+            except Exception as e:
+                failed[code] = str(e)
+                continue
+            if current_rows >= file_rows:
+                if handle:
+                    handle.close()
+                path = os.path.join(stage_dir, f"kline_{len(files):04d}.csv")
+                handle = open(path, 'w', newline='')
+                files.append(path)
+                current_rows = 0
+            df[KLINE_INSERT_COLUMNS].to_csv(handle, header=False, index=False, lineterminator='\n')
+            current_rows += len(df)
+            total_rows += len(df)
+            if idx % 100 == 0:
+                logging.info(f"Staged {idx}/{len(tasks)} codes, {total_rows} rows")
+    finally:
+        if handle:
+            handle.close()
+    return files, total_rows, failed
+
+def load_staged_files(files, codes):
+    """把暂存文件导入stock_kline，返回导入的行数
+
+    紧凑布局下导入stock_kline_compact，codes需预先登记到代码字典。
+    """
+    conn = get_connection(local_infile=True)
+    cursor = conn.cursor()
+    loaded = 0
+    try:
+        load_sql = LOAD_KLINE_SQL
+        if get_kline_layout(conn) == 'compact':
+            get_code_ids(conn, codes)
+            load_sql = LOAD_COMPACT_SQL
+        # 空表初始加载，唯一性由最后建索引时校验
+        cursor.execute("SET SESSION unique_checks = 0, foreign_key_checks = 0")
+        for path in files:
+            started = time.monotonic()
+            loaded_rows = cursor.execute(load_sql, (os.path.abspath(path).replace(os.sep, '/'),))
+            conn.commit()
+            loaded += loaded_rows
+            logging.info(f"Loaded {path}: {loaded_rows} rows in {time.monotonic() - started:.1f}s")
+    finally:
+        # 连接归还连接池后会被复用，恢复会话设置；恢复失败（例如导入时连接已断开）只记录日志，
+        # 不覆盖原来的异常，连接直接断开，不带着关闭的检查回到连接池
+        try:
+            cursor.execute("SET SESSION unique_checks = 1, foreign_key_checks = 1")
+            cursor.close()
+        except Exception as e:
+            logging.error(f"Could not restore unique_checks/foreign_key_checks, discarding the connection: {str(e)}")
+            conn.discard()
+        else:
+            conn.close()
+    return loaded
+
+def run_initial_load(start_date, end_date, stage_dir=None, keep_files=False, use_cache=True):
+    """重建stock_kline并批量加载[start_date, end_date]的全市场日K线，返回各阶段统计"""
+    stage_dir = stage_dir or INGEST_CONFIG['stage_dir']
+    stock_codes = get_stock_codes()
+    print(f"Found {len(stock_codes)} active stocks")
+    tasks = [(code, start_date, end_date) for code in stock_codes]
+    summary = {'start_date': start_date, 'end_date': end_date, 'codes': len(stock_codes)}
+
+    started = time.monotonic()
+    files, staged_rows, failed = stage_k_data(tasks, stage_dir, use_cache)
+    summary['fetch'] = _phase('Fetch and stage', staged_rows, time.monotonic() - started)
+    summary['failed_codes'] = failed
+    for code, error in failed.items():
+        print(f"Error processing {code}: {error}")
+
+    create_kline_table(unique_key=False)
+    started = time.monotonic()
+    loaded_rows = load_staged_files(files, stock_codes)
+    summary['load'] = _phase('LOAD DATA', loaded_rows, time.monotonic() - started)
+
+    started = time.monotonic()
+    if not ensure_kline_unique_key():
+        raise RuntimeError("stock_kline has duplicate (code, date) rows after initial load")
+    summary['index'] = _phase('Build unique key', loaded_rows, time.monotonic() - started)
+
+    # LOAD DATA绕过了写入路径，按导入结果重建按日台账
+    conn = get_connection()
+    try:
+        rebuild_ledger(conn)
+    finally:
+        conn.close()
+
+    if not keep_files:
+        for path in files:
+            os.remove(path)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk initial load of stock_kline")
+    parser.add_argument('--days', type=int, default=365, help="calendar days of history to load")
+    parser.add_argument('--stage-dir', default=None)
+    parser.add_argument('--keep-files', action='store_true', help="keep staged CSV files after loading")
+    parser.add_argument('--no-cache', action='store_true', help="bypass the local kline cache")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    end_date = datetime.now().strftime('%Y-%m-%d')
+    start_date = (datetime.now() - timedelta(days=args.days)).strftime('%Y-%m-%d')
+    run_initial_load(start_date, end_date, args.stage_dir, args.keep_files, not args.no_cache)
+
+if __name__ == "__main__":
+    main()
@@ -1,78 +1,147 @@
-import baostock as bs
 import pandas as pd
 import pymysql
+import functools
+import sys
 from datetime import datetime, timedelta
-import time
-from config import DB_CONFIG, BAOSTOCK_CONFIG
-
-# MySQL connection configuration
-def get_db_connection():
-    return pymysql.connect(
-        host=DB_CONFIG['host'],
-        port=DB_CONFIG['port'],
-        user=DB_CONFIG['user'],
-        password=DB_CONFIG['password'],
-        database=DB_CONFIG['database']
-    )
-
-def create_kline_table():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Drop table if exists and create new one
-    drop_table_sql = "DROP TABLE IF EXISTS stock_kline"
-    cursor.execute(drop_table_sql)
-    
-    # Create table for K-line data
-    create_table_sql = """
-    CREATE TABLE IF NOT EXISTS stock_kline (
-        id BIGINT AUTO_INCREMENT PRIMARY KEY,
-        code VARCHAR(20),
-        date DATE,
-        open DECIMAL(10,2),
-        high DECIMAL(10,2),
-        low DECIMAL(10,2),
-        close DECIMAL(10,2),
-        volume BIGINT,
-        amount DECIMAL(16,2),
-        adjustflag TINYINT,
-        turn DECIMAL(10,2),
-        tradestatus TINYINT,
-        pctChg DECIMAL(10,2),
-        peTTM DECIMAL(10,2),
-        pbMRQ DECIMAL(10,2),
-        psTTM DECIMAL(10,2),
-        pcfNcfTTM DECIMAL(10,2),
-        update_time DATETIME,
-        INDEX idx_code_date (code, date)
-    )
+from config import INGEST_CONFIG
+from rate_control import get_default_controller
+from kline_cache import fetch_history, get_kline_cache
+from kline_schema import (get_kline_layout, get_code_ids, compact_rows, COMPACT_TABLE, UPSERT_COMPACT_SQL,
+                          COMPACT_WATERMARKS_SQL)
+from kline_ledger import ensure_ledger_table, prepare_batch, apply_batch, reset_ledger
+from db_pool import get_connection
+
+def create_kline_table(unique_key=True):
+    """重建stock_kline表；unique_key=False时不建(code, date)索引，供批量初始加载完成后再统一建索引
+
+    紧凑布局下stock_kline是视图，只清空stock_kline_compact（主键即聚簇索引，无需另建）。
     """
-    cursor.execute(create_table_sql)
-    conn.commit()
-    cursor.close()
-    conn.close()
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        reset_ledger(conn)
+        if get_kline_layout(conn) == 'compact':
+            cursor.execute(f"TRUNCATE TABLE {COMPACT_TABLE}")
+            cursor.close()
+            return
+        
+        # Drop table if exists and create new one
+        drop_table_sql = "DROP TABLE IF EXISTS stock_kline"
+        cursor.execute(drop_table_sql)
+        
+        # Create table for K-line data
+        create_table_sql = """
+        CREATE TABLE IF NOT EXISTS stock_kline (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            code VARCHAR(20),
+            date DATE,
+            open DECIMAL(10,2),
+            high DECIMAL(10,2),
+            low DECIMAL(10,2),
+            close DECIMAL(10,2),
+            volume BIGINT,
+            amount DECIMAL(16,2),
+            adjustflag TINYINT,
+            turn DECIMAL(10,2),
+            tradestatus TINYINT,
+            pctChg DECIMAL(10,2),
+            peTTM DECIMAL(10,2),
+            pbMRQ DECIMAL(10,2),
+            psTTM DECIMAL(10,2),
+            pcfNcfTTM DECIMAL(10,2),
+            update_time DATETIME{unique_key}
+        )
+        """.format(unique_key=",\n            UNIQUE KEY uk_code_date (code, date)" if unique_key else "")
+        cursor.execute(create_table_sql)
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
 
-def get_stock_codes():
-    conn = get_db_connection()
+def ensure_kline_unique_key(conn=None):
+    """为已有的stock_kline表补充(code, date)唯一索引，保证重复写入是幂等的
+
+    旧表只有普通索引idx_code_date，如果表里已经存在重复行，加索引会失败，
+    此时返回False，需要先清理重复数据。
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT code FROM stock_codes WHERE trade_status = '1'")
-    codes = [row[0] for row in cursor.fetchall()]
-    cursor.close()
-    conn.close()
+    try:
+        if get_kline_layout(conn) == 'compact':
+            # 紧凑布局以(code_id, date)为主键
+            return True
+        cursor.execute("SHOW INDEX FROM stock_kline WHERE Key_name = 'uk_code_date'")
+        if cursor.fetchall():
+            return True
+
+        cursor.execute("SHOW INDEX FROM stock_kline WHERE Key_name = 'idx_code_date'")
+        drop_old = ", DROP INDEX idx_code_date" if cursor.fetchall() else ""
+        try:
+            cursor.execute(f"ALTER TABLE stock_kline ADD UNIQUE KEY uk_code_date (code, date){drop_old}")
+        except pymysql.err.IntegrityError as e:
+            print(f"stock_kline contains duplicate (code, date) rows, unique key not added: {str(e)}")
+            return False
+        conn.commit()
+        return True
+    finally:
+        cursor.close()
+        if own_conn:
+            conn.close()
+
+def get_stock_codes():
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT code FROM stock_codes WHERE trade_status = '1'")
+        codes = [row[0] for row in cursor.fetchall()]
+        cursor.close()
     return codes
 
-def get_k_data(code, start_date, end_date):
-    rs = bs.query_history_k_data_plus(code,
-        "date,code,open,high,low,close,volume,amount,adjustflag,turn,tradestatus,pctChg,peTTM,pbMRQ,psTTM,pcfNcfTTM",
-        start_date=start_date,
-        end_date=end_date,
-        frequency="d",
-        adjustflag="3")
-    
-    data_list = []
-    while (rs.error_code == '0') & rs.next():
-        data_list.append(rs.get_row_data())
-    return pd.DataFrame(data_list, columns=rs.fields)
+def get_kline_watermarks(conn=None):
+    """一次查询取出每只股票在stock_kline中的最新日期及当天的交易状态
+
+    返回{code: (last_date, tradestatus)}。
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        compact = get_kline_layout(conn) == 'compact'
+        if compact:
+            cursor.execute(COMPACT_WATERMARKS_SQL)
+        else:
+            cursor.execute("""
+                SELECT k.code, k.date, k.tradestatus
+                FROM stock_kline k
+                JOIN (SELECT code, MAX(date) AS last_date FROM stock_kline GROUP BY code) m
+                  ON k.code = m.code AND k.date = m.last_date
+            """)
+        return {code: (last_date, tradestatus) for code, last_date, tradestatus in cursor.fetchall()}
+    finally:
+        cursor.close()
+        if own_conn:
+            conn.close()
+
+KLINE_FIELDS = "date,code,open,high,low,close,volume,amount,adjustflag,turn,tradestatus,pctChg,peTTM,pbMRQ,psTTM,pcfNcfTTM"
+
+def query_k_data(code, start_date, end_date, use_cache=False, fetch=None):
+    """查询K线数据，本身不做限速；接口返回错误时抛出BaostockError
+
+    fetch为实际访问baostock的函数（签名同kline_cache.fetch_history），调用方可借此限速。
+    use_cache=True时已结算月份从本地缓存读取，只有缺失部分和开放尾部访问网络。
+    """
+    fetch = fetch or fetch_history
+    if use_cache:
+        return get_kline_cache().query(code, KLINE_FIELDS, start_date, end_date, fetch=fetch)
+    return fetch(code, KLINE_FIELDS, start_date, end_date, "d", "3")
+
+def get_k_data(code, start_date, end_date, controller=None, use_cache=False):
+    """经自适应速率控制器限速后查询K线数据，缓存命中时不占用请求配额"""
+    controller = controller or get_default_controller()
+    return query_k_data(code, start_date, end_date, use_cache,
+                        fetch=functools.partial(controller.call, fetch_history))
 
 def convert_to_float(value):
     try:
@@ -80,83 +149,128 @@ def convert_to_float(value):
     except (ValueError, AttributeError):
         return 0.0
 
-def insert_k_data(data):
-    if data.empty:
-        return
-    
-    conn = get_db_connection()
+KLINE_FLOAT_COLUMNS = ['open', 'high', 'low', 'close', 'amount', 'turn',
+                       'pctChg', 'peTTM', 'pbMRQ', 'psTTM', 'pcfNcfTTM']
+KLINE_INT_COLUMNS = ['volume', 'adjustflag', 'tradestatus']
+KLINE_INSERT_COLUMNS = ['code', 'date', 'open', 'high', 'low', 'close', 'volume', 'amount',
+                        'adjustflag', 'turn', 'tradestatus', 'pctChg', 'peTTM', 'pbMRQ',
+                        'psTTM', 'pcfNcfTTM', 'update_time']
+
+UPSERT_KLINE_SQL = """
+INSERT INTO stock_kline (
+    code, date, open, high, low, close, volume, amount,
+    adjustflag, turn, tradestatus, pctChg, peTTM, pbMRQ,
+    psTTM, pcfNcfTTM, update_time
+) VALUES (
+    %s, %s, %s, %s, %s, %s, %s, %s,
+    %s, %s, %s, %s, %s, %s,
+    %s, %s, %s
+)
+ON DUPLICATE KEY UPDATE
+    open = VALUES(open), high = VALUES(high), low = VALUES(low),
+    close = VALUES(close), volume = VALUES(volume), amount = VALUES(amount),
+    adjustflag = VALUES(adjustflag), turn = VALUES(turn),
+    tradestatus = VALUES(tradestatus), pctChg = VALUES(pctChg),
+    peTTM = VALUES(peTTM), pbMRQ = VALUES(pbMRQ), psTTM = VALUES(psTTM),
+    pcfNcfTTM = VALUES(pcfNcfTTM), update_time = VALUES(update_time)
+"""
+
+def prepare_k_data(data):
+    """按列向量化转换baostock返回的字符串数据，空值和非法值按0处理"""
+    df = data[['code', 'date']].copy()
+    for col in KLINE_FLOAT_COLUMNS:
+        df[col] = pd.to_numeric(data[col], errors='coerce').fillna(0.0)
+    for col in KLINE_INT_COLUMNS:
+        df[col] = pd.to_numeric(data[col], errors='coerce').fillna(0).astype('int64')
+    return df
+
+def insert_k_data(data, conn=None, batch_size=None):
+    """批量写入K线数据
+
+    data可以是单个DataFrame，也可以是多只股票DataFrame组成的列表。
+    按(code, date)唯一索引做INSERT ... ON DUPLICATE KEY UPDATE，重复运行同一天不会产生重复行。
+    传入conn时复用该连接，否则临时创建一个。返回写入的行数。
+    """
+    frames = [data] if isinstance(data, pd.DataFrame) else list(data)
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return 0
+    return write_prepared_k_data(prepare_k_data(pd.concat(frames, ignore_index=True)), conn, batch_size)
+
+def write_prepared_k_data(df, conn=None, batch_size=None):
+    """写入已经过prepare_k_data转换的数据，返回写入的行数
+
+    每批数据和对应的按日台账（kline_ledger）在同一个事务里提交。
+    """
+    if df.empty:
+        return 0
+    update_time = datetime.now()
+    df = df.assign(update_time=update_time)
+    batch_size = batch_size or INGEST_CONFIG['insert_batch_rows']
+
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
     cursor = conn.cursor()
-    
-    current_time = datetime.now()
-    for _, row in data.iterrows():
-        sql = """
-        INSERT INTO stock_kline (
-            code, date, open, high, low, close, volume, amount,
-            adjustflag, turn, tradestatus, pctChg, peTTM, pbMRQ,
-            psTTM, pcfNcfTTM, update_time
-        ) VALUES (
-            %s, %s, %s, %s, %s, %s, %s, %s,
-            %s, %s, %s, %s, %s, %s,
-            %s, %s, %s
-        )
-        """
-        values = (
-            row['code'], row['date'],
-            convert_to_float(row['open']), convert_to_float(row['high']),
-            convert_to_float(row['low']), convert_to_float(row['close']),
-            int(float(row['volume'])) if row['volume'].strip() else 0,
-            convert_to_float(row['amount']),
-            int(float(row['adjustflag'])) if row['adjustflag'].strip() else 0,
-            convert_to_float(row['turn']),
-            int(float(row['tradestatus'])) if row['tradestatus'].strip() else 0,
-            convert_to_float(row['pctChg']),
-            convert_to_float(row['peTTM']),
-            convert_to_float(row['pbMRQ']),
-            convert_to_float(row['psTTM']),
-            convert_to_float(row['pcfNcfTTM']),
-            current_time
-        )
-        cursor.execute(sql, values)
-    
-    conn.commit()
-    cursor.close()
-    conn.close()
-
-def main():
-    # 登录系统
-    lg = bs.login()
-    print('login respond error_code:' + lg.error_code)
-    print('login respond  error_msg:' + lg.error_msg)
-    
     try:
-        # 创建K线数据表
-        create_kline_table()
-        
-        # 获取所有股票代码
-        stock_codes = get_stock_codes()
-        print(f"Found {len(stock_codes)} active stocks")
-        
-        # 设置时间范围（最近一年的数据）
-        end_date = datetime.now().strftime('%Y-%m-%d')
-        start_date = (datetime.now() - timedelta(days=365)).strftime('%Y-%m-%d')
-        
-        # 获取并存储每支股票的K线数据
-        for i, code in enumerate(stock_codes, 1):
-            try:
-                print(f"Processing {i}/{len(stock_codes)}: {code}")
-                data = get_k_data(code, start_date, end_date)
-                insert_k_data(data)
-                # 避免请求过快
-                time.sleep(BAOSTOCK_CONFIG['delay_seconds'])  # Rate limiting
-            except Exception as e:
-                print(f"Error processing {code}: {str(e)}")
-                continue
-            
+        ensure_ledger_table(conn)
+        compact = get_kline_layout(conn) == 'compact'
+        if compact:
+            sql = UPSERT_COMPACT_SQL
+            rows = compact_rows(df, get_code_ids(conn, df['code'].unique()))
+        else:
+            sql = UPSERT_KLINE_SQL
+            # tolist()转换成Python原生类型，pymysql无法转义numpy标量
+            rows = list(zip(*(df[col].tolist() for col in KLINE_INSERT_COLUMNS)))
+        written = 0
+        for i in range(0, len(rows), batch_size):
+            batch, ledger_rows = prepare_batch(cursor, compact, rows[i:i + batch_size], update_time)
+            # pymysql会把executemany改写成多行INSERT语句
+            cursor.executemany(sql, batch)
+            apply_batch(cursor, ledger_rows)
+            conn.commit()
+            written += len(batch)
+    finally:
+        cursor.close()
+        if own_conn:
+            conn.close()
+    return written
+
+def main(bulk=False):
+    # 每个获取进程各自登录baostock，这里无需登录
+    # 设置时间范围（最近一年的数据）
+    end_date = datetime.now().strftime('%Y-%m-%d')
+    start_date = (datetime.now() - timedelta(days=365)).strftime('%Y-%m-%d')
+
+    if bulk:
+        # 暂存CSV + LOAD DATA，最后统一建索引，适合大范围回填
+        from initial_load import run_initial_load
+        run_initial_load(start_date, end_date)
         print("Successfully stored all K-line data in MySQL database")
+        return
+
+    # 创建K线数据表
+    create_kline_table()
     
+    # 获取所有股票代码
+    stock_codes = get_stock_codes()
+    print(f"Found {len(stock_codes)} active stocks")
+    
+    # 获取→解析→写入流水线：多进程获取，解析和批量写入各一个线程，队列有界保证内存平稳
+    from ingest_pipeline import run_ingest_pipeline  # 避免与kline_fetcher循环导入
+    tasks = [(code, start_date, end_date) for code in stock_codes]
+    conn = get_connection()
+    try:
+        stats = run_ingest_pipeline(
+            tasks, conn,
+            on_failed=lambda code, error: print(f"Error processing {code}: {str(error)}"),
+            use_cache=True)
     finally:
-        # 退出系统
-        bs.logout()
+        conn.close()
+    print(f"Wrote {stats['rows_written']} rows for {stats['codes_written']} stocks "
+          f"in {stats['seconds']:.1f}s")
+    
+    print("Successfully stored all K-line data in MySQL database")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(bulk='--bulk' in sys.argv[1:])
\ No newline at end of file
@@ -0,0 +1,206 @@
+import os
+import hashlib
+import threading
+from datetime import date, datetime, timedelta
+import numpy as np
+import pandas as pd
+import baostock as bs
+from config import CACHE_CONFIG
+from rate_control import BaostockError
+
+CACHEABLE_FREQUENCIES = ('d', 'w', 'm')
+EPOCH = date(1970, 1, 1)
+
+def fetch_history(code, fields, start_date, end_date, frequency, adjustflag):
+    """直接调用query_history_k_data_plus，返回字符串DataFrame；接口报错时抛出BaostockError"""
+    rs = bs.query_history_k_data_plus(code, fields, start_date=start_date, end_date=end_date,
+                                      frequency=frequency, adjustflag=adjustflag)
+    if rs.error_code != '0':
+        raise BaostockError(f"query_history_k_data_plus failed for {code}: {rs.error_code} {rs.error_msg}")
+    data_list = []
+    while (rs.error_code == '0') & rs.next():
+        data_list.append(rs.get_row_data())
+    return pd.DataFrame(data_list, columns=rs.fields)
+
+def parse_history(df, fields):
+    """把baostock返回的字符串列转成数值列，date和code保持字符串"""
+    out = pd.DataFrame(index=df.index)
+    for field in fields:
+        if field in ('date', 'code'):
+            out[field] = df[field].astype(str)
+        else:
+            out[field] = pd.to_numeric(df[field], errors='coerce')
+    return out
+
+def _month_segments(start, end):
+    """把[start, end]按自然月切分，返回每个月的(月初, 月末)"""
+    segments = []
+    month_start = start.replace(day=1)
+    while month_start <= end:
+        next_month = (month_start + timedelta(days=32)).replace(day=1)
+        segments.append((month_start, next_month - timedelta(days=1)))
+        month_start = next_month
+    return segments
+
+class KlineCache:
+    """baostock历史K线的本地内容寻址缓存
+
+    每个缓存文件对应(code, fields, 月初, 月末, frequency, adjustflag)一个自然月，
+    以float64数组(.npy)存放解析后的数值，date存为距1970-01-01的天数，code不落盘。
+    只有整月都已收盘结算的月份会写入缓存；请求中尚未结束的月份（开放尾部）总是走网络。
+    缺失的月份和尾部合并成一次网络请求，所以每次查询最多访问一次baostock。
+    前/后复权数据会随除权除息整体改写，只缓存不复权(adjustflag='3')的数据。
+    超过max_bytes时按最近使用时间淘汰。
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or CACHE_CONFIG['dir']
+        self.max_bytes = max_bytes or CACHE_CONFIG['max_bytes']
+        self.hits = 0
+        self.misses = 0
+        self.network_calls = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._sizes = {}
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.npy'):
+                    path = os.path.join(root, name)
+                    self._sizes[path] = os.path.getsize(path)
+        self.total_bytes = sum(self._sizes.values())
+
+    def _path(self, code, fields, seg_start, seg_end, frequency, adjustflag):
+        key = repr((code, fields, str(seg_start), str(seg_end), frequency, adjustflag))
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest + '.npy')
+
+    def _load(self, path, code, fields):
+        try:
+            values = np.load(path)
+        except (OSError, ValueError):
+            return None
+        os.utime(path)
+        stored = [f for f in fields if f != 'code']
+        df = pd.DataFrame(values.reshape(-1, len(stored)), columns=stored)
+        if 'date' in df:
+            days = df['date'].astype('int64').to_numpy().astype('timedelta64[D]')
+            df['date'] = pd.Series(np.datetime64(EPOCH, 'D') + days).dt.strftime('%Y-%m-%d').to_numpy()
+        if 'code' in fields:
+            df['code'] = code
+        return df[list(fields)]
+
+    def _store(self, path, df, fields):
+        stored = [f for f in fields if f != 'code']
+        columns = []
+        for field in stored:
+            if field == 'date':
+                dates = pd.to_datetime(df['date']).to_numpy().astype('datetime64[D]')
+                columns.append((dates - np.datetime64(EPOCH, 'D')).astype('float64'))
+            else:
+                columns.append(df[field].to_numpy(dtype='float64'))
+        values = np.column_stack(columns) if len(df) else np.empty((0, len(stored)))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, values)
+        os.replace(tmp_path, path)
+        with self._lock:
+            size = os.path.getsize(path)
+            self.total_bytes += size - self._sizes.get(path, 0)
+            self._sizes[path] = size
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            if self.total_bytes <= self.max_bytes:
+                return
+            by_age = []
+            for path in self._sizes:
+                try:
+                    by_age.append((os.path.getmtime(path), path))
+                except OSError:
+                    by_age.append((0, path))
+            by_age.sort()
+            target = self.max_bytes * 0.9
+            for _, path in by_age:
+                if self.total_bytes <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                self.total_bytes -= self._sizes.pop(path)
+                self.evictions += 1
+
+    def query(self, code, fields, start_date, end_date, frequency='d', adjustflag='3', fetch=None):
+        """查询[start_date, end_date]的数据，返回数值化的DataFrame
+
+        fetch(code, fields, start, end, frequency, adjustflag)负责实际的网络请求，
+        默认直接调用baostock，调用方可以传入带限速的版本。
+        """
+        fetch = fetch or fetch_history
+        field_list = [f.strip() for f in fields.split(',')]
+        if frequency not in CACHEABLE_FREQUENCIES or str(adjustflag) != '3':
+            self.network_calls += 1
+            return parse_history(fetch(code, fields, start_date, end_date, frequency, adjustflag), field_list)
+
+        start = datetime.strptime(start_date, '%Y-%m-%d').date()
+        end = datetime.strptime(end_date, '%Y-%m-%d').date()
+        cutoff = date.today() - timedelta(days=CACHE_CONFIG['settle_days'])
+        segments = _month_segments(start, end)
+
+        parts = []
+        fetch_from = None
+        for seg_start, seg_end in segments:
+            if seg_end > cutoff:
+                fetch_from = max(seg_start, start)
+                break
+            cached = self._load(self._path(code, fields, seg_start, seg_end, frequency, adjustflag), code, field_list)
+            if cached is None:
+                self.misses += 1
+                fetch_from = seg_start
+                break
+            self.hits += 1
+            parts.append(cached)
+
+        if fetch_from is not None:
+            # 请求截止在一个已结算月份的中间时，把这个月取完整，才能整月写入缓存
+            last_seg_end = segments[-1][1]
+            fetch_end = last_seg_end if last_seg_end <= cutoff else end
+            self.network_calls += 1
+            fetched = parse_history(
+                fetch(code, fields, fetch_from.strftime('%Y-%m-%d'), fetch_end.strftime('%Y-%m-%d'),
+                      frequency, adjustflag), field_list)
+            fetched_dates = pd.to_datetime(fetched['date']).dt.date if len(fetched) else pd.Series([], dtype=object)
+            for seg_start, seg_end in segments:
+                if seg_start < fetch_from or seg_end > cutoff:
+                    continue
+                in_segment = ((fetched_dates >= seg_start) & (fetched_dates <= seg_end)).to_numpy()
+                self._store(self._path(code, fields, seg_start, seg_end, frequency, adjustflag),
+                            fetched[in_segment], field_list)
+            parts.append(fetched)
+
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return pd.DataFrame(columns=field_list)
+        df = pd.concat(parts, ignore_index=True)
+        return df[(df['date'] >= start_date) & (df['date'] <= end_date)].reset_index(drop=True)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'network_calls': self.network_calls,
+            'evictions': self.evictions,
+            'total_bytes': self.total_bytes,
+        }
+
+_cache = None
+
+def get_kline_cache():
+    """进程内共享的缓存实例"""
+    global _cache
+    if _cache is None:
+        _cache = KlineCache()
+    return _cache
@@ -0,0 +1,146 @@
+import baostock as bs
+import multiprocessing as mp
+import queue
+import time
+import logging
+from k_stockinfo import query_k_data
+from kline_cache import fetch_history
+from rate_control import get_default_controller
+from config import BAOSTOCK_CONFIG, INGEST_CONFIG
+
+class TokenBucket:
+    """跨进程共享的令牌桶，限制所有worker合计的请求速率"""
+
+    def __init__(self, rate, capacity=None):
+        self.capacity = capacity or max(1.0, rate)
+        self._rate = mp.Value('d', rate, lock=False)
+        self._tokens = mp.Value('d', self.capacity, lock=False)
+        self._updated = mp.Value('d', time.monotonic(), lock=False)
+        self._lock = mp.Lock()
+
+    @property
+    def rate(self):
+        return self._rate.value
+
+    @rate.setter
+    def rate(self, value):
+        with self._lock:
+            self._refill()
+            self._rate.value = value
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated.value
+        self._tokens.value = min(self.capacity, self._tokens.value + elapsed * self._rate.value)
+        self._updated.value = now
+
+    def acquire(self):
+        """阻塞直到拿到一个令牌"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens.value >= 1:
+                    self._tokens.value -= 1
+                    return
+                wait = (1 - self._tokens.value) / self._rate.value
+            time.sleep(wait)
+
+def _fetch_worker(task_queue, result_queue, bucket, use_cache):
+    """worker进程：独立登录baostock，从共享队列取任务直到收到None"""
+    lg = bs.login()
+    if lg.error_code != '0':
+        result_queue.put(('login_failed', lg.error_msg))
+        return
+
+    calls = []
+
+    def fetch(*args):
+        # 只有真正访问网络时才消耗令牌，缓存命中不受限速影响
+        bucket.acquire()
+        started = time.monotonic()
+        try:
+            data = fetch_history(*args)
+        except Exception:
+            calls.append((time.monotonic() - started, False))
+            raise
+        calls.append((time.monotonic() - started, True))
+        return data
+
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            code, start_date, end_date = task
+            calls.clear()
+            try:
+                result = (code, query_k_data(code, start_date, end_date, use_cache, fetch), None)
+            except Exception as e:
+                result = (code, None, str(e))
+            # 每次网络调用的耗时和成败交回主进程，由速率控制器统一调整令牌桶速率
+            result_queue.put(('result', result, list(calls)))
+    finally:
+        bs.logout()
+        result_queue.put(('exit', None))
+
+def fetch_k_data_parallel(tasks, workers=None, controller=None, use_cache=False):
+    """多进程并发获取K线数据
+
+    tasks为(code, start_date, end_date)列表，每个worker进程持有自己的baostock会话，
+    所有进程共用一个令牌桶限速，令牌桶的速率由主进程的AIMD控制器根据调用结果调整。
+    按完成顺序逐个yield (code, DataFrame, error)，error不为None时DataFrame为None。
+    use_cache=True时已结算月份从本地K线缓存读取。
+    """
+    tasks = list(tasks)
+    if not tasks:
+        return
+    workers = min(workers or BAOSTOCK_CONFIG['workers'], len(tasks))
+    controller = controller or get_default_controller()
+    bucket = TokenBucket(controller.rate, BAOSTOCK_CONFIG.get('burst'))
+
+    task_queue = mp.Queue()
+    # 有界结果队列：消费方处理不过来时worker阻塞，不再继续请求
+    result_queue = mp.Queue(maxsize=INGEST_CONFIG['queue_size'])
+    for task in tasks:
+        task_queue.put(task)
+    for _ in range(workers):
+        task_queue.put(None)
+
+    processes = [mp.Process(target=_fetch_worker, args=(task_queue, result_queue, bucket, use_cache), daemon=True)
+                 for _ in range(workers)]
+    for p in processes:
+        p.start()
+
+    pending = {task[0] for task in tasks}
+    alive = workers
+    try:
+        while pending and alive:
+            try:
+                message = result_queue.get(timeout=5)
+            except queue.Empty:
+                # worker异常崩溃时不会发送退出消息
+                if not any(p.is_alive() for p in processes):
+                    break
+                continue
+            kind, payload = message[:2]
+            if kind == 'result':
+                for latency, ok in message[2]:
+                    controller.record(latency, ok)
+                bucket.rate = controller.rate
+                pending.discard(payload[0])
+                yield payload
+            elif kind == 'login_failed':
+                logging.error(f"Baostock login failed in fetch worker: {payload}")
+                alive -= 1
+            else:
+                alive -= 1
+
+        # 所有worker都已退出（例如登录失败），剩余代码按失败返回
+        for code in sorted(pending):
+            yield code, None, "no fetch worker available"
+    finally:
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+            p.join()
+        controller.export()
@@ -0,0 +1,218 @@
+"""stock_kline数据完整性扫描与重复行修复
+
+按股票代码分段扫描：每段code_batch只股票一条区间查询，沿(code, date)索引（紧凑布局沿主键）顺序读取，
+不做整表排序，也不长时间占用连接；每只股票的行都在同一段内，逐段做向量化检查。检查项：
+  - 重复的(code, date)行
+  - 相邻两根K线之间缺失的交易日（对照本地交易日历）
+  - 落在非交易日的K线
+  - OHLC不一致：high低于开收盘、low高于开收盘、low高于high、正常交易却价格非正
+  - 成交量为0的K线（区分停牌和正常交易状态）
+--repair时按小批量删除重复行（每组保留id最大、即最后写入的一行），然后补建(code, date)唯一索引；
+紧凑布局以(code_id, date)为主键，不会有重复行，--repair直接报错。
+
+    python kline_integrity.py [--repair]
+"""
+import os
+import json
+import time
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+from db_pool import get_connection
+from k_stockinfo import ensure_kline_unique_key
+from kline_schema import get_kline_layout, COMPACT_TABLE, CODE_DICT_TABLE
+from kline_ledger import rebuild_ledger
+from trade_calendar import get_trade_calendar
+from config import INTEGRITY_CONFIG
+
+SCAN_COLUMNS = ['id', 'code', 'date', 'open', 'high', 'low', 'close', 'volume', 'tradestatus']
+
+# (code, date)二级索引包含主键id，按code, date, id排序直接走索引
+LEGACY_CODES_SQL = "SELECT DISTINCT code FROM stock_kline ORDER BY code"
+LEGACY_SCAN_SQL = """
+SELECT id, code, date, open, high, low, close, volume, tradestatus
+FROM stock_kline
+WHERE code BETWEEN %s AND %s
+ORDER BY code, date, id
+"""
+
+# 紧凑布局按主键区间扫描，不经过视图；价格单位为分，不影响相对检查
+COMPACT_CODES_SQL = f"SELECT code_id FROM {CODE_DICT_TABLE} ORDER BY code_id"
+COMPACT_SCAN_SQL = f"""
+SELECT NULL AS id, d.code, k.date, k.open, k.high, k.low, k.close, k.volume, k.tradestatus
+FROM {COMPACT_TABLE} k
+JOIN {CODE_DICT_TABLE} d ON d.code_id = k.code_id
+WHERE k.code_id BETWEEN %s AND %s
+ORDER BY k.code_id, k.date
+"""
+
+def _new_report(layout):
+    return {
+        'layout': layout,
+        'rows_scanned': 0,
+        'codes': 0,
+        'duplicates': {'rows': 0, 'samples': []},
+        'gaps': {'segments': 0, 'missing_days': 0, 'samples': []},
+        'off_calendar': {'rows': 0, 'samples': []},
+        'ohlc_errors': {'rows': 0, 'samples': []},
+        'zero_volume': {'rows': 0, 'trading_rows': 0, 'samples': []},
+    }
+
+def _add_samples(section, records):
+    room = INTEGRITY_CONFIG['sample_size'] - len(section['samples'])
+    if room > 0:
+        section['samples'].extend(records[:room])
+
+def check_chunk(df, report, calendar):
+    """对一块按(code, date, id)排好序的数据做全部检查，返回需要删除的重复行id"""
+    report['rows_scanned'] += len(df)
+    report['codes'] += df['code'].nunique()
+
+    # 重复行：同一(code, date)保留最后一行（id最大）
+    dup_mask = df.duplicated(['code', 'date'], keep='last').to_numpy()
+    dup_ids = df.loc[dup_mask, 'id'].dropna().astype('int64').tolist()
+    report['duplicates']['rows'] += int(dup_mask.sum())
+    if dup_mask.any():
+        _add_samples(report['duplicates'], [
+            {'code': code, 'date': str(day)} for code, day in zip(df.loc[dup_mask, 'code'], df.loc[dup_mask, 'date'])])
+    df = df[~dup_mask]
+
+    codes = df['code'].to_numpy()
+    dates = pd.to_datetime(df['date']).to_numpy().astype('datetime64[D]')
+    o, h, l, c = (pd.to_numeric(df[col], errors='coerce').to_numpy(dtype='float64')
+                  for col in ('open', 'high', 'low', 'close'))
+    volume = pd.to_numeric(df['volume'], errors='coerce').fillna(0).to_numpy()
+    trading = pd.to_numeric(df['tradestatus'], errors='coerce').fillna(1).to_numpy() == 1
+
+    if calendar is not None and len(df):
+        days = calendar.days64
+        covered = (dates >= days[0]) & (dates <= np.datetime64(calendar.covered_until, 'D'))
+        pos = np.searchsorted(days, dates)
+        on_calendar = covered & (days[np.minimum(pos, len(days) - 1)] == dates)
+        off = covered & ~on_calendar
+        report['off_calendar']['rows'] += int(off.sum())
+        if off.any():
+            _add_samples(report['off_calendar'], [
+                {'code': code, 'date': str(day)} for code, day in zip(codes[off], dates[off])])
+
+        # 相邻两行属于同一只股票且都在日历内时，交易日序号之差减1即缺失天数
+        step = pos[1:] - pos[:-1]
+        gap = (codes[1:] == codes[:-1]) & on_calendar[1:] & on_calendar[:-1] & (step > 1)
+        report['gaps']['segments'] += int(gap.sum())
+        report['gaps']['missing_days'] += int((step[gap] - 1).sum())
+        if gap.any():
+            idx = np.flatnonzero(gap)
+            _add_samples(report['gaps'], [
+                {'code': codes[i], 'after': str(dates[i]), 'before': str(dates[i + 1]), 'missing': int(step[i] - 1)}
+                for i in idx])
+
+    with np.errstate(invalid='ignore'):
+        bad = ((h < np.maximum(o, c)) | (l > np.minimum(o, c)) | (l > h) | (trading & (l <= 0))
+               | np.isnan(o) | np.isnan(h) | np.isnan(l) | np.isnan(c))
+    report['ohlc_errors']['rows'] += int(bad.sum())
+    if bad.any():
+        _add_samples(report['ohlc_errors'], [
+            {'code': code, 'date': str(day), 'open': float(vo), 'high': float(vh), 'low': float(vl), 'close': float(vc)}
+            for code, day, vo, vh, vl, vc in zip(codes[bad], dates[bad], o[bad], h[bad], l[bad], c[bad])])
+
+    zero = volume == 0
+    report['zero_volume']['rows'] += int(zero.sum())
+    report['zero_volume']['trading_rows'] += int((zero & trading).sum())
+    if (zero & trading).any():
+        _add_samples(report['zero_volume'], [
+            {'code': code, 'date': str(day)} for code, day in zip(codes[zero & trading], dates[zero & trading])])
+    return dup_ids
+
+def scan_kline(conn, code_batch=None):
+    """按股票代码分段扫描stock_kline，返回(报告, 待删除的重复行id)"""
+    code_batch = code_batch or INTEGRITY_CONFIG['code_batch']
+    layout = get_kline_layout(conn)
+    report = _new_report(layout)
+    calendar = get_trade_calendar()
+    if calendar is None:
+        logging.warning("Trade calendar unavailable, gap and off-calendar checks skipped")
+    compact = layout == 'compact'
+
+    dup_ids = []
+    cursor = conn.cursor()
+    try:
+        cursor.execute(COMPACT_CODES_SQL if compact else LEGACY_CODES_SQL)
+        keys = [row[0] for row in cursor.fetchall()]
+        for i in range(0, len(keys), code_batch):
+            chunk = keys[i:i + code_batch]
+            cursor.execute(COMPACT_SCAN_SQL if compact else LEGACY_SCAN_SQL, (chunk[0], chunk[-1]))
+            rows = cursor.fetchall()
+            if rows:
+                dup_ids.extend(check_chunk(pd.DataFrame(list(rows), columns=SCAN_COLUMNS), report, calendar))
+            logging.info(f"Scanned {min(i + code_batch, len(keys))}/{len(keys)} codes, {report['rows_scanned']} rows")
+    finally:
+        cursor.close()
+    return report, dup_ids
+
+def delete_duplicates(conn, ids):
+    """按主键小批量删除，每批一个短事务，不长时间锁表"""
+    batch = INTEGRITY_CONFIG['delete_batch_rows']
+    cursor = conn.cursor()
+    deleted = 0
+    try:
+        for i in range(0, len(ids), batch):
+            chunk = ids[i:i + batch]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            deleted += cursor.execute(f"DELETE FROM stock_kline WHERE id IN ({placeholders})", chunk)
+            conn.commit()
+            time.sleep(INTEGRITY_CONFIG['delete_sleep_seconds'])
+    finally:
+        cursor.close()
+    return deleted
+
+def run_integrity_check(repair=False, code_batch=None, report_path=None):
+    started = time.monotonic()
+    conn = get_connection()
+    try:
+        if repair and get_kline_layout(conn) == 'compact':
+            raise RuntimeError(f"stock_kline is a view over {COMPACT_TABLE}, whose (code_id, date) primary key "
+                               f"rules out duplicate rows; --repair only applies to the legacy table")
+        report, dup_ids = scan_kline(conn, code_batch)
+    finally:
+        conn.close()
+
+    report['repaired'] = 0
+    if repair and dup_ids:
+        conn = get_connection()
+        try:
+            report['repaired'] = delete_duplicates(conn, dup_ids)
+            report['unique_key'] = ensure_kline_unique_key(conn)
+            # 按日台账里的行数包含了被删除的重复行
+            rebuild_ledger(conn)
+        finally:
+            conn.close()
+    report['seconds'] = round(time.monotonic() - started, 1)
+
+    report_path = report_path or INTEGRITY_CONFIG['report_path']
+    os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+    with open(report_path, 'w') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Scan stock_kline for duplicates, gaps and inconsistent bars")
+    parser.add_argument('--repair', action='store_true', help="delete duplicate (code, date) rows in small batches")
+    parser.add_argument('--code-batch', type=int, default=None, help="codes per ranged query")
+    parser.add_argument('--report', default=None, help="JSON report path")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        report = run_integrity_check(args.repair, args.code_batch, args.report)
+    except RuntimeError as e:
+        parser.error(str(e))
+    print(f"扫描 {report['rows_scanned']} 行, {report['codes']} 只股票, 用时 {report['seconds']}s")
+    print(f"- 重复行: {report['duplicates']['rows']} (已删除 {report['repaired']})")
+    print(f"- 缺失交易日: {report['gaps']['missing_days']} 天, {report['gaps']['segments']} 处")
+    print(f"- 非交易日K线: {report['off_calendar']['rows']}")
+    print(f"- OHLC不一致: {report['ohlc_errors']['rows']}")
+    print(f"- 成交量为0: {report['zero_volume']['rows']} (其中正常交易状态 {report['zero_volume']['trading_rows']})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""按交易日汇总的K线入库台账
+
+写入路径（k_stockinfo.write_prepared_k_data）在提交每批数据的同一个事务里更新kline_ingest_ledger：
+  rows_written   该日累计写入的行数（含重复写入）
+  codes_covered  该日在stock_kline中已有数据的股票数
+  first_update / last_update  该日数据首次/最近一次写入的时间
+  error_count    最近一次每日更新中以该日为目标日期、最终仍失败的股票数
+检查脚本只需按主键读一行，不必扫描stock_kline。LOAD DATA等绕过写入路径的操作之后调用rebuild_ledger()。
+
+    python kline_ledger.py [--rebuild] [--days 10]
+"""
+import argparse
+from collections import Counter
+from datetime import datetime
+from kline_schema import get_kline_layout, COMPACT_TABLE
+from config import INGEST_CONFIG
+
+LEDGER_TABLE = 'kline_ingest_ledger'
+LEDGER_COLUMNS = ['trade_date', 'rows_written', 'codes_covered', 'first_update', 'last_update', 'error_count']
+
+CREATE_LEDGER_SQL = f"""
+CREATE TABLE IF NOT EXISTS {LEDGER_TABLE} (
+    trade_date DATE PRIMARY KEY,
+    rows_written INT UNSIGNED NOT NULL DEFAULT 0,
+    codes_covered INT UNSIGNED NOT NULL DEFAULT 0,
+    first_update DATETIME,
+    last_update DATETIME,
+    error_count INT UNSIGNED NOT NULL DEFAULT 0
+)
+"""
+
+RECORD_BATCH_SQL = f"""
+INSERT INTO {LEDGER_TABLE} (trade_date, rows_written, codes_covered, first_update, last_update)
+VALUES (%s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+    rows_written = rows_written + VALUES(rows_written),
+    codes_covered = codes_covered + VALUES(codes_covered),
+    first_update = COALESCE(first_update, VALUES(first_update)),
+    last_update = VALUES(last_update)
+"""
+
+_ledger_ready = False
+
+def ensure_ledger_table(conn):
+    global _ledger_ready
+    if not _ledger_ready:
+        cursor = conn.cursor()
+        cursor.execute(CREATE_LEDGER_SQL)
+        conn.commit()
+        cursor.close()
+        _ledger_ready = True
+
+def count_existing(cursor, compact, keys):
+    """keys为不重复的[(code或code_id, date)]，按(code, date)索引查询，返回{date: 已存在的行数}
+
+    行构造器IN列表过长时优化器可能放弃区间查找，每条查询最多ledger_lookup_keys个键。
+    """
+    table, key_col = (COMPACT_TABLE, 'code_id') if compact else ('stock_kline', 'code')
+    step = INGEST_CONFIG['ledger_lookup_keys']
+    existing = Counter()
+    for i in range(0, len(keys), step):
+        chunk = keys[i:i + step]
+        placeholders = ', '.join(['(%s, %s)'] * len(chunk))
+        cursor.execute(f"SELECT date, COUNT(*) FROM {table} WHERE ({key_col}, date) IN ({placeholders}) GROUP BY date",
+                       [value for key in chunk for value in key])
+        for day, count in cursor.fetchall():
+            existing[str(day)] += count
+    return existing
+
+def prepare_batch(cursor, compact, rows, update_time):
+    """在写入rows之前调用：统计每个日期的新增股票数
+
+    rows的前两列是(code或code_id, date)，两种布局的写入行都满足。同一批里重复的键只保留最后一行
+    （baostock偶尔会重复返回同一根K线），否则每个副本都会被算作新增。
+    返回(去重后要写入的行, 写入后用于更新台账的参数)。
+    """
+    unique = {}
+    for row in rows:
+        unique[(row[0], row[1])] = row
+    keys = list(unique)
+    existing = count_existing(cursor, compact, keys)
+    per_date = Counter(str(day) for _, day in keys)
+    ledger_rows = [(day, count, count - existing.get(day, 0), update_time, update_time)
+                   for day, count in per_date.items()]
+    return list(unique.values()), ledger_rows
+
+def apply_batch(cursor, ledger_rows):
+    if ledger_rows:
+        cursor.executemany(RECORD_BATCH_SQL, ledger_rows)
+
+def record_errors(conn, trade_date, error_count):
+    """记录以trade_date为目标日期的一次更新最终失败的股票数"""
+    ensure_ledger_table(conn)
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        INSERT INTO {LEDGER_TABLE} (trade_date, error_count) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE error_count = VALUES(error_count)
+    """, (str(trade_date), error_count))
+    conn.commit()
+    cursor.close()
+
+def reset_ledger(conn):
+    ensure_ledger_table(conn)
+    cursor = conn.cursor()
+    cursor.execute(f"TRUNCATE TABLE {LEDGER_TABLE}")
+    cursor.close()
+
+def rebuild_ledger(conn):
+    """按stock_kline现有数据重建台账（整表扫描一次），返回日期数；错误数清零"""
+    ensure_ledger_table(conn)
+    compact = get_kline_layout(conn) == 'compact'
+    table = COMPACT_TABLE if compact else 'stock_kline'
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"DELETE FROM {LEDGER_TABLE}")
+        cursor.execute(f"""
+            INSERT INTO {LEDGER_TABLE} (trade_date, rows_written, codes_covered, first_update, last_update)
+            SELECT date, COUNT(*), COUNT(*), MIN(update_time), MAX(update_time)
+            FROM {table}
+            GROUP BY date
+        """)
+        count = cursor.rowcount
+        conn.commit()
+    finally:
+        cursor.close()
+    return count
+
+def _fetch_dicts(cursor):
+    return [dict(zip(LEDGER_COLUMNS, row)) for row in cursor.fetchall()]
+
+def get_ledger_entry(conn, trade_date):
+    """单个交易日的台账，没有记录时返回None"""
+    ensure_ledger_table(conn)
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {', '.join(LEDGER_COLUMNS)} FROM {LEDGER_TABLE} WHERE trade_date = %s",
+                   (str(trade_date),))
+    rows = _fetch_dicts(cursor)
+    cursor.close()
+    return rows[0] if rows else None
+
+def get_recent_ledger(conn, limit=10):
+    """最近limit个有数据的交易日，按日期降序"""
+    ensure_ledger_table(conn)
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {', '.join(LEDGER_COLUMNS)} FROM {LEDGER_TABLE} "
+                   f"WHERE codes_covered > 0 ORDER BY trade_date DESC LIMIT %s", (limit,))
+    rows = _fetch_dicts(cursor)
+    cursor.close()
+    return rows
+
+def count_active_codes(conn):
+    """stock_codes中正常交易的股票数，用来判断某天的数据是否齐全"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM stock_codes WHERE trade_status = '1'")
+    count = cursor.fetchone()[0]
+    cursor.close()
+    return count
+
+def main():
+    from db_pool import get_connection
+
+    parser = argparse.ArgumentParser(description="Show or rebuild the per-date kline ingestion ledger")
+    parser.add_argument('--rebuild', action='store_true', help="rebuild the ledger from stock_kline")
+    parser.add_argument('--days', type=int, default=10)
+    args = parser.parse_args()
+
+    conn = get_connection()
+    try:
+        if args.rebuild:
+            started = datetime.now()
+            print(f"Rebuilt ledger for {rebuild_ledger(conn)} dates in {(datetime.now() - started).seconds}s")
+        active = count_active_codes(conn)
+        for entry in get_recent_ledger(conn, args.days):
+            print(f"{entry['trade_date']}: {entry['codes_covered']}/{active} codes, "
+                  f"{entry['rows_written']} rows written, errors {entry['error_count']}, "
+                  f"last update {entry['last_update']}")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""K线快速读取：服务端游标逐块读取，按列直接写入预分配的float64/int64数组
+
+pd.read_sql经pymysql读出的DECIMAL列是Decimal对象，整列为object类型，rolling等计算走逐元素的Python运算。
+这里按列声明类型，每块fetchmany的结果转置后一次性转换写入预分配数组（不够时翻倍），
+不生成中间的对象列：
+
+    from kline_loader import load_stock_kline
+    df = load_stock_kline(conn, 'sh.600000', start_date='2024-01-01')   # 各列已是float64/int64
+"""
+import numpy as np
+import pandas as pd
+import logging
+import pymysql
+from kline_schema import CODE_DICT_TABLE, get_kline_layout
+from config import LOADER_CONFIG
+
+# stock_kline各列读出后的类型，未列出的列按object处理（如股票名称）
+KLINE_DTYPES = {
+    'code': 'object',
+    'date': 'datetime64[D]',
+    'open': 'float64',
+    'high': 'float64',
+    'low': 'float64',
+    'close': 'float64',
+    'volume': 'int64',
+    'amount': 'float64',
+    'adjustflag': 'int64',
+    'turn': 'float64',
+    'tradestatus': 'int64',
+    'pctChg': 'float64',
+    'peTTM': 'float64',
+    'pbMRQ': 'float64',
+    'psTTM': 'float64',
+    'pcfNcfTTM': 'float64',
+    'update_time': 'datetime64[s]',
+}
+
+DEFAULT_COLUMNS = ['code', 'date', 'open', 'high', 'low', 'close', 'volume', 'amount', 'adjustflag', 'turn']
+
+def _convert(values, dtype):
+    """一块数据中的一列（元组）转换为目标类型，NULL在浮点列为NaN、整数列为0"""
+    if dtype == 'float64':
+        return np.array(values, dtype='float64')
+    if dtype == 'int64':
+        if None in values:
+            values = [0 if value is None else value for value in values]
+        return np.array(values, dtype='int64')
+    if dtype.startswith('datetime64'):
+        return np.array(values, dtype=dtype)
+    return np.array(values, dtype='object')
+
+def fetch_columns(conn, sql, params=None, columns=None, dtypes=None, size_hint=None):
+    """执行sql并按列返回{列名: ndarray}
+
+    columns为结果集的列名（与SELECT顺序一致），默认取游标描述；dtypes覆盖KLINE_DTYPES；
+    size_hint为预计行数，用于一次分配到位。
+    """
+    dtypes = {**KLINE_DTYPES, **(dtypes or {})}
+    fetch_rows = LOADER_CONFIG['fetch_rows']
+    cursor = conn.cursor(pymysql.cursors.SSCursor)
+    try:
+        cursor.execute(sql, params)
+        columns = columns or [desc[0] for desc in cursor.description]
+        types = [dtypes.get(col, 'object') for col in columns]
+        capacity = max(size_hint or LOADER_CONFIG['initial_rows'], 1)
+        arrays = [np.empty(capacity, dtype=dtype) for dtype in types]
+        n = 0
+        while True:
+            rows = cursor.fetchmany(fetch_rows)
+            if not rows:
+                break
+            if n + len(rows) > capacity:
+                while n + len(rows) > capacity:
+                    capacity *= 2
+                for i, array in enumerate(arrays):
+                    grown = np.empty(capacity, dtype=array.dtype)
+                    grown[:n] = array[:n]
+                    arrays[i] = grown
+            for array, values, dtype in zip(arrays, zip(*rows), types):
+                array[n:n + len(rows)] = _convert(values, dtype)
+            n += len(rows)
+    finally:
+        cursor.close()
+    return {col: array[:n] for col, array in zip(columns, arrays)}
+
+def read_frame(conn, sql, params=None, columns=None, dtypes=None, size_hint=None):
+    """fetch_columns的DataFrame版本，日期列为datetime64"""
+    return pd.DataFrame(fetch_columns(conn, sql, params, columns, dtypes, size_hint), copy=False)
+
+def load_stock_kline(conn, code, start_date=None, end_date=None, columns=None, size_hint=None):
+    """单只股票按日期升序的K线"""
+    columns = columns or DEFAULT_COLUMNS
+    sql = f"SELECT {', '.join(columns)} FROM stock_kline WHERE code = %s"
+    params = [code]
+    if start_date is not None:
+        sql += " AND date >= %s"
+        params.append(str(start_date))
+    if end_date is not None:
+        sql += " AND date <= %s"
+        params.append(str(end_date))
+    return read_frame(conn, sql + " ORDER BY date", params, columns, size_hint=size_hint)
+
+def kline_codes(conn):
+    """K线表与stock_codes中代码的并集（升序）
+
+    已退市或被剔除出stock_codes、但K线表里还有数据的代码也要包含在内，这类代码记一条日志。
+    紧凑布局从代码字典表取K线表中的代码，不经过视图做DISTINCT。
+    """
+    cursor = conn.cursor()
+    try:
+        if get_kline_layout(conn) == 'compact':
+            cursor.execute(f"SELECT code FROM {CODE_DICT_TABLE}")
+        else:
+            cursor.execute("SELECT DISTINCT code FROM stock_kline")
+        kline = {row[0] for row in cursor.fetchall()}
+        cursor.execute("SELECT code FROM stock_codes")
+        listed = {row[0] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+    unlisted = kline - listed
+    if unlisted:
+        logging.warning(f"{len(unlisted)} codes have kline rows but are not in stock_codes "
+                        f"(e.g. {', '.join(sorted(unlisted)[:5])}), including them anyway")
+    return sorted(kline | listed)
@@ -0,0 +1,194 @@
+"""stock_kline的本地Parquet镜像
+
+数据集按year=YYYY/month=MM分区，每个月一个文件，文件内按(code, date)排序，
+行组的code/date统计信息可以让读取时跳过无关行组。增量同步根据按日台账(kline_ingest_ledger)
+找出上次同步之后有写入的月份，只重写这些月份的文件。
+
+    from kline_parquet import read_kline
+    df = read_kline('2024-01-01', '2024-12-31', columns=['close', 'volume'])
+
+    python kline_parquet.py [--rebuild]
+"""
+import os
+import json
+import shutil
+import argparse
+import logging
+from datetime import date, datetime
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from kline_ledger import LEDGER_TABLE, ensure_ledger_table
+from kline_loader import kline_codes, read_frame
+from config import PARQUET_CONFIG
+
+KLINE_COLUMNS = ['code', 'date', 'open', 'high', 'low', 'close', 'volume', 'amount', 'adjustflag', 'turn',
+                 'tradestatus', 'pctChg', 'peTTM', 'pbMRQ', 'psTTM', 'pcfNcfTTM', 'update_time']
+
+SCHEMA = pa.schema([
+    ('code', pa.string()),
+    ('date', pa.date32()),
+    ('open', pa.float64()),
+    ('high', pa.float64()),
+    ('low', pa.float64()),
+    ('close', pa.float64()),
+    ('volume', pa.int64()),
+    ('amount', pa.float64()),
+    ('adjustflag', pa.int8()),
+    ('turn', pa.float64()),
+    ('tradestatus', pa.int8()),
+    ('pctChg', pa.float64()),
+    ('peTTM', pa.float64()),
+    ('pbMRQ', pa.float64()),
+    ('psTTM', pa.float64()),
+    ('pcfNcfTTM', pa.float64()),
+    ('update_time', pa.timestamp('s')),
+])
+
+def _state_path(root):
+    return os.path.join(root, '_state.json')
+
+def _month_path(root, year, month):
+    return os.path.join(root, f"year={year}", f"month={month:02d}", 'part.parquet')
+
+def _to_table(df):
+    """把K线DataFrame转换成固定schema的Arrow表"""
+    out = {}
+    for field in SCHEMA:
+        col = df[field.name]
+        if field.name == 'code':
+            out[field.name] = col.astype(str)
+        elif field.name == 'date':
+            out[field.name] = pd.to_datetime(col).dt.date
+        elif field.name == 'update_time':
+            out[field.name] = pd.to_datetime(col)
+        elif pa.types.is_integer(field.type):
+            out[field.name] = pd.to_numeric(col, errors='coerce').fillna(0).astype('int64')
+        else:
+            out[field.name] = pd.to_numeric(col, errors='coerce').astype('float64')
+    return pa.Table.from_pandas(pd.DataFrame(out), schema=SCHEMA, preserve_index=False)
+
+def write_month(root, year, month, df):
+    """按(code, date)排序后整月重写，先写临时文件再替换"""
+    path = _month_path(root, year, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df = df.sort_values(['code', 'date'], kind='mergesort')
+    # 以.开头的临时文件不会被数据集扫描到
+    tmp_path = os.path.join(os.path.dirname(path), '.part.parquet.tmp')
+    pq.write_table(_to_table(df), tmp_path, row_group_size=PARQUET_CONFIG['row_group_rows'],
+                   compression='zstd')
+    os.replace(tmp_path, path)
+
+def _changed_months(conn, synced_at):
+    """台账中last_update晚于synced_at的(year, month)，以及其中最新的last_update"""
+    ensure_ledger_table(conn)
+    cursor = conn.cursor()
+    if synced_at:
+        cursor.execute(f"SELECT trade_date, last_update FROM {LEDGER_TABLE} "
+                       f"WHERE codes_covered > 0 AND last_update > %s", (synced_at,))
+    else:
+        cursor.execute(f"SELECT trade_date, last_update FROM {LEDGER_TABLE} WHERE codes_covered > 0")
+    rows = cursor.fetchall()
+    cursor.close()
+    if not rows:
+        return [], synced_at
+    return sorted({(day.year, day.month) for day, _ in rows}), str(max(last for _, last in rows))
+
+def _load_range(conn, codes, start_date, end_date):
+    """按股票分批读取[start_date, end_date]的K线，每批走(code, date)索引"""
+    frames = []
+    batch = PARQUET_CONFIG['code_batch']
+    for i in range(0, len(codes), batch):
+        chunk = codes[i:i + batch]
+        placeholders = ', '.join(['%s'] * len(chunk))
+        frames.append(read_frame(
+            conn, f"SELECT {', '.join(KLINE_COLUMNS)} FROM stock_kline "
+                  f"WHERE code IN ({placeholders}) AND date BETWEEN %s AND %s",
+            tuple(chunk) + (str(start_date), str(end_date)), KLINE_COLUMNS))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=KLINE_COLUMNS)
+
+def sync_parquet(conn=None, root=None, rebuild=False):
+    """把台账显示有变化的月份从MySQL重写到Parquet，返回重写的月份数"""
+    from db_pool import get_connection  # 避免导入期依赖数据库模块
+
+    root = root or PARQUET_CONFIG['dir']
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
+    try:
+        if rebuild and os.path.exists(root):
+            shutil.rmtree(root)
+        os.makedirs(root, exist_ok=True)
+        state = {}
+        if os.path.exists(_state_path(root)):
+            with open(_state_path(root)) as f:
+                state = json.load(f)
+        months, synced_at = _changed_months(conn, state.get('synced_at'))
+        if not months:
+            return 0
+
+        codes = kline_codes(conn)
+
+        # 一次读取一年内所有有变化的月份，内存占用以一年的全市场数据为上限
+        for year in sorted({year for year, _ in months}):
+            year_months = [month for y, month in months if y == year]
+            start = date(year, year_months[0], 1)
+            end = (pd.Timestamp(date(year, year_months[-1], 1)) + pd.offsets.MonthEnd(0)).date()
+            df = _load_range(conn, codes, start, end)
+            if df.empty:
+                continue
+            month_of = pd.to_datetime(df['date']).dt.month
+            for month in year_months:
+                part = df[(month_of == month).to_numpy()]
+                if len(part):
+                    write_month(root, year, month, part)
+            logging.info(f"Parquet mirror: rewrote {len(year_months)} months of {year}")
+
+        state['synced_at'] = synced_at
+        tmp_path = f"{_state_path(root)}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, _state_path(root))
+        return len(months)
+    finally:
+        if own_conn:
+            conn.close()
+
+def read_kline(start_date=None, end_date=None, codes=None, columns=None, root=None):
+    """从Parquet镜像读取K线
+
+    日期范围同时下推到year分区和行组统计信息，codes下推为code的isin过滤，
+    columns只读取需要的列（code和date总会返回）。
+    """
+    root = root or PARQUET_CONFIG['dir']
+    dataset = ds.dataset(root, format='parquet', partitioning='hive')
+    conditions = []
+    if start_date is not None:
+        start = pd.Timestamp(start_date).date()
+        conditions += [ds.field('year') >= start.year, ds.field('date') >= start]
+    if end_date is not None:
+        end = pd.Timestamp(end_date).date()
+        conditions += [ds.field('year') <= end.year, ds.field('date') <= end]
+    if codes is not None:
+        conditions.append(ds.field('code').isin(list(codes)))
+    row_filter = None
+    for condition in conditions:
+        row_filter = condition if row_filter is None else row_filter & condition
+    if columns is not None:
+        columns = ['code', 'date'] + [col for col in columns if col not in ('code', 'date')]
+    else:
+        columns = KLINE_COLUMNS
+    return dataset.to_table(columns=columns, filter=row_filter).to_pandas()
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync the partitioned Parquet mirror of stock_kline")
+    parser.add_argument('--rebuild', action='store_true', help="discard the mirror and export everything again")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    started = datetime.now()
+    months = sync_parquet(rebuild=args.rebuild)
+    print(f"Rewrote {months} months in {(datetime.now() - started).total_seconds():.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""stock_kline的紧凑存储布局
+
+紧凑布局下数据存放在stock_kline_compact：
+  - 主键(code_id, date)即聚簇索引，按代码的区间查询是顺序读
+  - 按年RANGE分区，旧年份可以整个分区删除
+  - 股票代码字典编码为SMALLINT code_id（stock_code_dict表）
+  - 价格和成交额存为整数分，比率存为FLOAT，恒为3的adjustflag不再存储
+原来的stock_kline换成同名视图，列名和类型与旧表一致，读取方无需修改；
+写入方通过get_kline_layout()判断布局，紧凑布局下直接写stock_kline_compact。
+迁移见migrate_kline_schema.py。
+"""
+from datetime import datetime
+
+COMPACT_TABLE = 'stock_kline_compact'
+CODE_DICT_TABLE = 'stock_code_dict'
+LEGACY_TABLE = 'stock_kline_legacy'
+
+# 以分为单位存储的列
+CENT_COLUMNS = ['open', 'high', 'low', 'close', 'amount']
+COMPACT_COLUMNS = ['code_id', 'date', 'open', 'high', 'low', 'close', 'volume', 'amount',
+                   'turn', 'tradestatus', 'pctChg', 'peTTM', 'pbMRQ', 'psTTM', 'pcfNcfTTM', 'update_time']
+
+CREATE_CODE_DICT_SQL = f"""
+CREATE TABLE IF NOT EXISTS {CODE_DICT_TABLE} (
+    code_id SMALLINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+    code VARCHAR(20) NOT NULL,
+    UNIQUE KEY uk_code (code)
+)
+"""
+
+CREATE_COMPACT_SQL = f"""
+CREATE TABLE IF NOT EXISTS {COMPACT_TABLE} (
+    code_id SMALLINT UNSIGNED NOT NULL,
+    date DATE NOT NULL,
+    open INT UNSIGNED,
+    high INT UNSIGNED,
+    low INT UNSIGNED,
+    close INT UNSIGNED,
+    volume BIGINT UNSIGNED,
+    amount BIGINT UNSIGNED,
+    turn FLOAT,
+    tradestatus TINYINT UNSIGNED,
+    pctChg FLOAT,
+    peTTM FLOAT,
+    pbMRQ FLOAT,
+    psTTM FLOAT,
+    pcfNcfTTM FLOAT,
+    update_time DATETIME,
+    PRIMARY KEY (code_id, date)
+)
+PARTITION BY RANGE COLUMNS(date) (
+{{partitions}}
+)
+"""
+
+# 兼容视图：列名、顺序和类型与旧stock_kline一致（没有id列）
+COMPAT_VIEW_SELECT = f"""
+SELECT d.code AS code, k.date AS date,
+       CAST(k.open / 100 AS DECIMAL(10,2)) AS open,
+       CAST(k.high / 100 AS DECIMAL(10,2)) AS high,
+       CAST(k.low / 100 AS DECIMAL(10,2)) AS low,
+       CAST(k.close / 100 AS DECIMAL(10,2)) AS close,
+       k.volume AS volume,
+       CAST(k.amount / 100 AS DECIMAL(16,2)) AS amount,
+       3 AS adjustflag,
+       CAST(k.turn AS DECIMAL(10,2)) AS turn,
+       k.tradestatus AS tradestatus,
+       CAST(k.pctChg AS DECIMAL(10,2)) AS pctChg,
+       CAST(k.peTTM AS DECIMAL(10,2)) AS peTTM,
+       CAST(k.pbMRQ AS DECIMAL(10,2)) AS pbMRQ,
+       CAST(k.psTTM AS DECIMAL(10,2)) AS psTTM,
+       CAST(k.pcfNcfTTM AS DECIMAL(10,2)) AS pcfNcfTTM,
+       k.update_time AS update_time
+FROM {COMPACT_TABLE} k
+JOIN {CODE_DICT_TABLE} d ON d.code_id = k.code_id
+"""
+
+UPSERT_COMPACT_SQL = f"""
+INSERT INTO {COMPACT_TABLE} ({', '.join(COMPACT_COLUMNS)})
+VALUES ({', '.join(['%s'] * len(COMPACT_COLUMNS))})
+ON DUPLICATE KEY UPDATE
+    {', '.join(f'{col} = VALUES({col})' for col in COMPACT_COLUMNS[2:])}
+"""
+
+# LOAD DATA读取stock_kline列顺序的CSV，在服务端完成代码编码和单位换算
+LOAD_COMPACT_SQL = f"""
+LOAD DATA LOCAL INFILE %s INTO TABLE {COMPACT_TABLE}
+FIELDS TERMINATED BY ',' LINES TERMINATED BY '\\n'
+(@code, date, @open, @high, @low, @close, volume, @amount,
+ @adjustflag, turn, tradestatus, pctChg, peTTM, pbMRQ, psTTM, pcfNcfTTM, update_time)
+SET code_id = (SELECT code_id FROM {CODE_DICT_TABLE} WHERE code = @code),
+    open = ROUND(@open * 100), high = ROUND(@high * 100), low = ROUND(@low * 100),
+    close = ROUND(@close * 100), amount = ROUND(@amount * 100)
+"""
+
+COMPACT_WATERMARKS_SQL = f"""
+SELECT d.code, k.date, k.tradestatus
+FROM {COMPACT_TABLE} k
+JOIN (SELECT code_id, MAX(date) AS last_date FROM {COMPACT_TABLE} GROUP BY code_id) m
+  ON k.code_id = m.code_id AND k.date = m.last_date
+JOIN {CODE_DICT_TABLE} d ON d.code_id = k.code_id
+"""
+
+_layouts = {}
+
+def get_kline_layout(conn):
+    """stock_kline是视图时为'compact'，普通表（或尚不存在）时为'legacy'
+
+    布局只在迁移工具切换时改变，按数据库缓存在进程内，每批写入不必再查information_schema；
+    swap_in_view切换后调用clear_layout_cache()，其他长期运行的进程需要重启。
+    """
+    key = getattr(conn, 'db', None)
+    layout = _layouts.get(key)
+    if layout is not None:
+        return layout
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT TABLE_TYPE FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'stock_kline'
+        """)
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    layout = _layouts[key] = 'compact' if row and row[0] == 'VIEW' else 'legacy'
+    return layout
+
+def clear_layout_cache():
+    _layouts.clear()
+
+_code_ids = {}
+
+def get_code_ids(conn, codes):
+    """返回{code: code_id}，字典中没有的代码先登记
+
+    只插入确实缺失的代码：INSERT IGNORE会消耗自增值，SMALLINT的code_id经不起每天浪费几千个。
+    """
+    codes = set(codes)
+    missing = [code for code in codes if code not in _code_ids]
+    if missing:
+        cursor = conn.cursor()
+        try:
+            placeholders = ', '.join(['%s'] * len(missing))
+            cursor.execute(f"SELECT code, code_id FROM {CODE_DICT_TABLE} WHERE code IN ({placeholders})", missing)
+            _code_ids.update(cursor.fetchall())
+            new_codes = [code for code in missing if code not in _code_ids]
+            if new_codes:
+                cursor.executemany(f"INSERT IGNORE INTO {CODE_DICT_TABLE} (code) VALUES (%s)",
+                                   [(code,) for code in sorted(new_codes)])
+                conn.commit()
+                placeholders = ', '.join(['%s'] * len(new_codes))
+                cursor.execute(f"SELECT code, code_id FROM {CODE_DICT_TABLE} WHERE code IN ({placeholders})",
+                               new_codes)
+                _code_ids.update(cursor.fetchall())
+        finally:
+            cursor.close()
+    return {code: _code_ids[code] for code in codes}
+
+def compact_rows(df, code_ids):
+    """把prepare_k_data的结果（带update_time）转换成COMPACT_COLUMNS顺序的行"""
+    columns = {'code_id': df['code'].map(code_ids).tolist()}
+    for col in COMPACT_COLUMNS[1:]:
+        if col in CENT_COLUMNS:
+            columns[col] = (df[col] * 100).round().astype('int64').tolist()
+        elif col != 'code_id':
+            columns[col] = df[col].tolist()
+    return list(zip(*(columns[col] for col in COMPACT_COLUMNS)))
+
+def partition_definitions(first_year, last_year):
+    """first_year到last_year每年一个分区，外加兜底的pmax"""
+    parts = [f"    PARTITION p{year} VALUES LESS THAN ('{year + 1}-01-01')"
+             for year in range(first_year, last_year + 1)]
+    parts.append("    PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+    return ',\n'.join(parts)
+
+def year_partitions(conn):
+    """紧凑表现有的年份分区，返回{year: partition_name}"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+        """, (COMPACT_TABLE,))
+        names = [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+    return {int(name[1:]): name for name in names if name[1:].isdigit()}
+
+def add_year_partitions(conn, until_year=None):
+    """从pmax中拆出直到until_year（默认明年）的年份分区，返回新增的年份"""
+    until_year = until_year or datetime.now().year + 1
+    existing = year_partitions(conn)
+    first = max(existing) + 1 if existing else datetime.now().year
+    years = list(range(first, until_year + 1))
+    if years:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"ALTER TABLE {COMPACT_TABLE} REORGANIZE PARTITION pmax INTO (\n"
+                           f"{partition_definitions(first, until_year)})")
+        finally:
+            cursor.close()
+    return years
+
+def drop_years_before(conn, year):
+    """整分区删除year之前的年份，返回删除的年份"""
+    years = sorted(y for y in year_partitions(conn) if y < year)
+    if years:
+        cursor = conn.cursor()
+        try:
+            names = ', '.join(f"p{y}" for y in years)
+            cursor.execute(f"ALTER TABLE {COMPACT_TABLE} DROP PARTITION {names}")
+        finally:
+            cursor.close()
+    return years
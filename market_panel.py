@@ -0,0 +1,263 @@
+"""内存映射的全市场行情面板：每个字段一个[code, 交易日]的稠密数组
+
+目录结构（PANEL_CONFIG['dir']）：
+  meta.json    字段、容量、已用交易日数、最近一次同步的台账时间
+  codes.json   行索引：股票代码列表
+  dates.npy    列索引：交易日（datetime64[D]），与本地交易日历一致
+  <field>.npy  open/high/low/close/volume/amount/turn，缺失的K线为NaN
+筛选脚本用MarketPanel.open()以只读mmap方式打开，切片即视图，不复制也不访问数据库：
+
+    panel = MarketPanel.open()
+    codes, dates, close = panel.window('close', bars=60)
+
+每日入库后update_market_panel()根据按日台账(kline_ingest_ledger)找出有变化的交易日，
+按股票分批从MySQL读取这些日期的K线写入面板；meta.json最后原子替换，新的交易日在此之后才对读者可见。
+
+    python market_panel.py [--rebuild]
+"""
+import os
+import json
+import shutil
+import argparse
+import logging
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from trade_calendar import get_trade_calendar
+from kline_ledger import LEDGER_TABLE, ensure_ledger_table
+from kline_loader import kline_codes, read_frame
+from config import PANEL_CONFIG
+
+PANEL_FIELDS = {
+    'open': 'float32',
+    'high': 'float32',
+    'low': 'float32',
+    'close': 'float32',
+    'volume': 'float64',
+    'amount': 'float64',
+    'turn': 'float32',
+}
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+class MarketPanel:
+    """[code, 交易日]稠密数组组成的行情面板"""
+
+    def __init__(self, path, mode='r'):
+        self.path = path
+        self.mode = mode
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        with open(os.path.join(path, 'codes.json')) as f:
+            self.codes = json.load(f)
+        self.code_pos = {code: i for i, code in enumerate(self.codes)}
+        self.all_dates = np.load(os.path.join(path, 'dates.npy'))
+        self.dates = self.all_dates[:self.meta['n_days']]
+        self._arrays = {field: np.load(os.path.join(path, f"{field}.npy"), mmap_mode=mode)
+                        for field in self.meta['fields']}
+
+    @classmethod
+    def open(cls, path=None, mode='r'):
+        """打开已有面板，不存在时返回None；mode='r'为只读零拷贝"""
+        path = path or PANEL_CONFIG['dir']
+        if not os.path.exists(os.path.join(path, 'meta.json')):
+            return None
+        return cls(path, mode)
+
+    @classmethod
+    def create(cls, path, n_days, code_capacity=None):
+        """新建空面板，预留n_days个交易日（另加spare_days）的列"""
+        code_capacity = code_capacity or PANEL_CONFIG['code_capacity']
+        day_capacity = n_days + PANEL_CONFIG['spare_days']
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'dates.npy'), np.full(day_capacity, np.datetime64('NaT'), dtype='datetime64[D]'))
+        for field, dtype in PANEL_FIELDS.items():
+            array = np.lib.format.open_memmap(os.path.join(path, f"{field}.npy"), mode='w+',
+                                              dtype=dtype, shape=(code_capacity, day_capacity))
+            array[:] = np.nan
+            array.flush()
+            del array
+        _write_json(os.path.join(path, 'codes.json'), [])
+        _write_json(os.path.join(path, 'meta.json'), {
+            'fields': PANEL_FIELDS,
+            'code_capacity': code_capacity,
+            'day_capacity': day_capacity,
+            'n_days': 0,
+            'synced_at': None,
+        })
+        return cls(path, 'r+')
+
+    def array(self, field):
+        """字段的[code, day]视图（只含已登记的代码和已填充的交易日）"""
+        return self._arrays[field][:len(self.codes), :self.meta['n_days']]
+
+    def window(self, field, bars, end=None, codes=None):
+        """截至end（含，默认最新一天）的最近bars个交易日，返回(codes, dates, values)
+
+        codes为None时返回全部代码；values在不指定codes时是mmap上的视图。
+        """
+        end_idx = self.meta['n_days'] if end is None else int(
+            np.searchsorted(self.dates, np.datetime64(str(end)[:10], 'D'), side='right'))
+        start_idx = max(0, end_idx - bars)
+        values = self.array(field)[:, start_idx:end_idx]
+        if codes is None:
+            return self.codes, self.dates[start_idx:end_idx], values
+        rows = [self.code_pos[code] for code in codes if code in self.code_pos]
+        return [self.codes[i] for i in rows], self.dates[start_idx:end_idx], values[rows]
+
+    def series(self, code, fields=None, start=None, end=None):
+        """单只股票的DataFrame，index为交易日，缺失的K线为NaN"""
+        fields = fields or list(self.meta['fields'])
+        lo = 0 if start is None else int(np.searchsorted(self.dates, np.datetime64(str(start)[:10], 'D')))
+        hi = len(self.dates) if end is None else int(
+            np.searchsorted(self.dates, np.datetime64(str(end)[:10], 'D'), side='right'))
+        row = self.code_pos.get(code)
+        data = {field: (self._arrays[field][row, lo:hi] if row is not None else np.full(hi - lo, np.nan))
+                for field in fields}
+        return pd.DataFrame(data, index=pd.DatetimeIndex(self.dates[lo:hi], name='date'))
+
+    def _resize(self, code_capacity, day_capacity):
+        """扩容：逐字段复制到更大的新文件后替换"""
+        old_codes, old_days = self.meta['code_capacity'], self.meta['day_capacity']
+        for field, dtype in self.meta['fields'].items():
+            path = os.path.join(self.path, f"{field}.npy")
+            tmp_path = f"{path}.resize"
+            array = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=(code_capacity, day_capacity))
+            array[:] = np.nan
+            array[:old_codes, :old_days] = self._arrays[field]
+            array.flush()
+            del array
+            self._arrays[field] = None
+            os.replace(tmp_path, path)
+            self._arrays[field] = np.load(path, mmap_mode=self.mode)
+        all_dates = np.full(day_capacity, np.datetime64('NaT'), dtype='datetime64[D]')
+        all_dates[:old_days] = self.all_dates
+        self.all_dates = all_dates
+        self.meta['code_capacity'] = code_capacity
+        self.meta['day_capacity'] = day_capacity
+
+    def ensure_axes(self, codes, dates):
+        """登记新代码、延长交易日轴，容量不够时扩容"""
+        new_codes = [code for code in codes if code not in self.code_pos]
+        n_days = self.meta['n_days']
+        last = self.dates[-1] if n_days else None
+        new_dates = [day for day in dates if last is None or day > last]
+        code_capacity, day_capacity = self.meta['code_capacity'], self.meta['day_capacity']
+        while len(self.codes) + len(new_codes) > code_capacity:
+            code_capacity *= 2
+        if n_days + len(new_dates) > day_capacity:
+            day_capacity = n_days + len(new_dates) + PANEL_CONFIG['spare_days']
+        if (code_capacity, day_capacity) != (self.meta['code_capacity'], self.meta['day_capacity']):
+            self._resize(code_capacity, day_capacity)
+        for code in new_codes:
+            self.code_pos[code] = len(self.codes)
+            self.codes.append(code)
+        self.all_dates[n_days:n_days + len(new_dates)] = new_dates
+        self.meta['n_days'] = n_days + len(new_dates)
+        self.dates = self.all_dates[:self.meta['n_days']]
+
+    def write_bars(self, df):
+        """把含code、date和各字段的K线写入对应格子，返回写入的行数"""
+        rows = df['code'].map(self.code_pos).to_numpy()
+        days = pd.to_datetime(df['date']).to_numpy().astype('datetime64[D]')
+        cols = np.searchsorted(self.dates, days)
+        on_axis = (cols < len(self.dates)) & (self.dates[np.minimum(cols, len(self.dates) - 1)] == days)
+        rows, cols = rows[on_axis].astype('int64'), cols[on_axis]
+        for field in self.meta['fields']:
+            self._arrays[field][rows, cols] = pd.to_numeric(df[field], errors='coerce').to_numpy()[on_axis]
+        return int(on_axis.sum())
+
+    def commit(self, synced_at=None):
+        """刷盘后再替换索引和meta.json"""
+        for array in self._arrays.values():
+            array.flush()
+        np.save(os.path.join(self.path, 'dates.npy'), self.all_dates)
+        _write_json(os.path.join(self.path, 'codes.json'), self.codes)
+        if synced_at is not None:
+            self.meta['synced_at'] = synced_at
+        _write_json(os.path.join(self.path, 'meta.json'), self.meta)
+
+def _changed_dates(conn, synced_at):
+    """台账中last_update晚于synced_at的交易日，以及其中最新的last_update"""
+    ensure_ledger_table(conn)
+    cursor = conn.cursor()
+    if synced_at:
+        cursor.execute(f"SELECT trade_date, last_update FROM {LEDGER_TABLE} "
+                       f"WHERE codes_covered > 0 AND last_update > %s", (synced_at,))
+    else:
+        cursor.execute(f"SELECT trade_date, last_update FROM {LEDGER_TABLE} WHERE codes_covered > 0")
+    rows = cursor.fetchall()
+    cursor.close()
+    if not rows:
+        return [], synced_at
+    return sorted(day for day, _ in rows), str(max(last for _, last in rows))
+
+def _load_bars(conn, codes, start_date, end_date):
+    """按股票分批读取[start_date, end_date]的K线，每批走(code, date)索引"""
+    fields = ', '.join(PANEL_FIELDS)
+    # 成交量也按浮点读取，缺失为NaN而不是按整数列补0
+    dtypes = dict.fromkeys(PANEL_FIELDS, 'float64')
+    batch = PANEL_CONFIG['code_batch']
+    for i in range(0, len(codes), batch):
+        chunk = codes[i:i + batch]
+        placeholders = ', '.join(['%s'] * len(chunk))
+        yield read_frame(conn, f"SELECT code, date, {fields} FROM stock_kline "
+                               f"WHERE code IN ({placeholders}) AND date BETWEEN %s AND %s",
+                         tuple(chunk) + (str(start_date), str(end_date)), dtypes=dtypes)
+
+def update_market_panel(conn=None, path=None, rebuild=False):
+    """把台账显示有变化的交易日从MySQL同步到面板，返回写入的K线数"""
+    from db_pool import get_connection  # 避免导入期依赖数据库模块
+
+    path = path or PANEL_CONFIG['dir']
+    calendar = get_trade_calendar()
+    if calendar is None:
+        raise RuntimeError("Trade calendar unavailable, run daily_update first")
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
+    try:
+        if rebuild and os.path.exists(path):
+            shutil.rmtree(path)
+        start = datetime.strptime(PANEL_CONFIG['start_date'], '%Y-%m-%d').date()
+        panel = MarketPanel.open(path, 'r+')
+        if panel is None:
+            latest = calendar.latest_trading_day(min(datetime.now().date(), calendar.covered_until))
+            panel = MarketPanel.create(path, len(calendar.trading_days_between(start, latest)))
+
+        changed, synced_at = _changed_dates(conn, panel.meta['synced_at'])
+        changed = [day for day in changed if day >= start]
+        if not changed:
+            return 0
+
+        codes = kline_codes(conn)
+        axis = np.array(calendar.trading_days_between(start, changed[-1]), dtype='datetime64[D]')
+        panel.ensure_axes(codes, axis)
+
+        written = 0
+        for df in _load_bars(conn, panel.codes, changed[0], changed[-1]):
+            if not df.empty:
+                written += panel.write_bars(df)
+        # 增量消费面板的读者（screen_state）据此判断已读过的交易日是否被改写
+        panel.meta['changed_from'] = str(changed[0])
+        panel.commit(synced_at)
+        logging.info(f"Market panel updated: {written} bars for {changed[0]} to {changed[-1]}, "
+                     f"{len(panel.codes)} codes x {panel.meta['n_days']} days")
+        return written
+    finally:
+        if own_conn:
+            conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or update the memory-mapped market panel")
+    parser.add_argument('--rebuild', action='store_true', help="discard the panel and load everything again")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    print(f"Wrote {update_market_panel(rebuild=args.rebuild)} bars")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""把stock_kline在线迁移到紧凑分区布局（见kline_schema.py）
+
+    python migrate_kline_schema.py migrate            # 分块复制、追平增量、原子切换
+    python migrate_kline_schema.py add-partitions --until 2027
+    python migrate_kline_schema.py drop-years --before 2015
+    python migrate_kline_schema.py drop-legacy        # 确认无误后删除旧表
+
+迁移过程：
+  1. 建代码字典和按年分区的stock_kline_compact
+  2. 按旧表id分块INSERT ... SELECT，每块一个短事务，进度写入状态文件，中断后可续跑
+  3. 追平复制开始之后新写入或被更新（update_time变化）的行
+  4. 核对行数后再追平一次，然后用一条RENAME TABLE把旧表换成stock_kline_legacy、兼容视图换成stock_kline
+旧表里重复的(code, date)行按id从小到大覆盖，保留最后写入的一行。
+切换的瞬间之后旧布局的写入会失败，最好在没有入库任务运行时执行第4步。
+"""
+import os
+import json
+import time
+import argparse
+from datetime import datetime
+from db_pool import get_connection
+from kline_schema import (get_kline_layout, clear_layout_cache, get_code_ids, partition_definitions,
+                          add_year_partitions, drop_years_before, COMPACT_TABLE, CODE_DICT_TABLE, LEGACY_TABLE,
+                          COMPACT_COLUMNS, CREATE_CODE_DICT_SQL, CREATE_COMPACT_SQL, COMPAT_VIEW_SELECT)
+from config import SCHEMA_CONFIG
+
+COPY_SQL = f"""
+INSERT INTO {COMPACT_TABLE} ({', '.join(COMPACT_COLUMNS)})
+SELECT d.code_id, k.date,
+       ROUND(k.open * 100), ROUND(k.high * 100), ROUND(k.low * 100), ROUND(k.close * 100),
+       k.volume, ROUND(k.amount * 100), k.turn, k.tradestatus,
+       k.pctChg, k.peTTM, k.pbMRQ, k.psTTM, k.pcfNcfTTM, k.update_time
+FROM stock_kline k
+JOIN {CODE_DICT_TABLE} d ON d.code = k.code
+WHERE k.id > %s AND k.id <= %s {{extra}}
+ORDER BY k.id
+ON DUPLICATE KEY UPDATE
+    {', '.join(f'{col} = VALUES({col})' for col in COMPACT_COLUMNS[2:])}
+"""
+
+def load_state():
+    path = SCHEMA_CONFIG['migrate_state_path']
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+def save_state(state):
+    path = SCHEMA_CONFIG['migrate_state_path']
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(state, f, indent=2)
+
+def sync_code_dict(conn):
+    """把旧表里出现过的代码登记到代码字典"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT DISTINCT code FROM stock_kline")
+    codes = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return get_code_ids(conn, codes)
+
+def create_compact_table(conn):
+    cursor = conn.cursor()
+    cursor.execute(CREATE_CODE_DICT_SQL)
+    cursor.execute("SELECT YEAR(MIN(date)) FROM stock_kline")
+    first_year = min(cursor.fetchone()[0] or datetime.now().year, SCHEMA_CONFIG['first_partition_year'])
+    cursor.execute(CREATE_COMPACT_SQL.format(
+        partitions=partition_definitions(first_year, datetime.now().year + 1)))
+    conn.commit()
+    cursor.close()
+
+def copy_range(conn, from_id, to_id, since=None):
+    """分块复制id在(from_id, to_id]的行；since不为None时只复制新行或update_time不早于since的行"""
+    chunk = SCHEMA_CONFIG['migrate_chunk_rows']
+    if since is None:
+        sql, extra_args = COPY_SQL.format(extra=''), ()
+    else:
+        sql, extra_args = COPY_SQL.format(extra="AND (k.id > %s OR k.update_time >= %s)"), (since[0], since[1])
+    cursor = conn.cursor()
+    copied = 0
+    try:
+        for start in range(from_id, to_id, chunk):
+            end = min(start + chunk, to_id)
+            copied += cursor.execute(sql, (start, end) + extra_args)
+            conn.commit()
+            yield end, copied
+            time.sleep(SCHEMA_CONFIG['migrate_sleep_seconds'])
+    finally:
+        cursor.close()
+
+def max_id(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM stock_kline")
+    value = cursor.fetchone()[0]
+    cursor.close()
+    return value
+
+def catch_up(conn, state):
+    """追平上一轮复制开始之后的新增和更新，返回本轮开始时间"""
+    started = datetime.now()
+    sync_code_dict(conn)
+    target = max_id(conn)
+    since = (state['copied_until'], state['since'])
+    copied = 0
+    for _, copied in copy_range(conn, 0, target, since):
+        pass
+    state['copied_until'] = target
+    state['since'] = started.strftime('%Y-%m-%d %H:%M:%S')
+    save_state(state)
+    print(f"Caught up {copied} rows changed since {since[1]}")
+    return started
+
+def verify_counts(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(DISTINCT code, date) FROM stock_kline")
+    legacy = cursor.fetchone()[0]
+    cursor.execute(f"SELECT COUNT(*) FROM {COMPACT_TABLE}")
+    compact = cursor.fetchone()[0]
+    cursor.close()
+    return legacy, compact
+
+def swap_in_view(conn):
+    """一条RENAME TABLE同时完成旧表改名和视图就位，读取方看不到中间状态"""
+    cursor = conn.cursor()
+    cursor.execute("DROP VIEW IF EXISTS stock_kline_compat")
+    cursor.execute(f"CREATE VIEW stock_kline_compat AS {COMPAT_VIEW_SELECT}")
+    cursor.execute(f"RENAME TABLE stock_kline TO {LEGACY_TABLE}, stock_kline_compat TO stock_kline")
+    conn.commit()
+    cursor.close()
+    clear_layout_cache()
+
+def migrate(force=False):
+    conn = get_connection()
+    try:
+        if get_kline_layout(conn) == 'compact':
+            print("stock_kline already uses the compact layout")
+            return
+        state = load_state()
+        if not state:
+            create_compact_table(conn)
+            state = {'copied_until': 0, 'target_id': max_id(conn),
+                     'since': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+            save_state(state)
+        sync_code_dict(conn)
+
+        started = time.monotonic()
+        copied = 0
+        for end, copied in copy_range(conn, state['copied_until'], state['target_id']):
+            state['copied_until'] = end
+            save_state(state)
+            if end % (SCHEMA_CONFIG['migrate_chunk_rows'] * 20) == 0:
+                elapsed = time.monotonic() - started
+                print(f"Copied up to id {end}/{state['target_id']} ({copied / max(elapsed, 1e-9):.0f} rows/s)")
+        print(f"Initial copy done: {copied} rows in {time.monotonic() - started:.1f}s")
+
+        catch_up(conn, state)
+        legacy, compact = verify_counts(conn)
+        print(f"Distinct (code, date) rows: legacy {legacy}, compact {compact}")
+        if compact < legacy and not force:
+            print("Compact table is missing rows, not switching (rerun, or pass --force)")
+            return
+        # 最后一次追平紧挨着切换，窗口内的写入量很小
+        catch_up(conn, state)
+        swap_in_view(conn)
+        os.remove(SCHEMA_CONFIG['migrate_state_path'])
+        print(f"stock_kline now reads from {COMPACT_TABLE}; the old table was kept as {LEGACY_TABLE}")
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate stock_kline to the compact partitioned layout")
+    sub = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = sub.add_parser('migrate', help="copy, catch up and switch stock_kline to the compact layout")
+    migrate_parser.add_argument('--force', action='store_true', help="switch even if the row counts differ")
+    add_parser = sub.add_parser('add-partitions', help="split yearly partitions out of pmax")
+    add_parser.add_argument('--until', type=int, default=None, help="last year to add (default: next year)")
+    drop_parser = sub.add_parser('drop-years', help="drop whole yearly partitions")
+    drop_parser.add_argument('--before', type=int, required=True)
+    sub.add_parser('drop-legacy', help=f"drop {LEGACY_TABLE} after the switch")
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        migrate(args.force)
+        return
+    conn = get_connection()
+    try:
+        if get_kline_layout(conn) != 'compact':
+            print("stock_kline still uses the legacy layout, run 'migrate' first")
+            return
+        cursor = conn.cursor()
+        if args.command == 'add-partitions':
+            print(f"Added partitions for years: {add_year_partitions(conn, args.until)}")
+        elif args.command == 'drop-years':
+            print(f"Dropped partitions for years: {drop_years_before(conn, args.before)}")
+        else:
+            cursor.execute(f"DROP TABLE IF EXISTS {LEGACY_TABLE}")
+            print(f"Dropped {LEGACY_TABLE}")
+        cursor.close()
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,11 @@
 import pandas as pd
 import mplfinance as mpf
-import pymysql
-from datetime import datetime
-from config import DB_CONFIG
+from db_pool import get_connection
 
-# 连接数据库
-conn = pymysql.connect(
-    host=DB_CONFIG['host'],
-    port=DB_CONFIG['port'],
-    user=DB_CONFIG['user'],
-    password=DB_CONFIG['password'],
-    database=DB_CONFIG['database']
-)
-
-# 从数据库读取数据
+# 从数据库读取数据，退出with时归还连接
 query = "SELECT * FROM stock_kline ORDER BY trade_date"
-df = pd.read_sql(query, conn)
-
-# 关闭数据库连接
-conn.close()
+with get_connection() as conn:
+    df = pd.read_sql(query, conn)
 
 # 转换日期列为datetime类型
 df['trade_date'] = pd.to_datetime(df['trade_date'])
@@ -1,9 +1,5 @@
-import pymysql
 import pandas as pd
-from config import DB_CONFIG
-
-def get_db_connection():
-    return pymysql.connect(**DB_CONFIG)
+from db_pool import get_connection
 
 def query_significant_spikes(min_ratio=3.0, min_post_ratio=1.5):
     """
@@ -11,8 +7,6 @@ def query_significant_spikes(min_ratio=3.0, min_post_ratio=1.5):
     1. The spike day volume is at least min_ratio times the previous average
     2. The post-spike average volume is at least min_post_ratio times the pre-spike average
     """
-    conn = get_db_connection()
-    
     query = f"""
     SELECT 
         v.code,
@@ -31,8 +25,8 @@ def query_significant_spikes(min_ratio=3.0, min_post_ratio=1.5):
     ORDER BY v.spike_date DESC, v.amount_ratio DESC
     """
     
-    df = pd.read_sql(query, conn)
-    conn.close()
+    with get_connection() as conn:
+        df = pd.read_sql(query, conn)
     
     # Format the amounts to be more readable (convert to millions)
     df['pre_avg_amount'] = df['pre_avg_amount'] / 1000000
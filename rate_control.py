@@ -0,0 +1,122 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from config import BAOSTOCK_CONFIG
+
+class BaostockError(RuntimeError):
+    """baostock接口返回了非0的error_code"""
+
+class AIMDRateController:
+    """根据调用结果自适应调整baostock请求速率（加性增、乘性减）
+
+    每次成功调用把速率提高 increase/rate，即连续成功时大约每秒增加increase次/秒；
+    出错、超时或调用耗时超过slow_call_seconds时，速率乘以decrease_factor。
+    两次降速之间至少间隔一个请求周期，避免同一批在途请求的错误把速率连续压到底。
+    history记录每次降速以及每100次调用的速率采样。
+    """
+
+    def __init__(self, initial_rate=None, min_rate=None, max_rate=None, increase=None,
+                 decrease_factor=None, slow_call_seconds=None, history_size=None):
+        self.rate = initial_rate or BAOSTOCK_CONFIG['initial_rate']
+        self.min_rate = min_rate or BAOSTOCK_CONFIG['min_rate']
+        self.max_rate = max_rate or BAOSTOCK_CONFIG['max_rate']
+        self.increase = increase or BAOSTOCK_CONFIG['rate_increase']
+        self.decrease_factor = decrease_factor or BAOSTOCK_CONFIG['rate_decrease_factor']
+        self.slow_call_seconds = slow_call_seconds or BAOSTOCK_CONFIG['slow_call_seconds']
+        self.history = deque(maxlen=history_size or BAOSTOCK_CONFIG['rate_history_size'])
+        self.calls = 0
+        self.errors = 0
+        self.slow_calls = 0
+        self.total_latency = 0.0
+        self._last_call = 0.0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """按当前速率排队，保证相邻两次调用间隔不小于1/rate"""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._last_call + 1.0 / self.rate)
+            self._last_call = slot
+        if slot > now:
+            time.sleep(slot - now)
+
+    def record(self, latency, ok):
+        """记录一次调用的耗时和结果，并据此调整速率"""
+        with self._lock:
+            self.calls += 1
+            self.total_latency += latency
+            slow = ok and latency > self.slow_call_seconds
+            if not ok:
+                self.errors += 1
+            if slow:
+                self.slow_calls += 1
+
+            now = time.monotonic()
+            if ok and not slow:
+                self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+                if self.calls % 100 == 0:
+                    self._append_history('sample', latency)
+                return
+            if now - self._last_decrease < 1.0 / self.rate:
+                return
+            self._last_decrease = now
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self._append_history('error' if not ok else 'slow', latency)
+
+    def _append_history(self, event, latency):
+        self.history.append({
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'event': event,
+            'calls': self.calls,
+            'latency': round(latency, 3),
+            'rate': round(self.rate, 3),
+        })
+
+    def call(self, fn, *args, **kwargs):
+        """限速执行一次baostock查询；返回对象带error_code且不为'0'时抛出BaostockError"""
+        self.wait()
+        started = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+            error_code = getattr(result, 'error_code', '0')
+            if error_code != '0':
+                raise BaostockError(f"{getattr(fn, '__name__', fn)} failed: {error_code} {result.error_msg}")
+        except Exception:
+            self.record(time.monotonic() - started, False)
+            raise
+        self.record(time.monotonic() - started, True)
+        return result
+
+    def snapshot(self, history=True):
+        """当前速率和统计信息，history=True时附带最近的降速记录和速率采样"""
+        with self._lock:
+            data = {
+                'rate': round(self.rate, 3),
+                'calls': self.calls,
+                'errors': self.errors,
+                'slow_calls': self.slow_calls,
+                'avg_latency': round(self.total_latency / self.calls, 3) if self.calls else None,
+            }
+            if history:
+                data['history'] = list(self.history)
+        return data
+
+    def export(self, path=None):
+        """把snapshot写成JSON文件供查看"""
+        path = path or BAOSTOCK_CONFIG['rate_history_path']
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+_default_controller = None
+
+def get_default_controller():
+    """进程内共享的默认速率控制器"""
+    global _default_controller
+    if _default_controller is None:
+        _default_controller = AIMDRateController()
+    return _default_controller
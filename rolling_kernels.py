@@ -0,0 +1,134 @@
+"""按最后一维（交易日）批量计算的滚动统计
+
+输入是[股票, 交易日]（或任意[..., 交易日]）数组，所有函数一次算完整个矩阵，输出与输入对齐：
+第t列是以第t天结束的窗口的结果，窗口不满或窗口内有NaN时为NaN（sum/mean/var/cv可用min_periods放宽，与pandas相同）。
+均值、方差和最小二乘斜率都由累积和的差分得到（每个元素O(1)，与窗口长度无关），
+方差和斜率先减去每行均值再累加，避免成交量这类大数平方后累积和丢失精度。
+
+    from rolling_kernels import rolling_mean, rolling_cv, rolling_slope
+    ma10 = rolling_mean(close, 10)
+    cv = rolling_cv(volume, 50)
+    slope = rolling_slope(volume, 10)   # 与每个窗口上np.polyfit(range(10), y, 1)[0]相同
+"""
+import numpy as np
+
+def _as_float(a):
+    return np.asarray(a, dtype='float64')
+
+def _prefixed_cumsum(a):
+    out = np.zeros(a.shape[:-1] + (a.shape[-1] + 1,), dtype=a.dtype)
+    np.cumsum(a, axis=-1, out=out[..., 1:])
+    return out
+
+def _rolling_sum_count(a, window, min_periods=None):
+    """以第t列结束的窗口内非NaN值的和及个数；个数不足min_periods（默认window，即窗口满且无NaN）时和为NaN
+
+    窗口在最后一维开头处不满时按已有的列计算，所以min_periods < window时开头几列也可能有结果。
+    """
+    a = _as_float(a)
+    min_periods = window if min_periods is None else min_periods
+    n = a.shape[-1]
+    if window <= 0 or n == 0:
+        return np.full(a.shape, np.nan), np.zeros(a.shape, dtype='int64')
+    valid = ~np.isnan(a)
+    end = np.arange(1, n + 1)
+    start = np.maximum(end - window, 0)
+    cumulative = _prefixed_cumsum(np.where(valid, a, 0.0))
+    counts = _prefixed_cumsum(valid.astype('int64'))
+    counts = counts[..., end] - counts[..., start]
+    sums = np.where(counts >= max(min_periods, 1), cumulative[..., end] - cumulative[..., start], np.nan)
+    return sums, counts
+
+def rolling_sum(a, window, min_periods=None):
+    return _rolling_sum_count(a, window, min_periods)[0]
+
+def rolling_mean(a, window, min_periods=None):
+    sums, counts = _rolling_sum_count(a, window, min_periods)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts
+
+def _centered(a):
+    """每行减去均值（全NaN的行保持NaN）"""
+    a = _as_float(a)
+    with np.errstate(invalid='ignore'):
+        center = np.nanmean(a, axis=-1, keepdims=True) if a.size else np.zeros(a.shape[:-1] + (1,))
+    return a - np.nan_to_num(center)
+
+def rolling_var(a, window, ddof=1, min_periods=None):
+    """min_periods < window时，窗口内有效值个数n不足window也计算（分母n - ddof），与pandas的min_periods相同"""
+    b = _centered(a)
+    s1, n = _rolling_sum_count(b, window, min_periods)
+    s2, _ = _rolling_sum_count(b * b, window, min_periods)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        var = (s2 - s1 * s1 / n) / (n - ddof)
+    # 累积和相减的舍入误差可能让常数窗口得到极小的负数
+    return np.where(var < 0, 0.0, var)
+
+def rolling_std(a, window, ddof=1, min_periods=None):
+    return np.sqrt(rolling_var(a, window, ddof, min_periods))
+
+def rolling_cv(a, window, ddof=1, min_periods=None):
+    """变异系数std/mean；均值为0时为NaN或inf"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return rolling_std(a, window, ddof, min_periods) / rolling_mean(a, window, min_periods)
+
+def rolling_slope(a, window):
+    """以0..window-1为横坐标的最小二乘斜率
+
+    窗口[t-w+1, t]内x = j - (t-w+1)，sum(x*y) = sum(j*y) - (t-w+1)*sum(y)，两个和都来自累积和。
+    """
+    b = _centered(a)
+    j = np.arange(b.shape[-1], dtype='float64')
+    sum_y = rolling_sum(b, window)
+    sum_jy = rolling_sum(b * j, window)
+    start = j - (window - 1)
+    sum_xy = sum_jy - start * sum_y
+    sum_x = window * (window - 1) / 2
+    sum_xx = (window - 1) * window * (2 * window - 1) / 6
+    denominator = window * sum_xx - sum_x * sum_x
+    if denominator == 0:
+        return np.full(b.shape, np.nan)
+    return (window * sum_xy - sum_x * sum_y) / denominator
+
+def rolling_max(a, window):
+    a = _as_float(a)
+    out = np.full(a.shape, np.nan)
+    if a.shape[-1] >= window:
+        out[..., window - 1:] = np.lib.stride_tricks.sliding_window_view(a, window, axis=-1).max(axis=-1)
+    return out
+
+def shift(a, periods, fill=np.nan):
+    """沿最后一维右移periods列（第t列变为原来第t-periods列）"""
+    a = np.asarray(a)
+    if periods == 0:
+        return a
+    out = np.full(a.shape, fill, dtype=np.result_type(a.dtype, np.asarray(fill).dtype))
+    if periods < a.shape[-1]:
+        out[..., periods:] = a[..., :-periods]
+    return out
+
+def rises(a, strict=True):
+    """第t列为第t天相对前一天是否增长（strict=False时持平也算），第0列为False"""
+    a = _as_float(a)
+    steps = np.diff(a, axis=-1)
+    with np.errstate(invalid='ignore'):
+        up = steps > 0 if strict else steps >= 0
+    return np.concatenate([np.zeros(a.shape[:-1] + (1,), dtype=bool), up], axis=-1)
+
+def count_rises(a, window, strict=True):
+    """以第t天结束的window根K线中，相邻两根增长的次数（window-1个间隔）"""
+    return rolling_sum(rises(a, strict), window - 1) if window > 1 else np.zeros(np.shape(a))
+
+def rise_run_length(a, strict=True):
+    """截至第t天连续增长的天数：累积计数减去最近一次中断时的计数"""
+    up = rises(a, strict)
+    counts = np.cumsum(up, axis=-1)
+    reset = np.maximum.accumulate(np.where(up, 0, counts), axis=-1)
+    return counts - reset
+
+def longest_rise_run(a, strict=True):
+    """沿最后一维最长的连续增长天数"""
+    a = np.asarray(a)
+    if a.shape[-1] == 0:
+        return np.zeros(a.shape[:-1], dtype='int64')
+    return rise_run_length(a, strict).max(axis=-1)
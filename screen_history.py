@@ -0,0 +1,158 @@
+"""历史回放：对每个(股票, 交易日)按当时可见的数据执行筛选，输出触发信号及其后5/10/20日收益
+
+compile_screen的结果本来就是逐列的（第t列只用到第t天及以前的K线），所以不需要逐日重放：
+每批股票读取一次从start_date往前bars根开始的全部K线，按股票左对齐成[股票, K线]矩阵（右侧补NaN），
+一次求值得到所有日期的掩码；掩码为True的位置就是信号，前向收益为close[t + h] / close[t] - 1。
+同一批数据可以同时评估多组参数，用来检验阈值：
+
+    from dataclasses import replace
+    from screen_history import sweep_history, forward_stats
+    from screen_rules import VOLUME_SCREEN, StableBase
+    loose = replace(VOLUME_SCREEN, name='cv_1.0', rules=(StableBase(window=15, skip=2, max_cv=1.0),) + VOLUME_SCREEN.rules[1:])
+    signals, baseline = sweep_history(conn, [VOLUME_SCREEN, loose], codes, '2020-01-01', '2024-12-31')
+    print(forward_stats(signals, baseline))
+
+信号只在start_date..end_date内产生，前向收益可以用到end_date之后已有的K线；之后不足h根K线时为NaN。
+"""
+import argparse
+import logging
+import time
+import numpy as np
+import pandas as pd
+from kline_loader import fetch_columns
+from screen_rules import compile_screen, PRESETS
+from trade_calendar import window_start_date
+from db_pool import get_connection
+from config import HISTORY_CONFIG
+
+def _load_batch(conn, codes, fields, start_date):
+    columns = ['code', 'date'] + fields
+    placeholders = ', '.join(['%s'] * len(codes))
+    return fetch_columns(
+        conn,
+        f"SELECT {', '.join(columns)} FROM stock_kline WHERE code IN ({placeholders}) AND date >= %s "
+        f"ORDER BY code, date",
+        list(codes) + [start_date], columns)
+
+def _to_matrix(data, fields):
+    """按(code, date)排序的行展开为左对齐的[股票, 最长K线数]矩阵，股票自身没有的位置为NaN/NaT"""
+    row_codes = data['code']
+    starts = np.flatnonzero(np.r_[True, row_codes[1:] != row_codes[:-1]])
+    sizes = np.diff(np.r_[starts, len(row_codes)])
+    rows = np.repeat(np.arange(len(starts)), sizes)
+    cols = np.arange(len(row_codes)) - np.repeat(starts, sizes)
+    shape = (len(starts), int(sizes.max()))
+    dates = np.full(shape, np.datetime64('NaT'), dtype='datetime64[D]')
+    dates[rows, cols] = data['date']
+    matrices = {}
+    for field in fields:
+        matrix = np.full(shape, np.nan)
+        matrix[rows, cols] = data[field]
+        matrices[field] = matrix
+    return row_codes[starts], sizes, dates, matrices
+
+def forward_returns(close, horizons):
+    """{h: [股票, K线]}，第t列为close[t + h] / close[t] - 1"""
+    out = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for h in horizons:
+            ahead = np.full(close.shape, np.nan)
+            if h < close.shape[-1]:
+                ahead[:, :-h] = close[:, h:]
+            returns = ahead / close - 1
+            returns[~np.isfinite(returns)] = np.nan
+            out[h] = returns
+    return out
+
+def _signals(spec, codes, dates, matrices, eligible, returns):
+    values, close = matrices[spec.field], matrices['close']
+    with np.errstate(all='ignore'):
+        mask, metrics = compile_screen(spec)(values, close)
+    rows, cols = np.nonzero(mask & eligible)
+    out = {'screen': spec.name, 'code': codes[rows], 'date': dates[rows, cols],
+           'close': close[rows, cols], spec.field: values[rows, cols]}
+    for name, metric in metrics.items():
+        out[name] = metric[rows, cols]
+    if 'first_surge_ago' in metrics:
+        position = cols - metrics['first_surge_ago'][rows, cols]
+        out['first_surge_date'] = dates[rows, position]
+        out['first_surge_value'] = values[rows, position]
+    for h, ret in returns.items():
+        out[f'ret_{h}d'] = ret[rows, cols]
+    return pd.DataFrame(out)
+
+def sweep_history(conn, specs, codes, start_date, end_date=None, horizons=None):
+    """对start_date..end_date之间每个(股票, 交易日)执行specs（一个或多个ScreenSpec）
+
+    返回(signals, baseline)：signals每个信号一行（screen、code、date、close、量能、各规则指标、ret_{h}d）；
+    baseline为同一范围内所有可评估的(股票, 交易日)的前向收益汇总{h: {'count', 'sum', 'wins'}}，作对照。
+    """
+    specs = [specs] if not isinstance(specs, (list, tuple)) else list(specs)
+    horizons = tuple(horizons or HISTORY_CONFIG['horizons'])
+    bars = max(spec.bars for spec in specs)
+    fields = sorted({spec.field for spec in specs} | {'close'})
+    load_from = window_start_date(bars, start_date)
+    start, end = np.datetime64(str(start_date)[:10], 'D'), np.datetime64(str(end_date or '9999-12-31')[:10], 'D')
+    batch = HISTORY_CONFIG['code_batch']
+    parts = []
+    baseline = {h: {'count': 0, 'sum': 0.0, 'wins': 0} for h in horizons}
+    started = time.monotonic()
+    for i in range(0, len(codes), batch):
+        data = _load_batch(conn, codes[i:i + batch], fields, load_from)
+        if not len(data['code']):
+            continue
+        batch_codes, sizes, dates, matrices = _to_matrix(data, fields)
+        returns = forward_returns(matrices['close'], horizons)
+        in_range = (dates >= start) & (dates <= end)
+        position = np.arange(dates.shape[1])
+        for spec in specs:
+            # compile_screen只屏蔽矩阵的前bars-1列；按股票左对齐后这正是每只股票历史不足的部分
+            eligible = in_range & (position < sizes[:, None])
+            parts.append(_signals(spec, batch_codes, dates, matrices, eligible, returns))
+        eligible = in_range & (position >= bars - 1)
+        for h, ret in returns.items():
+            sample = ret[eligible & ~np.isnan(ret)]
+            baseline[h]['count'] += sample.size
+            baseline[h]['sum'] += float(sample.sum())
+            baseline[h]['wins'] += int((sample > 0).sum())
+        logging.info(f"history sweep: {min(i + batch, len(codes))}/{len(codes)} codes, "
+                     f"{time.monotonic() - started:.1f}s")
+    signals = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=['screen', 'code', 'date'])
+    return signals.sort_values(['screen', 'date', 'code'], ignore_index=True), baseline
+
+def forward_stats(signals, baseline=None):
+    """每个screen、每个持有期的信号数、平均/中位收益、胜率；给出baseline时附上全体样本的平均收益和胜率作对照"""
+    rows = []
+    horizons = sorted(int(col[4:-1]) for col in signals.columns if col.startswith('ret_'))
+    for name, group in signals.groupby('screen', sort=True):
+        for h in horizons:
+            ret = group[f'ret_{h}d'].dropna()
+            row = {'screen': name, 'horizon': h, 'signals': len(group), 'with_return': len(ret),
+                   'mean': ret.mean(), 'median': ret.median(), 'win_rate': (ret > 0).mean() if len(ret) else np.nan}
+            if baseline is not None and baseline[h]['count']:
+                row['base_mean'] = baseline[h]['sum'] / baseline[h]['count']
+                row['base_win_rate'] = baseline[h]['wins'] / baseline[h]['count']
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run screen presets as of every trading day and report forward returns")
+    parser.add_argument('screens', nargs='+', choices=sorted(PRESETS), help="presets to sweep")
+    parser.add_argument('--start', required=True, help="first signal date, YYYY-MM-DD")
+    parser.add_argument('--end', default=None, help="last signal date (default: latest bar)")
+    parser.add_argument('--out', default=None, help="signal table CSV (default screen_history_<start>_<end>.csv)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT code FROM stock_kline")
+        codes = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+        signals, baseline = sweep_history(conn, [PRESETS[name] for name in args.screens], codes, args.start, args.end)
+    out = args.out or f"screen_history_{args.start}_{args.end or 'latest'}.csv"
+    signals.to_csv(out, index=False, encoding='utf-8-sig')
+    print(f"{len(signals)} signals saved to {out}")
+    print(forward_stats(signals, baseline).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
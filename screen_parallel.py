@@ -0,0 +1,84 @@
+"""多进程筛选：行情窗口只加载一次，放进共享内存，各进程按股票切片零拷贝计算
+
+    from screen_parallel import run_screen_parallel
+    hits = run_screen_parallel(conn, STOCK_SCREENER, codes, workers=32)
+
+父进程用screen_rules.load_window读取[股票, bars]矩阵，复制到multiprocessing.shared_memory；
+工作进程启动时按名字映射同一块内存，每个任务只传(spec, 起止行)，
+通过与否和各项指标直接写入共享的结果矩阵[股票, 1 + 指标数]，不经过pickle回传。
+"""
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from screen_rules import compile_screen, load_window, hits_frame, last_day
+from config import SCREEN_CONFIG
+
+_views = {}
+
+def _to_shared(array):
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    view[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+def _attach(name, shape, dtype):
+    # 进程池的工作进程（fork/spawn/forkserver）与父进程共用同一个资源跟踪器，这里的登记与父进程的是同一条，
+    # 不能unregister：否则父进程unlink时跟踪器报KeyError，父进程中途退出时共享内存也不会被回收
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+def _init_worker(layouts):
+    for key, layout in layouts.items():
+        _views[key] = _attach(*layout)
+
+def _evaluate_slice(spec, lo, hi):
+    values, close, out = _views['values'][1], _views['close'][1], _views['out'][1]
+    mask, metrics = last_day(*compile_screen(spec)(values[lo:hi], close[lo:hi]))
+    out[lo:hi, 0] = mask
+    for j, metric in enumerate(metrics.values(), start=1):
+        out[lo:hi, j] = metric
+    return hi - lo
+
+def _metric_names(spec, bars):
+    """在空矩阵上执行一次，得到指标名及顺序"""
+    with np.errstate(all='ignore'):
+        _, metrics = compile_screen(spec)(np.empty((0, bars)), np.empty((0, bars)))
+    return list(metrics)
+
+def run_screen_parallel(conn, spec, codes, workers=None, end_date=None, slice_rows=None):
+    """与screen_rules.run_screen结果相同，计算分到workers个进程"""
+    workers = workers or SCREEN_CONFIG['workers']
+    slice_rows = slice_rows or SCREEN_CONFIG['slice_rows']
+    started = time.monotonic()
+    codes, dates, values, close = load_window(conn, codes, spec.bars, spec.field, end_date, spec.min_bars)
+    loaded = time.monotonic()
+    names = _metric_names(spec, spec.bars)
+
+    blocks = []
+    try:
+        layouts = {}
+        for key, array in (('values', values), ('close', close),
+                           ('out', np.zeros((len(codes), 1 + len(names)), dtype='float64'))):
+            block, layouts[key] = _to_shared(array)
+            blocks.append(block)
+        out = np.ndarray(layouts['out'][1], dtype='float64', buffer=blocks[-1].buf)
+
+        slices = [(lo, min(lo + slice_rows, len(codes))) for lo in range(0, len(codes), slice_rows)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(layouts,)) as executor:
+            for future in [executor.submit(_evaluate_slice, spec, lo, hi) for lo, hi in slices]:
+                future.result()
+
+        mask = out[:, 0].astype(bool)
+        metrics = {name: out[:, j].copy() for j, name in enumerate(names, start=1)}
+        del out
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    if 'first_surge_ago' in metrics:
+        metrics['first_surge_ago'] = metrics['first_surge_ago'].astype('int64')
+    logging.info(f"{spec.name}: {len(codes)} codes on {workers} processes, "
+                 f"load {loaded - started:.2f}s, screen {time.monotonic() - loaded:.2f}s")
+    return hits_frame(spec, codes, dates, values, close, mask, metrics)
@@ -0,0 +1,289 @@
+"""声明式筛选规则引擎
+
+一个筛选由ScreenSpec描述：需要的K线数、量能字段（volume/amount）和一组规则：
+  StableBase  放量前的基期量能稳定（变异系数上限）
+  Surge       最近几根K线相对基期均值放量（倍数、任一/全部、是否含等号）
+  Trend       最近几根K线的量能趋势（最小二乘斜率、逐根增长、上涨次数）
+  NearMA      最新收盘价靠近或位于两条均线之间
+compile_screen()把规则编译成一串rolling_kernels运算，对[股票, 交易日]矩阵一次算出所有股票每一天的结果，
+单只股票就是一行的矩阵。原来各脚本里手写的条件成为本模块末尾的预设：
+
+    from screen_rules import run_screen, STOCK_SCREENER
+    hits = run_screen(conn, STOCK_SCREENER, codes)   # DataFrame：code、date、close及各规则的指标
+"""
+import functools
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional, Tuple
+import numpy as np
+import pandas as pd
+from kline_loader import fetch_columns
+from rolling_kernels import (rolling_mean, rolling_cv, rolling_slope, rolling_max, shift, count_rises,
+                             rise_run_length)
+from trade_calendar import window_start_date
+from config import SCREEN_CONFIG
+
+@dataclass(frozen=True)
+class StableBase:
+    """最近skip根之前的window根K线，量能变异系数（std/mean, ddof=1）不超过max_cv
+
+    inclusive=False时要求严格小于max_cv；nan_passes决定基期均值为0等原因算不出变异系数时是否通过；
+    min_window不为None时历史不足window根也按已有的K线计算（至少min_window根）。
+    """
+    window: int
+    max_cv: float
+    skip: int = 0
+    inclusive: bool = True
+    nan_passes: bool = True
+    min_window: Optional[int] = None
+
+@dataclass(frozen=True)
+class Surge:
+    """最近recent根K线中任一（how='any'）或全部（how='all'）超过之前base根均值的multiple倍"""
+    recent: int
+    base: int
+    multiple: float = 3.0
+    how: str = 'any'
+    inclusive: bool = False  # True时达到倍数即可（>=）
+    min_base: Optional[int] = None  # 不为None时基期不足base根也按已有的K线求均值（至少min_base根）
+
+@dataclass(frozen=True)
+class Trend:
+    """最近window根K线的量能趋势
+
+    method='slope'：最小二乘斜率为正；'monotonic'：逐根增长（strict=False时允许持平）；
+    'rises'：相邻两根上涨的次数不少于min_rises。
+    """
+    window: int
+    method: str = 'slope'
+    strict: bool = True
+    min_rises: int = 0
+
+@dataclass(frozen=True)
+class NearMA:
+    """最新收盘价与MA fast/MA slow任一的偏离小于band（inclusive=True时不大于），或位于两条均线之间
+
+    between=None不检查区间，'any'为两均线之间（不分上下），'ordered'要求MA fast >= 收盘价 >= MA slow；
+    band=None只检查区间。
+    """
+    fast: int = 10
+    slow: int = 20
+    band: Optional[float] = 0.03
+    between: Optional[str] = 'any'
+    inclusive: bool = False
+
+@dataclass(frozen=True)
+class ScreenSpec:
+    name: str
+    bars: int  # 筛选用到的K线数，取每只股票最后bars根
+    rules: Tuple = ()
+    field: str = 'volume'  # 量能规则使用的字段
+    min_bars: Optional[int] = None  # 不为None时K线不足bars根、但有min_bars根的股票也参与（配合规则的min_window/min_base）
+
+# 每个规则对[..., 交易日]数组逐列求值：第t列是“截至第t天”的结果，快照筛选取最后一列
+
+def _stable_base(rule, values, close):
+    cv = shift(rolling_cv(values, rule.window, min_periods=rule.min_window), rule.skip)
+    with np.errstate(invalid='ignore'):
+        hit = cv <= rule.max_cv if rule.inclusive else cv < rule.max_cv
+    if rule.nan_passes:
+        hit |= np.isnan(cv)
+    return hit, {'cv': cv}
+
+def _surge(rule, values, close):
+    values = np.asarray(values, dtype='float64')
+    baseline = shift(rolling_mean(values, rule.base, min_periods=rule.min_base), rule.recent)
+    threshold = baseline * rule.multiple
+    hit = np.full(values.shape, rule.how == 'all')
+    first_ago = np.full(values.shape, -1, dtype='int64')
+    # recent很小（2~10根），按“几天前”逐个比较，每次都是整矩阵运算
+    with np.errstate(invalid='ignore'):
+        for ago in range(rule.recent):
+            past = shift(values, ago)
+            over = past >= threshold if rule.inclusive else past > threshold
+            hit = hit & over if rule.how == 'all' else hit | over
+            first_ago[over] = ago
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = rolling_max(values, rule.recent) / baseline
+    return hit, {'baseline': baseline, 'surge_ratio': ratio, 'first_surge_ago': first_ago}
+
+def _trend(rule, values, close):
+    if rule.method == 'slope':
+        slope = rolling_slope(values, rule.window)
+        with np.errstate(invalid='ignore'):
+            return slope > 0, {'slope': slope}
+    if rule.method == 'monotonic':
+        run = rise_run_length(values, rule.strict)
+        return run >= rule.window - 1, {'rises': np.minimum(run, rule.window - 1)}
+    count = count_rises(values, rule.window, rule.strict)
+    with np.errstate(invalid='ignore'):
+        return count >= rule.min_rises, {'rises': count}
+
+def _near_ma(rule, values, close):
+    price = np.asarray(close, dtype='float64')
+    ma_fast = rolling_mean(price, rule.fast)
+    ma_slow = rolling_mean(price, rule.slow)
+    hit = np.zeros(price.shape, dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if rule.band is not None:
+            within = np.less_equal if rule.inclusive else np.less
+            hit |= (within(np.abs(price - ma_fast) / ma_fast, rule.band)
+                    | within(np.abs(price - ma_slow) / ma_slow, rule.band))
+        if rule.between == 'any':
+            hit |= (np.minimum(ma_fast, ma_slow) <= price) & (price <= np.maximum(ma_fast, ma_slow))
+        elif rule.between == 'ordered':
+            hit |= (ma_fast >= price) & (price >= ma_slow)
+    return hit, {f'ma{rule.fast}': ma_fast, f'ma{rule.slow}': ma_slow}
+
+_EVALUATORS = {
+    StableBase: (_stable_base, lambda rule: rule.window + rule.skip),
+    Surge: (_surge, lambda rule: rule.recent + rule.base),
+    Trend: (_trend, lambda rule: rule.window),
+    NearMA: (_near_ma, lambda rule: max(rule.fast, rule.slow)),
+}
+
+@functools.lru_cache(maxsize=None)
+def compile_screen(spec):
+    """把spec编译成evaluate(values, close)
+
+    两个参数都是[..., 交易日]数组，返回逐列的(通过的掩码, 指标字典)；前spec.bars-1列历史不足，掩码为False
+    （设置了min_bars时为前min_bars-1列；K线不足bars根的股票在左侧补NaN）。
+    """
+    steps = []
+    for rule in spec.rules:
+        evaluator, needed = _EVALUATORS[type(rule)]
+        if needed(rule) > spec.bars:
+            raise ValueError(f"{spec.name}: {rule} needs {needed(rule)} bars, spec has {spec.bars}")
+        steps.append(functools.partial(evaluator, rule))
+
+    def evaluate(values, close=None):
+        mask = np.ones(values.shape, dtype=bool)
+        mask[..., :(spec.min_bars or spec.bars) - 1] = False
+        metrics = {}
+        for step in steps:
+            hit, extra = step(values, close)
+            mask &= hit
+            metrics.update(extra)
+        return mask, metrics
+    return evaluate
+
+def load_window(conn, codes, bars, field='volume', end_date=None, min_bars=None):
+    """按股票分批读取截至end_date的K线，取每只股票最后bars根
+
+    返回(codes, dates, values, close)，后三个都是[股票, bars]矩阵（dates为datetime64[D]，values/close为float64）；
+    K线不足bars根的股票不返回，给出min_bars时有min_bars根即返回，左侧不足的位置为NaN/NaT。
+    """
+    end_date = end_date or datetime.now().strftime('%Y-%m-%d')
+    start_date = window_start_date(bars, end_date)
+    columns = ['code', 'date', field] + ([] if field == 'close' else ['close'])
+    parts = []
+    batch = SCREEN_CONFIG['code_batch']
+    for i in range(0, len(codes), batch):
+        chunk = list(codes[i:i + batch])
+        placeholders = ', '.join(['%s'] * len(chunk))
+        parts.append(fetch_columns(
+            conn,
+            f"SELECT {', '.join(columns)} FROM stock_kline "
+            f"WHERE code IN ({placeholders}) AND date BETWEEN %s AND %s ORDER BY code, date",
+            chunk + [start_date, end_date], columns, size_hint=len(chunk) * bars))
+    row_codes = np.concatenate([part['code'] for part in parts]) if parts else np.array([], dtype=object)
+    if not len(row_codes):
+        return row_codes, np.empty((0, bars), dtype='datetime64[D]'), np.empty((0, bars)), np.empty((0, bars))
+    dates = np.concatenate([part['date'] for part in parts])
+    values = np.concatenate([part[field] for part in parts]).astype('float64')
+    close = np.concatenate([part['close'] for part in parts])
+
+    # 数据按(code, date)排好序，每只股票最后一行的位置往前取bars行
+    ends = np.flatnonzero(np.append(row_codes[1:] != row_codes[:-1], True))
+    starts = np.append(0, ends[:-1] + 1)
+    keep = ends - starts + 1 >= (min_bars or bars)
+    ends, starts = ends[keep], starts[keep]
+    index = ends[:, None] - (bars - 1) + np.arange(bars)
+    # 不足bars根的股票，窗口伸到前一只股票的行，这些位置置空
+    missing = index < starts[:, None]
+    index = np.maximum(index, 0)
+    dates, values, close = dates[index], values[index], close[index]
+    if missing.any():
+        dates[missing] = np.datetime64('NaT')
+        values[missing] = np.nan
+        close[missing] = np.nan
+    return row_codes[ends], dates, values, close
+
+def hits_frame(spec, codes, dates, values, close, mask, metrics):
+    """mask和metrics为最后一天的结果（[股票]），整理成通过筛选的股票列表"""
+    out = {'code': codes[mask], 'date': dates[mask, -1], 'close': close[mask, -1], spec.field: values[mask, -1]}
+    for name, metric in metrics.items():
+        out[name] = metric[mask]
+    if 'first_surge_ago' in metrics:
+        rows = np.flatnonzero(mask)
+        position = values.shape[-1] - 1 - metrics['first_surge_ago'][mask]
+        out['first_surge_date'] = dates[rows, position]
+        out['first_surge_value'] = values[rows, position]
+    return pd.DataFrame(out)
+
+def last_day(mask, metrics):
+    """逐列结果只保留最后一天"""
+    return mask[..., -1], {name: metric[..., -1] for name, metric in metrics.items()}
+
+def run_screen(conn, spec, codes, end_date=None):
+    """对codes执行spec，返回通过的股票及指标"""
+    codes, dates, values, close = load_window(conn, codes, spec.bars, spec.field, end_date, spec.min_bars)
+    mask, metrics = last_day(*compile_screen(spec)(values, close))
+    return hits_frame(spec, codes, dates, values, close, mask, metrics)
+
+def screen_frame(spec, df):
+    """单只股票按日期升序的DataFrame（含spec.field和close列），通过时返回指标字典，否则返回None"""
+    if len(df) < (spec.min_bars or spec.bars):
+        return None
+    tail = df.iloc[-spec.bars:]
+    values = pd.to_numeric(tail[spec.field], errors='coerce').to_numpy(dtype='float64')[None, :]
+    close = (pd.to_numeric(tail['close'], errors='coerce').to_numpy(dtype='float64')[None, :]
+             if 'close' in tail else np.full_like(values, np.nan))
+    mask, metrics = last_day(*compile_screen(spec)(values, close))
+    if not mask[0]:
+        return None
+    return {name: value[0] for name, value in metrics.items()}
+
+# 各脚本的预设，阈值与原先手写的条件一致
+
+# volume_screen：前15天成交额相对标准差不超过0.8，最近2天都超过均值3倍且逐日增长
+VOLUME_SCREEN = ScreenSpec('volume_screen', bars=17, field='amount', rules=(
+    StableBase(window=15, skip=2, max_cv=0.8),
+    Surge(recent=2, base=15, multiple=3, how='all'),
+    Trend(window=2, method='monotonic'),
+))
+
+# StockScreener：前50天（排除最近10天）变异系数小于0.5（原脚本cv < 0.5，算不出变异系数时不通过），最近10天有一天超过之前20天均值3倍、量能斜率为正，
+# 收盘价在MA10/MA20上下3%或两者之间
+STOCK_SCREENER = ScreenSpec('stock_screener', bars=60, rules=(
+    StableBase(window=50, skip=10, max_cv=0.5, inclusive=False, nan_passes=False),
+    Surge(recent=10, base=20, multiple=3),
+    Trend(window=10, method='slope'),
+    NearMA(fast=10, slow=20, band=0.03, between='any'),
+))
+
+# StockVolumeScanner：最近10天之前的80天变异系数不超过0.5，最近10天最大量达到其均值3倍、斜率为正，
+# 收盘价在MA10或MA20上下3%以内（含3%）
+VOLUME_SCANNER = ScreenSpec('stock_volume_scanner', bars=90, rules=(
+    StableBase(window=80, skip=10, max_cv=0.5),
+    Surge(recent=10, base=80, multiple=3, inclusive=True),
+    Trend(window=10, method='slope'),
+    NearMA(fast=10, slow=20, band=0.03, between=None, inclusive=True),
+))
+
+# volume_filter：最近10天之前的60天变异系数不超过0.8，最近10天有一天达到其均值3倍、至少7次上涨，
+# 收盘价位于MA10和MA20之间（MA10在上）。与原脚本一样有60根K线即参与，不足70根时基期取最近10天之前的全部K线
+VOLUME_FILTER = ScreenSpec('volume_filter', bars=70, min_bars=60, rules=(
+    StableBase(window=60, skip=10, max_cv=0.8, min_window=50),
+    Surge(recent=10, base=60, multiple=3, inclusive=True, min_base=50),
+    Trend(window=10, method='rises', min_rises=7),
+    NearMA(fast=10, slow=20, band=None, between='ordered'),
+))
+
+# volume_spike_scanner：最近3天都达到之前27天均值的3倍，且逐日不减
+VOLUME_SPIKE = ScreenSpec('volume_spike_scanner', bars=30, rules=(
+    Surge(recent=3, base=27, multiple=3, how='all', inclusive=True),
+    Trend(window=3, method='monotonic', strict=False),
+))
+
+PRESETS = {spec.name: spec for spec in (VOLUME_SCREEN, STOCK_SCREENER, VOLUME_SCANNER, VOLUME_FILTER, VOLUME_SPIKE)}
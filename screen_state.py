@@ -0,0 +1,299 @@
+"""逐K线增量维护的筛选状态
+
+每只股票保存：
+  - volume/amount/close最近size根K线的环形缓冲区（停牌日没有K线，不占位置，与逐只读取最后N根的语义一致）
+  - 筛选规则用到的每个(字段, 窗口, 跳过最近几根)的滑动和与平方和：StableBase的基期、Surge的基期均值、NearMA的均线
+每天新的一根K线进入时，环形缓冲区写一格，每个滑动和加上进入窗口的值、减去离开窗口的值，都是O(1)；
+筛选时由滑动和直接得到均值、变异系数和均线，趋势等短窗口条件取缓冲区末尾几根，一次遍历全市场。
+
+数据来自行情面板（market_panel），daily_update在更新面板后调用update_screen_state()；
+面板改写了已经进入状态的交易日（补数据、修复）时整体重建。
+
+    python screen_state.py [--rebuild] [--screen stock_screener]
+"""
+import os
+import json
+import time
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+from market_panel import MarketPanel
+from rolling_kernels import rolling_slope, rise_run_length, count_rises
+from screen_rules import StableBase, Surge, Trend, NearMA, PRESETS
+from config import STATE_CONFIG
+
+STATE_FIELDS = ('volume', 'amount', 'close')
+
+def accumulator_keys(specs):
+    """specs需要的(字段, 窗口, 跳过最近几根)滑动和"""
+    keys = set()
+    for spec in specs:
+        for rule in spec.rules:
+            if isinstance(rule, StableBase):
+                keys.add((spec.field, rule.window, rule.skip))
+            elif isinstance(rule, Surge):
+                keys.add((spec.field, rule.base, rule.recent))
+            elif isinstance(rule, NearMA):
+                keys.add(('close', rule.fast, 0))
+                keys.add(('close', rule.slow, 0))
+    return sorted(keys)
+
+def _key_name(key):
+    return f"{key[0]}_{key[1]}_{key[2]}"
+
+class ScreenState:
+    def __init__(self, codes, size, keys, count=None, last_date=None, rings=None, sums=None, meta=None):
+        n = len(codes)
+        self.codes = list(codes)
+        self.size = size
+        self.keys = list(keys)
+        self.count = np.zeros(n, dtype='int64') if count is None else count
+        self.last_date = np.full(n, np.datetime64('NaT'), dtype='datetime64[D]') if last_date is None else last_date
+        self.rings = rings or {field: np.full((n, size), np.nan) for field in STATE_FIELDS}
+        self.sums = sums or {key: (np.zeros(n), np.zeros(n)) for key in self.keys}
+        self.meta = meta or {'last_day': None, 'panel_synced_at': None, 'updates_since_resync': 0}
+
+    @classmethod
+    def empty(cls, specs, codes=()):
+        keys = accumulator_keys(specs)
+        size = max([spec.bars for spec in specs] + [window + skip + 1 for _, window, skip in keys])
+        return cls(codes, size, keys)
+
+    def add_codes(self, codes):
+        """追加新代码（面板只会在末尾追加代码，行号保持一致）"""
+        extra = len(codes) - len(self.codes)
+        if extra <= 0:
+            return
+        self.codes = list(codes)
+        self.count = np.concatenate([self.count, np.zeros(extra, dtype='int64')])
+        self.last_date = np.concatenate([self.last_date, np.full(extra, np.datetime64('NaT'), dtype='datetime64[D]')])
+        for field in STATE_FIELDS:
+            self.rings[field] = np.vstack([self.rings[field], np.full((extra, self.size), np.nan)])
+        for key, (total, squares) in self.sums.items():
+            self.sums[key] = (np.concatenate([total, np.zeros(extra)]), np.concatenate([squares, np.zeros(extra)]))
+
+    def _ago(self, field, k, rows=None):
+        """k根K线之前的值；历史不足时为0（滑动和只用已存在的K线，是否满窗由count判断）"""
+        rows = np.arange(len(self.codes)) if rows is None else rows
+        count = self.count[rows]
+        values = self.rings[field][rows, (count - 1 - k) % self.size]
+        return np.where(count > k, np.nan_to_num(values), 0.0)
+
+    def push(self, rows, day, values):
+        """rows这些股票在day有一根新K线，values为{字段: 一维数组}；每只股票O(1)"""
+        slots = self.count[rows] % self.size
+        for field in STATE_FIELDS:
+            self.rings[field][rows, slots] = values[field]
+        self.count[rows] += 1
+        self.last_date[rows] = day
+        for (field, window, skip), (total, squares) in self.sums.items():
+            entering = self._ago(field, skip, rows)
+            leaving = self._ago(field, skip + window, rows)
+            total[rows] += entering - leaving
+            squares[rows] += entering * entering - leaving * leaving
+
+    def tail(self, field, n):
+        """每只股票最近n根K线，[股票, n]，从旧到新；不足的位置为NaN"""
+        k = np.arange(n - 1, -1, -1)
+        index = (self.count[:, None] - 1 - k) % self.size
+        values = np.take_along_axis(self.rings[field], index, axis=1)
+        return np.where(self.count[:, None] > k, values, np.nan)
+
+    def resync(self):
+        """按环形缓冲区重新计算所有滑动和，消除长期增量累加的舍入误差"""
+        for field, window, skip in self.keys:
+            values = np.nan_to_num(self.tail(field, window + skip)[:, :window])
+            self.sums[(field, window, skip)] = (values.sum(axis=1), (values * values).sum(axis=1))
+        self.meta['updates_since_resync'] = 0
+
+    def _window_count(self, key):
+        """每只股票窗口内已有的K线数（历史不足window + skip根时小于window）"""
+        field, window, skip = key
+        return np.clip(self.count - skip, 0, window)
+
+    def window_mean(self, key, min_periods=None):
+        """滑动和对应的均值；窗口内K线少于min_periods（默认满窗）时为NaN"""
+        total, _ = self.sums[key]
+        n = self._window_count(key)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(n >= (min_periods or key[1]), total / n, np.nan)
+
+    def window_cv(self, key, min_periods=None):
+        total, squares = self.sums[key]
+        n = self._window_count(key)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = total / n
+            var = np.maximum((squares - total * total / n) / (n - 1), 0.0)
+            cv = np.sqrt(var) / mean
+        return np.where(n >= max(min_periods or key[1], 2), cv, np.nan)
+
+    def evaluate(self, spec):
+        """由状态对全市场执行spec，返回(通过的掩码, 指标字典)，语义与screen_rules的快照筛选相同
+
+        只有最后一根K线在状态的最后交易日的股票参与：停牌、退市的股票环形缓冲区仍是满的，
+        但快照筛选只读取最近的交易日，它们不会出现。
+        """
+        mask = self.count >= (spec.min_bars or spec.bars)
+        if self.meta['last_day'] is not None:
+            mask &= self.last_date == np.datetime64(self.meta['last_day'], 'D')
+        metrics = {}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for rule in spec.rules:
+                if isinstance(rule, StableBase):
+                    cv = self.window_cv((spec.field, rule.window, rule.skip), rule.min_window)
+                    hit = cv <= rule.max_cv if rule.inclusive else cv < rule.max_cv
+                    mask &= (hit | np.isnan(cv)) if rule.nan_passes else hit
+                    metrics['cv'] = cv
+                elif isinstance(rule, Surge):
+                    baseline = self.window_mean((spec.field, rule.base, rule.recent), rule.min_base)
+                    recent = self.tail(spec.field, rule.recent)
+                    threshold = baseline[:, None] * rule.multiple
+                    over = recent >= threshold if rule.inclusive else recent > threshold
+                    mask &= over.all(axis=1) if rule.how == 'all' else over.any(axis=1)
+                    metrics['baseline'] = baseline
+                    metrics['surge_ratio'] = recent.max(axis=1) / baseline
+                    metrics['first_surge_ago'] = np.where(over.any(axis=1), rule.recent - 1 - over.argmax(axis=1), -1)
+                elif isinstance(rule, Trend):
+                    recent = self.tail(spec.field, rule.window)
+                    if rule.method == 'slope':
+                        slope = rolling_slope(recent, rule.window)[:, -1]
+                        mask &= slope > 0
+                        metrics['slope'] = slope
+                    elif rule.method == 'monotonic':
+                        run = rise_run_length(recent, rule.strict)[:, -1]
+                        mask &= run >= rule.window - 1
+                        metrics['rises'] = run
+                    else:
+                        rises = count_rises(recent, rule.window, rule.strict)[:, -1]
+                        mask &= rises >= rule.min_rises
+                        metrics['rises'] = rises
+                elif isinstance(rule, NearMA):
+                    price = self.tail('close', 1)[:, 0]
+                    ma_fast = self.window_mean(('close', rule.fast, 0))
+                    ma_slow = self.window_mean(('close', rule.slow, 0))
+                    hit = np.zeros(len(self.codes), dtype=bool)
+                    if rule.band is not None:
+                        within = np.less_equal if rule.inclusive else np.less
+                        hit |= (within(np.abs(price - ma_fast) / ma_fast, rule.band)
+                                | within(np.abs(price - ma_slow) / ma_slow, rule.band))
+                    if rule.between == 'any':
+                        hit |= (np.minimum(ma_fast, ma_slow) <= price) & (price <= np.maximum(ma_fast, ma_slow))
+                    elif rule.between == 'ordered':
+                        hit |= (ma_fast >= price) & (price >= ma_slow)
+                    mask &= hit
+                    metrics[f'ma{rule.fast}'] = ma_fast
+                    metrics[f'ma{rule.slow}'] = ma_slow
+        return mask, metrics
+
+    def screen(self, spec):
+        """通过筛选的股票及指标，列与screen_rules.run_screen一致（不含首次放量日期）"""
+        mask, metrics = self.evaluate(spec)
+        rows = np.flatnonzero(mask)
+        out = {'code': [self.codes[i] for i in rows], 'date': self.last_date[rows],
+               'close': self.tail('close', 1)[rows, 0], spec.field: self.tail(spec.field, 1)[rows, 0]}
+        for name, metric in metrics.items():
+            out[name] = metric[rows]
+        return pd.DataFrame(out)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        arrays = {'codes': np.array(self.codes, dtype=str), 'count': self.count, 'last_date': self.last_date}
+        for field in STATE_FIELDS:
+            arrays[f'ring_{field}'] = self.rings[field]
+        for key, (total, squares) in self.sums.items():
+            arrays[f'sum_{_key_name(key)}'] = total
+            arrays[f'sq_{_key_name(key)}'] = squares
+        meta = {**self.meta, 'size': self.size, 'keys': [list(key) for key in self.keys]}
+        arrays['meta'] = np.array(json.dumps(meta))
+        tmp_path = os.path.join(path, 'state.tmp.npz')
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, os.path.join(path, 'state.npz'))
+
+    @classmethod
+    def load(cls, path):
+        file_path = os.path.join(path, 'state.npz')
+        if not os.path.exists(file_path):
+            return None
+        with np.load(file_path) as data:
+            meta = json.loads(str(data['meta']))
+            keys = [tuple(key) for key in meta.pop('keys')]
+            size = meta.pop('size')
+            rings = {field: data[f'ring_{field}'] for field in STATE_FIELDS}
+            sums = {key: (data[f'sum_{_key_name(key)}'], data[f'sq_{_key_name(key)}']) for key in keys}
+            return cls(data['codes'].tolist(), size, keys, data['count'], data['last_date'], rings, sums, meta)
+
+def _push_panel_day(state, panel, column):
+    volume = panel.array('volume')[:, column]
+    rows = np.flatnonzero(~np.isnan(volume))
+    if len(rows):
+        state.push(rows, panel.dates[column], {field: np.asarray(panel.array(field)[rows, column], dtype='float64')
+                                               for field in STATE_FIELDS})
+
+def rebuild_screen_state(panel, specs):
+    """用面板最近若干交易日重放出状态（长期停牌的股票可能不满窗，下次满窗前不参与筛选）
+
+    返回(状态, 重放的交易日数)。
+    """
+    state = ScreenState.empty(specs, panel.codes)
+    n_days = panel.meta['n_days']
+    start = max(0, n_days - state.size * STATE_CONFIG['rebuild_lookback_factor'])
+    for column in range(start, n_days):
+        _push_panel_day(state, panel, column)
+    state.resync()
+    return state, n_days - start
+
+def update_screen_state(path=None, rebuild=False, specs=None):
+    """把面板上新增的交易日推入状态，返回推入的交易日数"""
+    path = path or STATE_CONFIG['dir']
+    specs = specs or list(PRESETS.values())
+    panel = MarketPanel.open()
+    if panel is None:
+        raise RuntimeError("Market panel unavailable, run market_panel.py first")
+    if not panel.meta['n_days']:
+        return 0
+
+    state = None if rebuild else ScreenState.load(path)
+    last_day = None if state is None else state.meta['last_day']
+    changed_from = panel.meta.get('changed_from')
+    if state is not None and state.keys != accumulator_keys(specs):
+        logging.info("Screen specs changed, rebuilding screen state")
+        state = None
+    elif (state is not None and panel.meta['synced_at'] != state.meta['panel_synced_at']
+          and changed_from is not None and last_day is not None and changed_from <= last_day):
+        logging.info(f"Market panel rewrote {changed_from}, already in the screen state; rebuilding")
+        state = None
+
+    if state is None:
+        state, pushed = rebuild_screen_state(panel, specs)
+    else:
+        state.add_codes(panel.codes)
+        start = int(np.searchsorted(panel.dates, np.datetime64(last_day, 'D'), side='right')) if last_day else 0
+        for column in range(start, len(panel.dates)):
+            _push_panel_day(state, panel, column)
+        pushed = len(panel.dates) - start
+        state.meta['updates_since_resync'] += pushed
+        if state.meta['updates_since_resync'] >= STATE_CONFIG['resync_every']:
+            state.resync()
+    state.meta['last_day'] = str(panel.dates[-1])
+    state.meta['panel_synced_at'] = panel.meta['synced_at']
+    state.save(path)
+    return pushed
+
+def main():
+    parser = argparse.ArgumentParser(description="Update the incremental screening state and run a screen from it")
+    parser.add_argument('--rebuild', action='store_true', help="replay the state from the market panel")
+    parser.add_argument('--screen', choices=sorted(PRESETS), default=None, help="preset to run after the update")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    print(f"Pushed {update_screen_state(rebuild=args.rebuild)} trading days into the screen state")
+    if args.screen:
+        state = ScreenState.load(STATE_CONFIG['dir'])
+        started = time.monotonic()
+        hits = state.screen(PRESETS[args.screen])
+        print(f"{args.screen}: {len(hits)} of {len(state.codes)} codes in {(time.monotonic() - started) * 1000:.1f}ms")
+        if len(hits):
+            print(hits.to_string(index=False))
+
+if __name__ == "__main__":
+    main()
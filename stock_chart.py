@@ -1,8 +1,8 @@
-import mysql.connector
-import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-from config import DB_CONFIG
+from db_pool import get_connection
+from kline_loader import read_frame
+from rolling_kernels import rolling_mean
 import dash
 from dash import dcc, html
 from dash.dependencies import Input, Output
@@ -16,9 +16,6 @@ def get_screened_stocks():
     获取筛选后的股票列表
     """
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-        
         # 直接获取最新日期的筛选结果
         query = """
         SELECT v.stock_code, v.stock_name 
@@ -31,11 +28,11 @@ def get_screened_stocks():
         AND v.scan_date = latest.latest_date
         ORDER BY v.stock_code
         """
-        cursor.execute(query)
-        stocks = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query)
+            stocks = cursor.fetchall()
+            cursor.close()
         
         if not stocks:
             logging.warning("No screened stocks found in database")
@@ -53,9 +50,6 @@ def get_stock_data(stock_code):
     从数据库获取股票数据，并包含股票名称
     """
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-        
         # 获取股票数据和名称
         query = """
         SELECT k.date, k.open, k.high, k.low, k.close, k.volume,
@@ -74,15 +68,10 @@ def get_stock_data(stock_code):
         WHERE k.code = %s
         ORDER BY k.date
         """
-        cursor.execute(query, (stock_code, stock_code, stock_code))
-        
-        # 获取数据并转换为DataFrame
-        data = cursor.fetchall()
-        df = pd.DataFrame(data, columns=['date', 'open', 'high', 'low', 'close', 'volume', 'stock_name'])
-        df['date'] = pd.to_datetime(df['date'])
-        
-        cursor.close()
-        conn.close()
+        # 按列读成float64/int64，日期为datetime64
+        with get_connection() as conn:
+            df = read_frame(conn, query, (stock_code, stock_code, stock_code),
+                            columns=['date', 'open', 'high', 'low', 'close', 'volume', 'stock_name'])
         
         return df
     
@@ -105,8 +94,8 @@ def create_candlestick_figure(stock_code):
     title = f'{stock_name} ({stock_code})'
     
     # 计算移动平均线
-    df['MA10'] = df['close'].rolling(window=10).mean()
-    df['MA20'] = df['close'].rolling(window=20).mean()
+    df['MA10'] = rolling_mean(df['close'].to_numpy(), 10)
+    df['MA20'] = rolling_mean(df['close'].to_numpy(), 20)
     
     # 创建子图布局
     fig = make_subplots(rows=2, cols=1, shared_xaxes=True, 
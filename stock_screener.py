@@ -1,107 +1,46 @@
-import pymysql
 import pandas as pd
-import numpy as np
-from config import DB_CONFIG
-from datetime import datetime, timedelta
-import concurrent.futures
-from tqdm import tqdm
 import logging
+import argparse
+from trade_calendar import window_start_date
+from kline_loader import load_stock_kline
+from db_pool import get_connection, log_pool_stats
+from screen_rules import run_screen, screen_frame, STOCK_SCREENER
+from screen_parallel import run_screen_parallel
+from config import SCREEN_CONFIG
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 
 class StockScreener:
-    def __init__(self):
-        self.conn = pymysql.connect(
-            host=DB_CONFIG['host'],
-            port=DB_CONFIG['port'],
-            user=DB_CONFIG['user'],
-            password=DB_CONFIG['password'],
-            database=DB_CONFIG['database']
-        )
-        
-    def get_stock_data(self, stock_code):
-        """获取指定股票最近90天的数据"""
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=120)  # 获取多一点数据以便计算均线
-        
-        query = """
-            SELECT code, date, open, high, low, close, volume, amount, adjustflag, turn
-            FROM stock_kline
-            WHERE code = %s AND date >= %s
-            ORDER BY date ASC
-        """
-        df = pd.read_sql(query, self.conn, params=(stock_code, start_date.strftime('%Y-%m-%d')))
-        return df
-    
-    def calculate_moving_averages(self, df):
-        """计算10日和20日均线"""
-        df['MA10'] = df['close'].rolling(window=10).mean()
-        df['MA20'] = df['close'].rolling(window=20).mean()
-        return df
-    
-    def check_volume_stability(self, df, lookback_days=60):
-        """检查过去几个月成交量是否稳定（横盘）"""
-        if len(df) < lookback_days:
-            return False
-            
-        recent_volume = df['volume'].iloc[-lookback_days:-10]  # 排除最近10天
-        cv = recent_volume.std() / recent_volume.mean()
-        return cv < 0.5  # 变异系数小于0.5认为相对稳定
-    
-    def check_volume_surge(self, df):
-        """检查最近10天是否有3倍成交量且持续增长"""
-        if len(df) < 30:
-            return False
-            
-        # 计算基准成交量（最近10天之前的20天平均成交量）
-        baseline_volume = df['volume'].iloc[-30:-10].mean()
-        recent_volumes = df['volume'].tail(10)
-        
-        # 检查是否有3倍成交量
-        has_surge = any(recent_volumes > baseline_volume * 3)
-        
-        # 检查最近10天成交量趋势
-        volume_trend = np.polyfit(range(10), recent_volumes.values, 1)[0]
-        
-        return has_surge and volume_trend > 0
-    
-    def check_price_ma_position(self, df):
-        """检查价格是否在10-20日均线附近"""
-        if len(df) < 20:
-            return False
-            
-        latest = df.iloc[-1]
-        price = latest['close']
-        ma10 = latest['MA10']
-        ma20 = latest['MA20']
-        
-        # 价格在MA10和MA20之间，或者接近其中之一（上下3%范围内）
-        near_ma10 = abs(price - ma10) / ma10 < 0.03
-        near_ma20 = abs(price - ma20) / ma20 < 0.03
-        between_mas = min(ma10, ma20) <= price <= max(ma10, ma20)
-        
-        return near_ma10 or near_ma20 or between_mas
+    """条件见screen_rules.STOCK_SCREENER：基期量能稳定、最近10天放量且趋势向上、收盘价在MA10/MA20附近
+
+    需要数据库时从连接池签出连接，不持有共享连接。
+    """
+    spec = STOCK_SCREENER
+
+    def get_stock_data(self, stock_code, bars=60):
+        """获取指定股票最近bars个交易日的数据（覆盖60日成交量窗口和均线计算）"""
+        start_date = window_start_date(bars)
+        # 直接读成float64/int64列，避免Decimal对象列上的rolling计算
+        with get_connection() as conn:
+            return load_stock_kline(conn, stock_code, start_date=start_date, size_hint=bars)
     
+    def _result(self, code, date, close, volume, metrics):
+        return {
+            'code': code,
+            'latest_price': close,
+            'latest_volume': volume,
+            'avg_volume': metrics['baseline'],
+            'date': pd.Timestamp(date).strftime('%Y-%m-%d')
+        }
+
     def screen_stock(self, stock_code):
         """筛选单个股票"""
         try:
             df = self.get_stock_data(stock_code)
-            if len(df) < 60:  # 数据不足，跳过
-                return None
-                
-            df = self.calculate_moving_averages(df)
-            
-            # 检查条件
-            if (self.check_volume_stability(df) and 
-                self.check_volume_surge(df) and 
-                self.check_price_ma_position(df)):
-                return {
-                    'code': stock_code,
-                    'latest_price': df['close'].iloc[-1],
-                    'latest_volume': df['volume'].iloc[-1],
-                    'avg_volume': df['volume'].iloc[-30:-10].mean(),
-                    'date': df['date'].iloc[-1].strftime('%Y-%m-%d')
-                }
+            metrics = screen_frame(self.spec, df)
+            if metrics:
+                return self._result(stock_code, df['date'].iloc[-1], df['close'].iloc[-1],
+                                    df['volume'].iloc[-1], metrics)
         except Exception as e:
             logging.error(f"处理股票 {stock_code} 时出错: {str(e)}")
         return None
@@ -109,31 +48,30 @@ class StockScreener:
     def get_all_stock_codes(self):
         """获取所有股票代码"""
         query = "SELECT DISTINCT code FROM stock_kline"
-        df = pd.read_sql(query, self.conn)
+        with get_connection() as conn:
+            df = pd.read_sql(query, conn)
         return df['code'].tolist()
 
-    def screen_stocks(self, max_workers=8):
-        """多线程筛选股票"""
+    def screen_stocks(self, workers=None):
+        """一次读取所有股票的窗口，对全市场向量化执行筛选；workers > 1时分到多个进程（共享内存）"""
+        workers = workers or SCREEN_CONFIG['workers']
         stock_codes = self.get_all_stock_codes()
-        results = []
-        
         logging.info(f"开始筛选 {len(stock_codes)} 只股票...")
-        
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = {executor.submit(self.screen_stock, code): code for code in stock_codes}
-            
-            with tqdm(total=len(stock_codes), desc="筛选进度") as pbar:
-                for future in concurrent.futures.as_completed(futures):
-                    result = future.result()
-                    if result:
-                        results.append(result)
-                    pbar.update(1)
-        
-        return results
+        with get_connection() as conn:
+            if workers > 1:
+                hits = run_screen_parallel(conn, self.spec, stock_codes, workers)
+            else:
+                hits = run_screen(conn, self.spec, stock_codes)
+        log_pool_stats()
+        return [self._result(row['code'], row['date'], row['close'], row['volume'], row)
+                for row in hits.to_dict('records')]
 
 def main():
+    parser = argparse.ArgumentParser(description="按STOCK_SCREENER条件筛选全市场")
+    parser.add_argument('--workers', type=int, default=None, help="screening processes (default SCREEN_CONFIG['workers'])")
+    args = parser.parse_args()
     screener = StockScreener()
-    results = screener.screen_stocks()
+    results = screener.screen_stocks(args.workers)
     
     if results:
         print("\n符合条件的股票：")
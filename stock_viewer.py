@@ -1,27 +1,23 @@
 import streamlit as st
-import mysql.connector
 from stock_chart import plot_candlestick
-from config import DB_CONFIG
+from db_pool import get_connection
 
 def get_stock_list():
     """
     从数据库获取所有可用的股票代码和名称
     """
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-        
         query = """
         SELECT DISTINCT k.code, c.code_name 
         FROM stock_kline k
         LEFT JOIN stock_codes c ON k.code = c.code
         ORDER BY k.code
         """
-        cursor.execute(query)
-        stocks = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query)
+            stocks = cursor.fetchall()
+            cursor.close()
         
         return stocks
         
@@ -1,26 +1,20 @@
-import pymysql
-from config import DB_CONFIG
 import pandas as pd
-from datetime import datetime, timedelta
-import numpy as np
-import concurrent.futures
+from datetime import datetime
 from typing import List, Dict
 import logging
+import argparse
+from trade_calendar import window_start_date
+from db_pool import get_connection, log_pool_stats
+from screen_rules import run_screen, screen_frame, VOLUME_SCANNER
+from screen_parallel import run_screen_parallel
+from config import SCREEN_CONFIG
 
 # 设置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 class StockVolumeScanner:
-    def __init__(self, thread_workers=4):
-        self.thread_workers = thread_workers
-        self.conn = pymysql.connect(
-            host=DB_CONFIG['host'],
-            port=DB_CONFIG['port'],
-            user=DB_CONFIG['user'],
-            password=DB_CONFIG['password'],
-            database=DB_CONFIG['database']
-        )
-        self.cursor = self.conn.cursor()
+    """条件见screen_rules.VOLUME_SCANNER；不持有共享的连接和游标，每次查询从连接池签出"""
+    spec = VOLUME_SCANNER
 
     def get_stock_codes(self) -> List[str]:
         """获取所有股票代码"""
@@ -29,13 +23,17 @@ class StockVolumeScanner:
         FROM stock_kline 
         WHERE date >= DATE_SUB(CURDATE(), INTERVAL 90 DAY)
         """
-        self.cursor.execute(query)
-        return [row[0] for row in self.cursor.fetchall()]
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query)
+            codes = [row[0] for row in cursor.fetchall()]
+            cursor.close()
+        return codes
 
-    def get_stock_data(self, code: str, days=90) -> pd.DataFrame:
-        """获取指定股票最近days天的数据"""
+    def get_stock_data(self, code: str, bars=90) -> pd.DataFrame:
+        """获取指定股票最近bars个交易日的数据"""
         end_date = datetime.now().strftime('%Y-%m-%d')
-        start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+        start_date = window_start_date(bars)
         
         query = """
         SELECT code, date, open, high, low, close, volume, amount, turn
@@ -44,112 +42,68 @@ class StockVolumeScanner:
         ORDER BY date
         """
         
-        self.cursor.execute(query, (code, start_date, end_date))
         columns = ['code', 'date', 'open', 'high', 'low', 'close', 'volume', 'amount', 'turn']
-        data = pd.DataFrame(list(self.cursor.fetchall()), columns=columns)
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, (code, start_date, end_date))
+            data = pd.DataFrame(list(cursor.fetchall()), columns=columns)
+            cursor.close()
         return data
 
-    def calculate_ma(self, group: pd.DataFrame, window: int) -> pd.Series:
-        """计算移动平均线"""
-        return group['close'].rolling(window=window).mean()
+    def _result(self, code, date, close, metrics) -> Dict:
+        return {
+            'code': code,
+            'latest_date': date,
+            'latest_price': close,
+            'volume_increase': metrics['surge_ratio'],
+            'ma10': metrics['ma10'],
+            'ma20': metrics['ma20'],
+            'volume_trend': metrics['slope']
+        }
 
     def analyze_single_stock(self, code: str) -> Dict:
         """分析单个股票"""
         try:
             group = self.get_stock_data(code)
-            if len(group) < 90:  # 确保有足够的数据
+            metrics = screen_frame(self.spec, group)
+            if metrics is None:
                 return None
-                
-            # 计算MA10和MA20
-            group['MA10'] = self.calculate_ma(group, 10)
-            group['MA20'] = self.calculate_ma(group, 20)
-            
-            # 获取最近10天的数据
-            recent_data = group.tail(10)
-            old_data = group[:-10]
-            
-            if len(old_data) < 30:
-                return None
-            
-            # 计算之前的平均成交量和标准差
-            avg_volume_before = old_data['volume'].mean()
-            volume_cv = old_data['volume'].std() / old_data['volume'].mean()
-            
-            # 1. 检查之前是否横盘（成交量稳定）
-            if volume_cv > 0.5:
-                return None
-            
-            # 2&3. 检查最近10天的成交量
-            recent_volumes = recent_data['volume'].values
-            max_recent_volume = recent_volumes.max()
-            
-            # 检查是否有3倍量
-            if max_recent_volume < avg_volume_before * 3:
-                return None
-            
-            # 检查成交量趋势
-            volume_trend = np.polyfit(range(len(recent_volumes)), recent_volumes, 1)[0]
-            if volume_trend <= 0:
-                return None
-            
-            # 4. 检查价格是否在均线附近
-            latest_price = group['close'].iloc[-1]
-            latest_ma10 = group['MA10'].iloc[-1]
-            latest_ma20 = group['MA20'].iloc[-1]
-            
-            deviation = 0.03
-            near_ma = (abs(latest_price - latest_ma10) / latest_ma10 <= deviation or 
-                      abs(latest_price - latest_ma20) / latest_ma20 <= deviation)
-            
-            if not near_ma:
-                return None
-            
-            return {
-                'code': code,
-                'latest_date': group['date'].iloc[-1],
-                'latest_price': latest_price,
-                'volume_increase': max_recent_volume / avg_volume_before,
-                'ma10': latest_ma10,
-                'ma20': latest_ma20,
-                'volume_trend': volume_trend
-            }
+            return self._result(code, group['date'].iloc[-1], float(group['close'].iloc[-1]), metrics)
         except Exception as e:
             logging.error(f"处理股票 {code} 时发生错误: {str(e)}")
             return None
 
-    def scan_volume_patterns(self) -> pd.DataFrame:
-        """使用多线程扫描符合条件的股票"""
+    def scan_volume_patterns(self, workers=None) -> pd.DataFrame:
+        """一次读取所有股票的窗口，对全市场向量化扫描；workers > 1时分到多个进程（共享内存）"""
+        workers = workers or SCREEN_CONFIG['workers']
         stock_codes = self.get_stock_codes()
-        results = []
-        
         logging.info(f"开始扫描 {len(stock_codes)} 只股票...")
         
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.thread_workers) as executor:
-            future_to_code = {executor.submit(self.analyze_single_stock, code): code 
-                            for code in stock_codes}
-            
-            for future in concurrent.futures.as_completed(future_to_code):
-                code = future_to_code[future]
-                try:
-                    result = future.result()
-                    if result:
-                        results.append(result)
-                        logging.info(f"股票 {code} 符合条件")
-                except Exception as e:
-                    logging.error(f"处理股票 {code} 时发生错误: {str(e)}")
+        with get_connection() as conn:
+            if workers > 1:
+                hits = run_screen_parallel(conn, self.spec, stock_codes, workers)
+            else:
+                hits = run_screen(conn, self.spec, stock_codes)
+        results = [self._result(row['code'], row['date'].date(), row['close'], row)
+                   for row in hits.to_dict('records')]
+        for result in results:
+            logging.info(f"股票 {result['code']} 符合条件")
         
+        log_pool_stats()
         return pd.DataFrame(results)
 
-    def __del__(self):
-        self.cursor.close()
-        self.conn.close()
-
-if __name__ == '__main__':
-    scanner = StockVolumeScanner(thread_workers=8)  # 使用8个线程
-    results = scanner.scan_volume_patterns()
+def main():
+    parser = argparse.ArgumentParser(description="按VOLUME_SCANNER条件扫描全市场")
+    parser.add_argument('--workers', type=int, default=None, help="screening processes (default SCREEN_CONFIG['workers'])")
+    args = parser.parse_args()
+    scanner = StockVolumeScanner()
+    results = scanner.scan_volume_patterns(args.workers)
     
     if len(results) > 0:
         print(f"\n找到 {len(results)} 只符合条件的股票：")
         print(results.to_string(index=False))
     else:
         print("\n没有找到符合条件的股票。")
+
+if __name__ == '__main__':
+    main()
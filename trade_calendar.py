@@ -0,0 +1,140 @@
+import os
+import bisect
+import logging
+from datetime import date, datetime, timedelta
+import numpy as np
+import pandas as pd
+import baostock as bs
+from config import CALENDAR_CONFIG
+from rate_control import get_default_controller
+
+def _to_date(day):
+    if day is None:
+        return datetime.now().date()
+    if isinstance(day, datetime):
+        return day.date()
+    if isinstance(day, date):
+        return day
+    return datetime.strptime(str(day)[:10], '%Y-%m-%d').date()
+
+class TradeCalendar:
+    """本地缓存的交易日历，覆盖范围到covered_until为止"""
+
+    def __init__(self, trading_days, covered_until):
+        self.days = sorted(trading_days)
+        self.covered_until = covered_until
+        self.days64 = np.array(self.days, dtype='datetime64[D]')
+
+    def _check_covered(self, day):
+        if day > self.covered_until:
+            raise ValueError(f"Trade calendar only covers dates up to {self.covered_until}, got {day}")
+
+    def is_trading_day(self, day=None):
+        day = _to_date(day)
+        self._check_covered(day)
+        i = bisect.bisect_left(self.days, day)
+        return i < len(self.days) and self.days[i] == day
+
+    def latest_trading_day(self, day=None):
+        """day当天或之前最近的一个交易日"""
+        day = _to_date(day)
+        self._check_covered(day)
+        i = bisect.bisect_right(self.days, day)
+        return self.days[i - 1] if i else None
+
+    def next_trading_day(self, day):
+        """day之后的第一个交易日，超出日历范围时返回None"""
+        day = _to_date(day)
+        i = bisect.bisect_right(self.days, day)
+        return self.days[i] if i < len(self.days) else None
+
+    def previous_trading_days(self, n, end=None):
+        """截至end（含）的最近n个交易日，按日期升序"""
+        end = _to_date(end)
+        self._check_covered(end)
+        i = bisect.bisect_right(self.days, end)
+        return self.days[max(0, i - n):i]
+
+    def trading_days_between(self, start, end):
+        """[start, end]区间内的交易日"""
+        start, end = _to_date(start), _to_date(end)
+        return self.days[bisect.bisect_left(self.days, start):bisect.bisect_right(self.days, end)]
+
+    def count_trading_days(self, start, end):
+        """(start, end]区间内的交易日数量"""
+        start, end = _to_date(start), _to_date(end)
+        return bisect.bisect_right(self.days, end) - bisect.bisect_right(self.days, start)
+
+    def window_start(self, n, end=None):
+        """以end为最后一根K线、恰好n根K线的窗口起始日期"""
+        days = self.previous_trading_days(n, end)
+        return days[0] if days else None
+
+def _calendar_path(path=None):
+    return path or CALENDAR_CONFIG['path']
+
+def load_trade_calendar(path=None):
+    """读取本地日历文件，不存在时返回None"""
+    path = _calendar_path(path)
+    if not os.path.exists(path):
+        return None
+    df = pd.read_csv(path, dtype={'calendar_date': str, 'is_trading_day': str})
+    if df.empty:
+        return None
+    trading = df.loc[df['is_trading_day'] == '1', 'calendar_date']
+    return TradeCalendar([_to_date(d) for d in trading], _to_date(df['calendar_date'].iloc[-1]))
+
+def refresh_trade_calendar(until=None, path=None):
+    """增量刷新本地交易日历，一次拉取到until所在年份年底
+
+    需要调用方已经登录baostock。返回刷新后的TradeCalendar。
+    """
+    path = _calendar_path(path)
+    until = _to_date(until)
+    calendar = load_trade_calendar(path)
+    if calendar is not None and calendar.covered_until >= until:
+        return calendar
+
+    start = calendar.covered_until + timedelta(days=1) if calendar else _to_date(CALENDAR_CONFIG['start_date'])
+    end = date(until.year, 12, 31)
+    rs = get_default_controller().call(bs.query_trade_dates, start_date=start.strftime('%Y-%m-%d'),
+                                       end_date=end.strftime('%Y-%m-%d'))
+    data_list = []
+    while (rs.error_code == '0') & rs.next():
+        data_list.append(rs.get_row_data())
+    new_rows = pd.DataFrame(data_list, columns=rs.fields)[['calendar_date', 'is_trading_day']]
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    new_rows.to_csv(path, mode='a', header=not os.path.exists(path), index=False)
+    logging.info(f"Trade calendar refreshed: {start} to {end}, {len(new_rows)} days")
+
+    global _calendar
+    _calendar = load_trade_calendar(path)
+    return _calendar
+
+_calendar = None
+_fallback_warned = False
+
+def get_trade_calendar():
+    """进程内缓存的交易日历，只读本地文件，不会访问baostock"""
+    global _calendar
+    if _calendar is None:
+        _calendar = load_trade_calendar()
+    return _calendar
+
+def window_start_date(n_bars, end=None):
+    """取以end结束、n_bars根K线窗口的起始日期字符串
+
+    本地日历不存在或不覆盖end时，退化为按自然日估算（会多取一些数据）。
+    """
+    end = _to_date(end)
+    calendar = get_trade_calendar()
+    if calendar is not None and calendar.covered_until >= end:
+        start = calendar.window_start(n_bars, end)
+        if start is not None:
+            return start.strftime('%Y-%m-%d')
+    global _fallback_warned
+    if not _fallback_warned:
+        logging.warning("Trade calendar unavailable, estimating window start from calendar days")
+        _fallback_warned = True
+    return (end - timedelta(days=n_bars * 7 // 5 + 10)).strftime('%Y-%m-%d')
@@ -1,118 +1,269 @@
+"""成交额放量检测，结果写入volume_spikes表
+
+某日成交额不低于最近lookback_days日均额（含当日）的volume_threshold倍，且之后post_days日的均额
+高于之前lookback_days日的均额，记为一次放量。
+
+默认增量运行：volume_spike_progress记录每只股票已判定完的最后日期（以及当时的参数），
+只读取该日期之前lookback_days + history_margin根K线以后的数据，按股票分批拼成一维数组，
+用累积和差分一次算出所有行的滚动均额、前后窗口均额，结果与进度在同一事务中批量写入，
+volume_spikes上的(code, spike_date)唯一索引保证重复运行不会产生重复行。
+区间内停牌过久、截断后第一根新K线前不足lookback_days根的股票，本批不推进进度，随后改读完整历史重算。
+参数变化的股票自动从头重算；--full忽略全部进度。
+"""
+import argparse
+import json
+import numpy as np
 import pymysql
-import pandas as pd
 from datetime import datetime
-from config import DB_CONFIG
-
-def get_db_connection():
-    return pymysql.connect(
-        host=DB_CONFIG['host'],
-        port=DB_CONFIG['port'],
-        user=DB_CONFIG['user'],
-        password=DB_CONFIG['password'],
-        database=DB_CONFIG['database']
-    )
+from trade_calendar import window_start_date
+from kline_loader import fetch_columns
+from db_pool import get_connection
+from config import SPIKE_CONFIG
 
 def create_volume_spike_table():
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
     
-    # Create table for volume spikes
-    create_table_sql = """
-    CREATE TABLE IF NOT EXISTS volume_spikes (
-        id INT AUTO_INCREMENT PRIMARY KEY,
-        code VARCHAR(10) NOT NULL,
-        spike_date DATE NOT NULL,
-        pre_avg_amount DECIMAL(20,2),
-        spike_amount DECIMAL(20,2),
-        amount_ratio DECIMAL(10,2),
-        post_avg_amount DECIMAL(20,2),
-        post_amount_ratio DECIMAL(10,2),
-        close_price DECIMAL(10,2),
-        update_time DATETIME,
-        INDEX idx_code_date (code, spike_date)
-    )
+        # Create table for volume spikes
+        create_table_sql = """
+        CREATE TABLE IF NOT EXISTS volume_spikes (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            code VARCHAR(10) NOT NULL,
+            spike_date DATE NOT NULL,
+            pre_avg_amount DECIMAL(20,2),
+            spike_amount DECIMAL(20,2),
+            amount_ratio DECIMAL(10,2),
+            post_avg_amount DECIMAL(20,2),
+            post_amount_ratio DECIMAL(10,2),
+            close_price DECIMAL(10,2),
+            update_time DATETIME,
+            UNIQUE KEY uk_code_spike (code, spike_date)
+        )
+        """
+        cursor.execute(create_table_sql)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS volume_spike_progress (
+            code VARCHAR(10) PRIMARY KEY,
+            last_date DATE NOT NULL,
+            params VARCHAR(100) NOT NULL,
+            update_time DATETIME
+        )
+        """)
+        conn.commit()
+        ensure_spike_unique_key(conn)
+    finally:
+        conn.close()
+
+def ensure_spike_unique_key(conn):
+    """旧表只有普通索引idx_code_date，且每次运行都会重复插入：保留每组(code, spike_date)中最新的一行后加唯一索引"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SHOW INDEX FROM volume_spikes WHERE Key_name = 'uk_code_spike'")
+        if cursor.fetchall():
+            return
+        cursor.execute("""
+        DELETE v FROM volume_spikes v
+        JOIN volume_spikes newer
+          ON newer.code = v.code AND newer.spike_date = v.spike_date AND newer.id > v.id
+        """)
+        removed = cursor.rowcount
+        cursor.execute("SHOW INDEX FROM volume_spikes WHERE Key_name = 'idx_code_date'")
+        drop_old = ", DROP INDEX idx_code_date" if cursor.fetchall() else ""
+        cursor.execute(f"ALTER TABLE volume_spikes ADD UNIQUE KEY uk_code_spike (code, spike_date){drop_old}")
+        conn.commit()
+        print(f"volume_spikes: removed {removed} duplicate rows, added unique key (code, spike_date)")
+    finally:
+        cursor.close()
+
+def _params_key(lookback_days, post_days, volume_threshold):
+    return json.dumps([lookback_days, post_days, volume_threshold])
+
+def _load_progress(conn, params):
+    """{code: 已判定完的最后日期}，参数不同的记录视为没有进度"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT code, last_date, params FROM volume_spike_progress")
+    progress = {code: np.datetime64(last_date, 'D') for code, last_date, saved in cursor.fetchall() if saved == params}
+    cursor.close()
+    return progress
+
+def _load_batch(conn, codes, start_date):
+    placeholders = ', '.join(['%s'] * len(codes))
+    sql = f"SELECT code, date, amount, close FROM stock_kline WHERE code IN ({placeholders})"
+    params = list(codes)
+    if start_date is not None:
+        sql += " AND date >= %s"
+        params.append(start_date)
+    return fetch_columns(conn, sql + " ORDER BY code, date", params, ['code', 'date', 'amount', 'close'])
+
+def detect_spikes(data, last_done, lookback_days, post_days, volume_threshold, windowed=False):
+    """在按(code, date)排序的一批数据上向量化检测放量
+
+    last_done为{code: 日期}，只返回晚于该日期的放量。windowed=False表示读的是完整历史，
+    与原逐只计算的口径相同（前窗口在历史开头可以不满lookback_days根）；windowed=True表示数据从某个日期截断，
+    此时前窗口必须完整，第一根新K线的窗口被截断的股票（区间内停牌过久）放进short，不检测也不推进进度，
+    由调用方改读完整历史重算。成交额缺失（NULL）的K线与pandas一样：含它的滚动均额为NaN，前后窗口均额跳过它。
+    返回(放量行下标, 各列指标, {code: 新的已判定日期}, short)。
     """
-    cursor.execute(create_table_sql)
-    conn.commit()
-    conn.close()
+    codes, dates = data['code'], data['date']
+    amount = np.asarray(data['amount'], dtype='float64')
+    n = len(codes)
+    if n == 0:
+        return np.array([], dtype='int64'), {}, {}, []
+    # 每行所在股票的首行和末行下标
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    ends = np.r_[starts[1:], n] - 1
+    sizes = ends - starts + 1
+    group_start = np.repeat(starts, sizes)
+    group_end = np.repeat(ends, sizes)
+    group_codes = codes[starts]
+    done = np.array([last_done.get(code, np.datetime64('NaT')) for code in group_codes], dtype='datetime64[D]')
+    after_done = np.where(np.repeat(np.isnat(done), sizes), True, dates > np.repeat(done, sizes))
 
-def analyze_volume_spikes(lookback_days=10, post_days=5, volume_threshold=3.0):
-    conn = get_db_connection()
-    
-    # Get all stock codes
+    i = np.arange(n)
+    valid = ~np.isnan(amount)
+    cumulative = np.r_[0.0, np.cumsum(np.where(valid, amount, 0.0))]
+    counts = np.r_[0, np.cumsum(valid)]
+    # 含当日的lookback_days日均额，窗口内有缺失时为NaN
+    rolling_lo = np.maximum(i - lookback_days + 1, 0)
+    rolling_ok = (i - lookback_days + 1 >= group_start) & (counts[i + 1] - counts[rolling_lo] == lookback_days)
+    rolling_avg = np.where(rolling_ok, (cumulative[i + 1] - cumulative[rolling_lo]) / lookback_days, np.nan)
+    # 之前lookback_days日均额（跳过缺失）
+    pre_lo = np.maximum(group_start, i - lookback_days)
+    pre_full = i - pre_lo == lookback_days
+    pre_count = counts[i] - counts[pre_lo]
+    pre_ok = (pre_count > 0) & (pre_full | (not windowed))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pre_avg = np.where(pre_ok, (cumulative[i] - cumulative[pre_lo]) / pre_count, np.nan)
+        ratio = amount / rolling_avg
+    # 之后post_days日均额（跳过缺失）
+    post_hi = np.minimum(i + post_days, n - 1) + 1
+    post_count = counts[post_hi] - counts[i + 1]
+    post_ok = (i + post_days <= group_end) & (post_count > 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        post_avg = np.where(post_ok, (cumulative[post_hi] - cumulative[i + 1]) / post_count, np.nan)
+
+    # 截断读取时，第一根新K线之前不足lookback_days根的股票整只改读完整历史
+    short = []
+    if windowed:
+        cut = np.zeros(len(starts), dtype=bool)
+        new_rows = np.flatnonzero(after_done)
+        if len(new_rows):
+            group_of = np.repeat(np.arange(len(starts)), sizes)
+            first_new = new_rows[np.r_[True, group_of[new_rows[1:]] != group_of[new_rows[:-1]]]]
+            cut[group_of[first_new]] = first_new - lookback_days < starts[group_of[first_new]]
+        short = list(group_codes[cut])
+        keep = ~np.repeat(cut, sizes)
+    else:
+        keep = np.ones(n, dtype=bool)
+
+    with np.errstate(invalid='ignore'):
+        hits = np.flatnonzero(keep & rolling_ok & pre_ok & post_ok & after_done
+                              & (ratio >= volume_threshold) & (post_avg > pre_avg))
+    metrics = {
+        'pre_avg_amount': pre_avg[hits],
+        'spike_amount': amount[hits],
+        'amount_ratio': ratio[hits],
+        'post_avg_amount': post_avg[hits],
+        'close_price': data['close'][hits],
+    }
+    # 后窗口已完整的最后一天；历史不足post_days + 1根的股票、需要重算的股票不推进
+    decided = ends - post_days
+    short_set = set(short)
+    new_done = {code: dates[k] for code, k, start in zip(group_codes, decided, starts)
+                if k >= start and code not in short_set}
+    return hits, metrics, new_done, short
+
+def _save(conn, data, hits, metrics, new_done, params):
+    now = datetime.now()
+    rows = [(str(data['code'][k]), str(data['date'][k]), float(pre), float(spike), float(ratio),
+             float(post), float(post / pre), float(close), now)
+            for k, pre, spike, ratio, post, close in zip(hits, metrics['pre_avg_amount'], metrics['spike_amount'],
+                                                         metrics['amount_ratio'], metrics['post_avg_amount'],
+                                                         metrics['close_price'])]
     cursor = conn.cursor()
-    cursor.execute("SELECT DISTINCT code FROM stock_kline")
-    stock_codes = [row[0] for row in cursor.fetchall()]
-    
-    # Create volume_spikes table if not exists
+    try:
+        if rows:
+            cursor.executemany("""
+            INSERT INTO volume_spikes
+            (code, spike_date, pre_avg_amount, spike_amount, amount_ratio,
+             post_avg_amount, post_amount_ratio, close_price, update_time)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                pre_avg_amount = VALUES(pre_avg_amount), spike_amount = VALUES(spike_amount),
+                amount_ratio = VALUES(amount_ratio), post_avg_amount = VALUES(post_avg_amount),
+                post_amount_ratio = VALUES(post_amount_ratio), close_price = VALUES(close_price),
+                update_time = VALUES(update_time)
+            """, rows)
+        if new_done:
+            cursor.executemany("""
+            INSERT INTO volume_spike_progress (code, last_date, params, update_time)
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE last_date = VALUES(last_date), params = VALUES(params),
+                update_time = VALUES(update_time)
+            """, [(code, str(day), params, now) for code, day in new_done.items()])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return len(rows)
+
+def _process(conn, chunk, start_date, progress, params, lookback_days, post_days, volume_threshold):
+    """检测并保存一批股票，返回(写入的放量数, 需要读完整历史重算的股票)"""
+    try:
+        data = _load_batch(conn, chunk, start_date)
+        hits, metrics, new_done, short = detect_spikes(data, progress, lookback_days, post_days, volume_threshold,
+                                                       windowed=start_date is not None)
+        return _save(conn, data, hits, metrics, new_done, params), short
+    except pymysql.err.Error as e:
+        print(f"Error processing {chunk[0]}..{chunk[-1]}: {str(e)}")
+        return 0, []
+
+def analyze_volume_spikes(lookback_days=10, post_days=5, volume_threshold=3.0, full=False):
     create_volume_spike_table()
-    
-    for code in stock_codes:
-        try:
-            # Get k-line data for this stock
-            query = f"""
-            SELECT date, amount, close 
-            FROM stock_kline 
-            WHERE code = '{code}'
-            ORDER BY date
-            """
-            df = pd.read_sql(query, conn)
-            
-            if len(df) < lookback_days + post_days:
-                continue
-                
-            # Calculate rolling average volume
-            df['rolling_avg_amount'] = df['amount'].rolling(window=lookback_days, min_periods=lookback_days).mean()
-            
-            # Find volume spikes
-            df['amount_ratio'] = df['amount'] / df['rolling_avg_amount']
-            
-            # Get dates where volume is 3x the average
-            spike_dates = df[df['amount_ratio'] >= volume_threshold].index
-            
-            for spike_idx in spike_dates:
-                if spike_idx + post_days >= len(df):
-                    continue
-                    
-                spike_row = df.iloc[spike_idx]
-                
-                # Calculate average volume after spike
-                post_period = df.iloc[spike_idx + 1:spike_idx + post_days + 1]
-                pre_period = df.iloc[max(0, spike_idx - lookback_days):spike_idx]
-                
-                post_avg_amount = post_period['amount'].mean()
-                pre_avg_amount = pre_period['amount'].mean()
-                
-                # Only consider if post-spike volume remains higher than pre-spike
-                if post_avg_amount > pre_avg_amount:
-                    # Insert into volume_spikes table
-                    insert_sql = """
-                    INSERT INTO volume_spikes 
-                    (code, spike_date, pre_avg_amount, spike_amount, amount_ratio,
-                     post_avg_amount, post_amount_ratio, close_price, update_time)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    """
-                    
-                    cursor.execute(insert_sql, (
-                        code,
-                        df.iloc[spike_idx]['date'],
-                        float(pre_avg_amount),
-                        float(spike_row['amount']),
-                        float(spike_row['amount_ratio']),
-                        float(post_avg_amount),
-                        float(post_avg_amount / pre_avg_amount),
-                        float(spike_row['close']),
-                        datetime.now()
-                    ))
-                    conn.commit()
-            
-            print(f"Processed {code}")
-            
-        except Exception as e:
-            print(f"Error processing {code}: {str(e)}")
-            continue
-    
-    conn.close()
+    params = _params_key(lookback_days, post_days, volume_threshold)
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT code FROM stock_kline")
+        stock_codes = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+        progress = {} if full else _load_progress(conn, params)
+
+        # 没有进度的股票读全部历史；有进度的按进度日期排序分批，同批的起始日期相近
+        fresh = [code for code in stock_codes if code not in progress]
+        tracked = sorted((code for code in stock_codes if code in progress), key=progress.get)
+        batch = SPIKE_CONFIG['code_batch']
+        total = 0
+        for group, incremental in ((fresh, False), (tracked, True)):
+            retry = []
+            for i in range(0, len(group), batch):
+                chunk = group[i:i + batch]
+                start_date = None
+                if incremental:
+                    earliest = min(progress[code] for code in chunk)
+                    start_date = window_start_date(lookback_days + SPIKE_CONFIG['history_margin'], earliest.item())
+                saved, short = _process(conn, chunk, start_date, progress, params,
+                                        lookback_days, post_days, volume_threshold)
+                total += saved
+                retry += short
+                print(f"Processed {i + len(chunk)}/{len(group)} {'incremental' if incremental else 'full-history'} "
+                      f"codes, {saved} spikes upserted")
+            # 截断窗口内停牌过久的股票改读完整历史
+            for i in range(0, len(retry), batch):
+                chunk = retry[i:i + batch]
+                saved, _ = _process(conn, chunk, None, progress, params, lookback_days, post_days, volume_threshold)
+                total += saved
+                print(f"Reprocessed {i + len(chunk)}/{len(retry)} codes with suspensions from full history, "
+                      f"{saved} spikes upserted")
+        print(f"Done: {total} spikes upserted")
+    finally:
+        conn.close()
 
 if __name__ == "__main__":
-    analyze_volume_spikes()
+    parser = argparse.ArgumentParser(description="Detect volume spikes into the volume_spikes table")
+    parser.add_argument('--full', action='store_true', help="ignore saved progress and rescan every code's full history")
+    args = parser.parse_args()
+    analyze_volume_spikes(full=args.full)
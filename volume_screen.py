@@ -1,12 +1,14 @@
-import pymysql
+import sys
 import pandas as pd
 from config import DB_CONFIG
-from datetime import datetime, timedelta
-import threading
+from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor
 import logging
 from queue import Queue
 import time
+from trade_calendar import window_start_date
+from db_pool import get_connection
+from screen_rules import run_screen, screen_frame, VOLUME_SCREEN
 
 # 设置日志配置
 logging.basicConfig(
@@ -22,23 +24,17 @@ def connect_database():
     """连接到MySQL数据库"""
     logging.info(f"正在连接到数据库 {DB_CONFIG['host']}:{DB_CONFIG['port']}")
     try:
-        conn = pymysql.connect(
-            host=DB_CONFIG['host'],
-            port=DB_CONFIG['port'],
-            user=DB_CONFIG['user'],
-            password=DB_CONFIG['password'],
-            database=DB_CONFIG['database']
-        )
+        conn = get_connection()
         logging.info("数据库连接成功")
         return conn
     except Exception as e:
         logging.error(f"数据库连接失败: {str(e)}")
         raise
 
-def get_stock_data(conn, stock_code, days=25):
-    """从stock_kline表获取指定股票的历史数据"""
+def get_stock_data(conn, stock_code, bars=17):
+    """从stock_kline表获取指定股票最近bars个交易日的数据"""
     end_date = datetime.now().strftime('%Y-%m-%d')
-    start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+    start_date = window_start_date(bars)
     
     logging.info(f"获取股票 {stock_code} 的数据 - 时间范围: {start_date} 到 {end_date}")
     
@@ -82,54 +78,15 @@ def get_stock_name(conn, stock_code):
         cursor.close()
 
 def check_volume_conditions(df):
-    """检查交易量是否满足条件"""
+    """检查交易量是否满足条件（规则见screen_rules.VOLUME_SCREEN）"""
     stock_code = df['code'].iloc[0] if not df.empty else 'unknown'
-    logging.debug(f"开始检查股票 {stock_code} 的交易量条件")
-    
-    if len(df) < 17:  # 确保有足够的数据
-        logging.debug(f"股票 {stock_code} 数据量不足: 只有 {len(df)} 条记录，需要至少17条")
+    metrics = screen_frame(VOLUME_SCREEN, df)
+    if metrics is None:
+        logging.debug(f"股票 {stock_code} 未满足交易量条件（数据 {len(df)} 条）")
         return False
-    
-    # 获取最近2天的数据
-    recent_2days = df.iloc[-2:]
-    
-    # 获取之前的数据（3-17天）
-    previous_days = df.iloc[-17:-2]
-    
-    # 条件1：之前的交易量较少（使用平均值作为基准）
-    avg_volume_previous = previous_days['amount'].mean()
-    std_volume_previous = previous_days['amount'].std()
-    relative_std = std_volume_previous / avg_volume_previous
-    
-    logging.debug(f"股票 {stock_code} 历史交易量分析:")
-    logging.debug(f"- 平均值: {avg_volume_previous:,.2f}")
-    logging.debug(f"- 标准差: {std_volume_previous:,.2f}")
-    logging.debug(f"- 相对标准差: {relative_std:.2f}")
-    
-    # 检查之前的交易量是否不活跃（波动较小）
-    if relative_std > 0.8:  # 相对标准差阈值
-        logging.debug(f"股票 {stock_code} 相对标准差 {relative_std:.2f} > 0.8，波动性过大")
-        return False
-    
-    # 条件2：最近2天的交易量都要大于之前平均值的3倍
-    volume_threshold = avg_volume_previous * 3
-    recent_volumes = recent_2days['amount'].values
-    logging.debug(f"股票 {stock_code} 最近两天交易量分析:")
-    logging.debug(f"- 最近两天交易量: {recent_volumes[0]:,.2f}, {recent_volumes[1]:,.2f}")
-    logging.debug(f"- 需超过阈值(3倍均值): {volume_threshold:,.2f}")
-    
-    if not all(recent_2days['amount'] > volume_threshold):
-        logging.debug(f"股票 {stock_code} 最近两天的交易量未能超过阈值")
-        return False
-    
-    # 条件3：最近2天的交易量保持增长
-    if not recent_volumes[0] < recent_volumes[1]:
-        logging.debug(f"股票 {stock_code} 最近两天交易量未保持增长: {recent_volumes[0]:,.2f} -> {recent_volumes[1]:,.2f}")
-        return False
-    
     logging.info(f"股票 {stock_code} 满足所有交易量条件！")
-    logging.info(f"- 过去平均交易量: {avg_volume_previous:,.2f}")
-    logging.info(f"- 最近两天交易量: {recent_volumes[0]:,.2f} -> {recent_volumes[1]:,.2f}")
+    logging.info(f"- 过去平均交易量: {metrics['baseline']:,.2f}")
+    logging.info(f"- 相对标准差: {metrics['cv']:.2f}, 放量倍数: {metrics['surge_ratio']:.2f}")
     return True
 
 def save_results(conn, stock_code, scan_date):
@@ -152,6 +109,28 @@ def save_results(conn, stock_code, scan_date):
     finally:
         cursor.close()
 
+def save_results_bulk(conn, stock_codes, scan_date):
+    """一次查询股票名称，一个事务批量写入所有筛选结果"""
+    if not stock_codes:
+        return
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SHOW COLUMNS FROM stock_codes")
+        columns = [col[0] for col in cursor.fetchall()]
+        name_column = 'stock_name' if 'stock_name' in columns else 'code_name'
+        placeholders = ', '.join(['%s'] * len(stock_codes))
+        cursor.execute(f"SELECT code, {name_column} FROM stock_codes WHERE code IN ({placeholders})", stock_codes)
+        names = dict(cursor.fetchall())
+        sql = "INSERT INTO volume_screen_results (stock_code, stock_name, scan_date) VALUES (%s, %s, %s)"
+        cursor.executemany(sql, [(code, names.get(code) or code, scan_date) for code in stock_codes])
+        conn.commit()
+        logging.info(f"成功保存 {len(stock_codes)} 只股票的筛选结果")
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"批量保存筛选结果时出错: {str(e)}")
+    finally:
+        cursor.close()
+
 def get_all_stock_codes(conn):
     """获取所有股票代码"""
     query = "SELECT DISTINCT code FROM stock_kline"
@@ -161,24 +140,23 @@ def get_all_stock_codes(conn):
 def process_stock(stock_code, scan_date, progress_queue):
     """处理单个股票的函数"""
     try:
-        conn = connect_database()
-        df = get_stock_data(conn, stock_code)
-        
-        if check_volume_conditions(df):
-            save_results(conn, stock_code, scan_date)
-            logging.info(f"找到符合条件的股票: {stock_code}")
-        
-        progress_queue.put(1)  # 用于进度追踪
-        conn.close()
+        with connect_database() as conn:
+            df = get_stock_data(conn, stock_code)
+            
+            if check_volume_conditions(df):
+                save_results(conn, stock_code, scan_date)
+                logging.info(f"找到符合条件的股票: {stock_code}")
         
     except Exception as e:
         logging.error(f"处理股票 {stock_code} 时出错: {str(e)}")
-        progress_queue.put(1)
+    finally:
+        progress_queue.put(1)  # 用于进度追踪
 
-def main():
+def main(bulk=True):
     logging.info("开始筛选股票...")
     start_time = time.time()
     
+    conn = None
     try:
         # 连接数据库
         conn = connect_database()
@@ -207,6 +185,16 @@ def main():
         cursor.close()
         logging.info("已清空历史筛选结果")
         
+        if bulk:
+            # 批量模式：少量区间查询取回全部数据，向量化检查，一次写入结果
+            hits = run_screen(conn, VOLUME_SCREEN, stock_codes)['code'].tolist()
+            logging.info(f"批量检查 {len(stock_codes)} 只股票，{len(hits)} 只满足所有交易量条件")
+            save_results_bulk(conn, hits, scan_date)
+            for stock_code in hits:
+                logging.info(f"找到符合条件的股票: {stock_code}")
+            logging.info(f"筛选完成！总用时: {time.time() - start_time:.2f}秒")
+            return
+        
         # 创建进度队列
         progress_queue = Queue()
         processed_count = 0
@@ -233,6 +221,9 @@ def main():
         
     except Exception as e:
         logging.error(f"程序执行出错: {str(e)}")
+    finally:
+        if conn is not None:
+            conn.close()
 
 if __name__ == "__main__":
-    main()
+    main(bulk='--per-stock' not in sys.argv[1:])